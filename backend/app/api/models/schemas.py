@@ -23,6 +23,68 @@ class AnalysisResult(BaseModel):
     confidence: float
     recommendation: str
     timestamp: str # ISO 8601 format string
+    # Registry version of the model that produced the prediction
+    model_version: Optional[str] = None
+
+class TiledAnalysisResult(BaseModel):
+    """Response model for tile-by-tile analysis of a large RGB image (e.g. a field orthomosaic)."""
+    upload_id: str
+    image_width: int
+    image_height: int
+    tile_size: int
+    stride: int
+    rows: int
+    cols: int
+    class_names: List[str]
+    # Predicted class index and confidence per tile, indexed [row][col]
+    class_grid: List[List[int]]
+    confidence_grid: List[List[float]]
+    class_counts: Dict[str, int]
+    diseased_fraction: float
+    recommendations: Dict[str, str]
+    overlay_path: Optional[str] = None
+    model_version: Optional[str] = None
+    timestamp: str = ""
+
+class RiskMapWindow(BaseModel):
+    """Response model for a window of the stored risk and confidence maps."""
+    upload_id: str
+    # Window in scene pixels; the maps have one value per scale x scale block
+    x: int
+    y: int
+    width: int
+    height: int
+    scale: int
+    class_names: List[str]
+    # Class index and confidence, indexed [row][col]
+    risk_map: List[List[int]]
+    confidence_map: List[List[float]]
+
+class BatchAnalysisRequest(BaseModel):
+    """Request model for analyzing many uploads in one call."""
+    upload_ids: List[str] = []
+    # Optional manifest file under data/ listing upload IDs (one per line, or a JSON list)
+    manifest_path: Optional[str] = None
+
+class BatchAnalysisError(BaseModel):
+    """Line emitted by the batch endpoint for an upload that could not be analyzed."""
+    upload_id: str
+    error: str
+
+class JobStatus(BaseModel):
+    """Status of a background analysis job."""
+    job_id: str
+    kind: str  # "risk" or "spectral"
+    status: str  # "queued", "running", "succeeded", "failed", "cancelled" or "timed_out"
+    progress: float  # Percent complete
+    message: Optional[str] = None
+    params: Dict[str, Any] = {}
+    error: Optional[str] = None
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    # The analysis result once the job has succeeded
+    result: Optional[Dict[str, Any]] = None
 
 class ErrorResponse(BaseModel):
     """Response model for errors."""
@@ -34,6 +96,7 @@ class SpectralAnalysisResponse(BaseModel):
     file_info: Dict[str, Any]
     indices: Dict[str, Any]  # Contains NDVI, NDRE, MSI, SAVI data
     health_map_path: Optional[str] = None
+    index_rasters: Optional[Dict[str, str]] = None  # GeoTIFF path of each index, if requested
     timestamp: str = ""
 
 class TrendDataPoint(BaseModel):
@@ -0,0 +1,65 @@
+# backend/app/api/routes/admin.py
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+from app.core import model_loader
+from app.core.analysis_pipeline import analysis_pipeline
+from app.core.job_queue import job_queue
+from app.core.raster_cache import raster_cache
+from app.core.model_registry import list_versions, version_exists
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+@router.get("/admin/models")
+async def get_models():
+    """
+    Lists the registered model versions, the active one and the state of the latest rollout.
+    """
+    try:
+        return {
+            "active_version": model_loader.get_active_version(),
+            "versions": list_versions(),
+            "rollout": model_loader.get_rollout_status(),
+        }
+    except Exception as e:
+        logger.error(f"Error listing model versions: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to list model versions: {str(e)}")
+
+@router.post("/admin/models/{version}/activate", status_code=202)
+async def activate_model(version: str):
+    """
+    Starts a zero-downtime rollout of a model version. The version is loaded and
+    warmed up in the background while the current one keeps serving, then swapped in.
+    Poll GET /api/admin/models for the rollout status.
+    """
+    if not version_exists(version):
+        raise HTTPException(status_code=404, detail=f"Model version {version} not found.")
+    if not model_loader.start_rollout(version):
+        raise HTTPException(status_code=409, detail="Another model rollout is in progress.")
+    logger.info(f"Started rollout of model version {version}")
+    return JSONResponse(status_code=202, content=model_loader.get_rollout_status())
+
+@router.get("/admin/pipeline")
+async def get_pipeline_metrics():
+    """
+    Returns the batch analysis pipeline configuration and the per-stage
+    utilization of its most recent run.
+    """
+    return analysis_pipeline.metrics()
+
+@router.get("/admin/jobs")
+async def get_job_queue_stats():
+    """
+    Returns the job queue settings and the number of jobs in each state.
+    """
+    return await asyncio.to_thread(job_queue.stats)
+
+@router.get("/admin/raster-cache")
+async def get_raster_cache_stats():
+    """
+    Returns the hit/miss counts and memory use of the derived-raster cache.
+    """
+    return raster_cache.stats()
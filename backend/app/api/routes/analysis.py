@@ -1,23 +1,112 @@
 # backend/app/api/routes/analysis.py
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from app.api.models.schemas import AnalysisResult, ErrorResponse, AlertResponse
-from app.core.ai_predictor import run_analysis
-from app.core.risk_detector import risk_detector
-from app.utils.file_handler import load_result_json
-from app.core.spectral_processor import spectral_processor
+from app.api.models.schemas import AnalysisResult, ErrorResponse, AlertResponse, BatchAnalysisRequest, BatchAnalysisError, TiledAnalysisResult, RiskMapWindow, JobStatus
+from app.core.ai_predictor import run_analysis_async
+from app.core.analysis_pipeline import analysis_pipeline, PipelineRun
+from app.core.risk_detector import risk_detector, RISK_STREAMING_MB
+from app.core.hyperspectral_cube import open_cube
+from app.core.risk_maps import save_risk_maps, read_risk_window, get_risk_raster_path, MAX_WINDOW_SIZE
+from app.core.tiled_analysis import run_tiled_analysis, get_tiles_result_path
+from app.utils.file_handler import load_result_json, load_manifest_ids
+from app.core.worker_pool import worker_pool, WorkerPoolFullError
+from app.core.job_queue import job_queue, JobContext, JobQueueFullError
+import asyncio
 import uuid
 import logging
 import os
 import json
 import numpy as np
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Callable, Optional
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+def _ndjson_line(item: BaseModel) -> str:
+    """Serializes one model as a newline-delimited JSON record."""
+    return item.model_dump_json() + "\n"
+
+def _partition_batch(upload_ids: List[str]):
+    """Splits upload IDs into ready NDJSON lines (invalid IDs, existing results) and IDs still to analyze."""
+    ready, pending = [], []
+    for upload_id in upload_ids:
+        try:
+            uuid.UUID(upload_id)
+        except ValueError:
+            ready.append(_ndjson_line(BatchAnalysisError(upload_id=upload_id, error="Invalid upload ID format.")))
+            continue
+
+        if os.path.exists(os.path.join("data", "results", f"{upload_id}.json")):
+            try:
+                result_data = load_result_json(upload_id)
+                if 'timestamp' not in result_data:
+                    result_data['timestamp'] = datetime.utcnow().isoformat() + "Z"
+                ready.append(_ndjson_line(AnalysisResult(**result_data)))
+                continue
+            except Exception as e:
+                logger.error(f"Error loading existing result for {upload_id}: {e}")
+        pending.append(upload_id)
+    return ready, pending
+
+async def _stream_batch_results(ready: List[str], run: Optional[PipelineRun]) -> AsyncIterator[str]:
+    """
+    Yields the ready NDJSON lines, then one line per upload of the pipeline run,
+    which preprocesses upcoming uploads while the model runs on batches of up to
+    BATCH_ANALYSIS_SIZE.
+    """
+    try:
+        for line in ready:
+            yield line
+        if run is None:
+            return
+        while True:
+            entry = await asyncio.to_thread(run.next_result)
+            if entry is None:
+                break
+            if "error" in entry:
+                yield _ndjson_line(BatchAnalysisError(**entry))
+            else:
+                entry['timestamp'] = datetime.utcnow().isoformat() + "Z"
+                yield _ndjson_line(AnalysisResult(**entry))
+    finally:
+        # Client went away: stop decoding and inference for the remaining uploads
+        if run is not None:
+            run.close()
+
+@router.post("/analyze/batch")
+async def analyze_batch(request: BatchAnalysisRequest):
+    """
+    Analyze many uploads in one call.
+    Results are streamed back as newline-delimited JSON (one AnalysisResult or
+    BatchAnalysisError per line) as soon as each batch finishes.
+    """
+    upload_ids = list(request.upload_ids)
+    if request.manifest_path:
+        try:
+            upload_ids.extend(load_manifest_ids(request.manifest_path))
+        except (ValueError, FileNotFoundError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # Drop duplicates but keep the requested order
+    upload_ids = list(dict.fromkeys(upload_ids))
+    if not upload_ids:
+        raise HTTPException(status_code=400, detail="No upload IDs given.")
+
+    logger.info(f"Starting batch analysis for {len(upload_ids)} upload(s)")
+    ready, pending = _partition_batch(upload_ids)
+    run = None
+    if pending:
+        # Started before streaming so a busy server can still answer 503
+        try:
+            run = analysis_pipeline.run(pending)
+        except WorkerPoolFullError as e:
+            logger.warning(f"Rejected batch analysis: {e}")
+            raise HTTPException(status_code=503, detail="Server is busy. Please retry shortly.")
+    return StreamingResponse(_stream_batch_results(ready, run), media_type="application/x-ndjson")
+
 @router.post("/analyze/{upload_id}", response_model=AnalysisResult)
 async def analyze_image(upload_id: str):
     """
@@ -48,17 +137,56 @@ async def analyze_image(upload_id: str):
 
     # If result doesn't exist, run the analysis
     try:
-        # Call the core analysis function
-        result = run_analysis(upload_id)
+        # Call the core analysis function (batched with concurrent requests)
+        result = await run_analysis_async(upload_id)
         # Add timestamp to the result
         result['timestamp'] = datetime.utcnow().isoformat() + "Z"
         logger.info(f"Analysis completed for upload_id {upload_id}. Result: {result}")
         return AnalysisResult(**result)
+    except WorkerPoolFullError as e:
+        logger.warning(f"Rejected analysis for upload_id {upload_id}: {e}")
+        raise HTTPException(status_code=503, detail="Server is busy. Please retry shortly.")
     except Exception as e:
         logger.error(f"Error during analysis for upload_id {upload_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
 
+@router.post("/analyze/{upload_id}/tiles", response_model=TiledAnalysisResult)
+async def analyze_image_tiles(upload_id: str):
+    """
+    Analyze a large RGB image (e.g. a stitched field orthomosaic) tile by tile.
+    Returns a per-tile class/confidence grid and a rendered overlay instead of a single label.
+    """
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid upload ID format.")
+
+    result_file_path = get_tiles_result_path(upload_id)
+    if os.path.exists(result_file_path):
+        logger.info(f"Tiled result for upload_id {upload_id} already exists. Loading from file.")
+        try:
+            with open(result_file_path, 'r') as f:
+                result_data = json.load(f)
+            result_data.setdefault('timestamp', datetime.utcnow().isoformat() + "Z")
+            return TiledAnalysisResult(**result_data)
+        except Exception as e:
+            logger.error(f"Error loading existing tiled result for {upload_id}: {e}")
+
+    try:
+        result = await worker_pool.run(run_tiled_analysis, upload_id)
+        result['timestamp'] = datetime.utcnow().isoformat() + "Z"
+        logger.info(f"Tiled analysis completed for upload_id {upload_id}: {result['class_counts']}")
+        return TiledAnalysisResult(**result)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Uploaded image not found for the given upload ID.")
+    except WorkerPoolFullError as e:
+        logger.warning(f"Rejected tiled analysis for upload_id {upload_id}: {e}")
+        raise HTTPException(status_code=503, detail="Server is busy. Please retry shortly.")
+    except Exception as e:
+        logger.error(f"Error during tiled analysis for upload_id {upload_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Tiled analysis failed: {str(e)}")
+
 @router.get("/results/{upload_id}", response_model=AnalysisResult)
 async def get_result(upload_id: str):
     """
@@ -82,10 +210,81 @@ async def get_result(upload_id: str):
         logger.error(f"Error loading result for {upload_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to load result.")
 
+def _find_risk_cube(upload_id: str) -> Optional[str]:
+    """Path of the ENVI cube uploaded for risk analysis, or None."""
+    # In MVP, we assume spectral data is stored in a specific format
+    for extension in (".dat", ".hdr"):  # ENVI data or header file
+        data_path = os.path.join("data", "uploads", f"{upload_id}{extension}")
+        if os.path.exists(data_path):
+            return data_path
+    return None
+
+def _run_risk_analysis(upload_id: str, data_path: str,
+                       progress: Optional[Callable[[float, Optional[str]], None]] = None) -> Dict[str, Any]:
+    """
+    Opens the hyperspectral cube, runs risk detection and saves the results.
+    Cubes above RISK_STREAMING_MB are processed tile by tile from disk.
+    The risk and confidence maps are stored as a compressed GeoTIFF; the JSON
+    result keeps the alerts and summaries and points to the map endpoint.
+    This is CPU and IO heavy, so it is run on the worker pool or as a job.
+    progress(fraction, message), if given, is called as the analysis advances.
+    """
+    report = progress or (lambda fraction, message=None: None)
+    # Detection is most of the work; saving the maps is the last 10%
+    detection_progress = lambda fraction: report(0.9 * fraction)
+    with open_cube(data_path) as cube:
+        report(0.0, f"Detecting risk zones in a {cube.height}x{cube.width}x{cube.bands} cube")
+        if cube.float32_nbytes > RISK_STREAMING_MB * 1024 * 1024:
+            risk_results = risk_detector.detect_risk_zones_streaming(
+                cube, os.path.join("data", "results", upload_id), detection_progress)
+        else:
+            # Run risk detection on the spectral data; the cube is read tile by tile
+            risk_results = risk_detector.detect_risk_zones(cube, detection_progress)
+        metadata = cube.metadata
+
+    report(0.9, "Saving risk maps")
+    risk_map = risk_results.pop("risk_map")
+    confidence_map = risk_results.pop("confidence_map")
+    scratch_paths = [risk_results.pop(key) for key in ("risk_map_path", "confidence_map_path") if key in risk_results]
+    try:
+        risk_results["map_summary"] = save_risk_maps(upload_id, risk_map, confidence_map, risk_detector.class_names,
+                                                     metadata.get("transform"), metadata.get("crs"))
+    finally:
+        # Streamed maps are scratch .npy files; the GeoTIFF replaces them
+        del risk_map, confidence_map
+        for path in scratch_paths:
+            os.remove(path)
+    risk_results["risk_map_url"] = f"/api/risk-map/{upload_id}"
+
+    # Save risk analysis results
+    risk_result_file_path = os.path.join("data", "results", f"{upload_id}_risk.json")
+    os.makedirs(os.path.dirname(risk_result_file_path), exist_ok=True)
+
+    with open(risk_result_file_path, 'w') as f:
+        json.dump(risk_results, f, indent=2)
+
+    return {
+        "upload_id": upload_id,
+        "risk_analysis": risk_results,
+        "result_path": risk_result_file_path,
+        "timestamp": datetime.utcnow().isoformat() + "Z"
+    }
+
+def _risk_job(job: JobContext) -> Dict[str, Any]:
+    """Job handler: risk analysis of params["upload_id"]."""
+    upload_id = job.params["upload_id"]
+    data_path = _find_risk_cube(upload_id)
+    if data_path is None:
+        raise FileNotFoundError(f"Hyperspectral data not found for upload_id {upload_id}")
+    return _run_risk_analysis(upload_id, data_path, job.report)
+
+job_queue.register_handler("risk", _risk_job)
+
 @router.post("/analyze-risk/{upload_id}", response_model=dict)
 async def analyze_risk_zones(upload_id: str):
     """
-    Analyze hyperspectral data for stress/pest risk zones
+    Analyze hyperspectral data for stress/pest risk zones.
+    Waits for the result; use /analyze-risk/{upload_id}/jobs for large cubes.
     """
     try:
         # Validate upload_id
@@ -95,42 +294,84 @@ async def analyze_risk_zones(upload_id: str):
             raise HTTPException(status_code=400, detail="Invalid upload ID format.")
         
         # Construct the path to the hyperspectral data
-        # In MVP, we assume spectral data is stored in a specific format
-        data_path = os.path.join("data", "uploads", f"{upload_id}.dat")  # ENVI format
-        hdr_path = os.path.join("data", "uploads", f"{upload_id}.hdr")  # Header file
-        
-        # Try different file extensions
-        if os.path.exists(data_path):
-            spectral_data_info = spectral_processor.load_hyperspectral_data(data_path)
-        elif os.path.exists(hdr_path):
-            spectral_data_info = spectral_processor.load_hyperspectral_data(hdr_path)
+        data_path = _find_risk_cube(upload_id)
+        if data_path is not None:
+            return await worker_pool.run(_run_risk_analysis, upload_id, data_path)
         else:
             # If no hyperspectral file, try to create from regular image (simulated)
             # This is for MVP - in real implementation, we'd need actual hyperspectral data
             raise HTTPException(status_code=404, detail="Hyperspectral data not found. Only ENVI format (.dat/.hdr) supported for risk analysis.")
-        
-        # Run risk detection on the spectral data
-        spectral_data = spectral_data_info['data']
-        risk_results = risk_detector.detect_risk_zones(spectral_data)
-        
-        # Save risk analysis results
-        risk_result_file_path = os.path.join("data", "results", f"{upload_id}_risk.json")
-        os.makedirs(os.path.dirname(risk_result_file_path), exist_ok=True)
-        
-        with open(risk_result_file_path, 'w') as f:
-            json.dump(risk_results, f, indent=2)
-        
-        return {
-            "upload_id": upload_id,
-            "risk_analysis": risk_results,
-            "result_path": risk_result_file_path,
-            "timestamp": datetime.utcnow().isoformat() + "Z"
-        }
     
+    except HTTPException:
+        raise
+    except WorkerPoolFullError as e:
+        logger.warning(f"Rejected risk analysis for upload_id {upload_id}: {e}")
+        raise HTTPException(status_code=503, detail="Server is busy. Please retry shortly.")
     except Exception as e:
         logger.error(f"Error during risk analysis for upload_id {upload_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Risk analysis failed: {str(e)}")
 
+@router.post("/analyze-risk/{upload_id}/jobs", response_model=JobStatus, status_code=202)
+async def submit_risk_job(upload_id: str, timeout_seconds: Optional[float] = None):
+    """
+    Queue risk analysis as a background job and return at once.
+    Poll /jobs/{job_id} (or follow /jobs/{job_id}/events) for progress and the result.
+    """
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid upload ID format.")
+    if _find_risk_cube(upload_id) is None:
+        raise HTTPException(status_code=404, detail="Hyperspectral data not found. Only ENVI format (.dat/.hdr) supported for risk analysis.")
+
+    try:
+        job = await asyncio.to_thread(job_queue.submit, "risk", {"upload_id": upload_id}, timeout_seconds)
+        return JobStatus(**job)
+    except JobQueueFullError as e:
+        logger.warning(f"Rejected risk job for upload_id {upload_id}: {e}")
+        raise HTTPException(status_code=503, detail="Job queue is full. Please retry later.")
+
+@router.get("/risk-map/{upload_id}", response_model=RiskMapWindow)
+async def get_risk_map(upload_id: str, x: int = 0, y: int = 0, width: Optional[int] = None,
+                       height: Optional[int] = None, max_size: int = 512):
+    """
+    Returns a window of the stored risk and confidence maps (the whole scene by
+    default), downsampled so its longest side is at most max_size pixels.
+    """
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid upload ID format.")
+    if not 1 <= max_size <= MAX_WINDOW_SIZE:
+        raise HTTPException(status_code=400, detail=f"max_size must be between 1 and {MAX_WINDOW_SIZE}.")
+
+    try:
+        window = await asyncio.to_thread(read_risk_window, upload_id, x, y, width, height, max_size)
+        window["risk_map"] = window["risk_map"].tolist()
+        window["confidence_map"] = np.round(window["confidence_map"].astype(np.float64), 3).tolist()
+        return RiskMapWindow(**window)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Risk maps not found for the given upload ID.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error reading risk map for upload_id {upload_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to read risk map.")
+
+@router.get("/risk-map/{upload_id}/raster")
+async def download_risk_raster(upload_id: str):
+    """
+    Downloads the full risk map GeoTIFF (band 1: class index, band 2: confidence x 255).
+    """
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid upload ID format.")
+    raster_path = get_risk_raster_path(upload_id)
+    if not os.path.exists(raster_path):
+        raise HTTPException(status_code=404, detail="Risk maps not found for the given upload ID.")
+    return FileResponse(raster_path, media_type="image/tiff", filename=f"{upload_id}_risk.tif")
+
 @router.get("/alerts/{upload_id}", response_model=List[AlertResponse])
 async def get_alerts(upload_id: str):
     """
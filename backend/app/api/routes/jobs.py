@@ -0,0 +1,81 @@
+# backend/app/api/routes/jobs.py
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.api.models.schemas import JobStatus
+from app.core.job_queue import job_queue, FINISHED_STATES
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, List, Optional
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+# How often the event stream checks the job for changes (seconds)
+EVENT_POLL_INTERVAL = 0.5
+# Comment line sent when nothing changed for this long, so proxies keep the stream open (seconds)
+EVENT_KEEPALIVE_SECONDS = 15.0
+
+async def _get_job_or_404(job_id: str) -> dict:
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@router.get("/jobs", response_model=List[JobStatus])
+async def list_jobs(status: Optional[str] = None, limit: int = 50):
+    """
+    List the most recent jobs (without results), optionally filtered by status.
+    """
+    return [JobStatus(**job) for job in await asyncio.to_thread(job_queue.list, status, max(1, min(limit, 500)))]
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    """
+    Status, progress and (once it has succeeded) the result of a job.
+    """
+    return JobStatus(**await _get_job_or_404(job_id))
+
+async def _job_events(request: Request, job_id: str) -> AsyncIterator[str]:
+    """Yields a server-sent event whenever the job's status, progress or message changes, until it finishes."""
+    last_state = None
+    last_sent = asyncio.get_running_loop().time()
+    while not await request.is_disconnected():
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        if job is None:
+            return
+        state = (job["status"], job["progress"], job["message"])
+        now = asyncio.get_running_loop().time()
+        if state != last_state:
+            last_state, last_sent = state, now
+            yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+            if job["status"] in FINISHED_STATES:
+                return
+        elif now - last_sent > EVENT_KEEPALIVE_SECONDS:
+            last_sent = now
+            yield ": keep-alive\n\n"
+        await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(request: Request, job_id: str):
+    """
+    Follow a job as server-sent events. Each event carries the job status as JSON;
+    the stream ends after the job finishes (the last event includes the result).
+    """
+    await _get_job_or_404(job_id)
+    return StreamingResponse(_job_events(request, job_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.delete("/jobs/{job_id}", response_model=JobStatus, status_code=202)
+async def cancel_job(job_id: str):
+    """
+    Cancel a job. Queued jobs are cancelled at once; running jobs stop at their next
+    progress update. Returns 409 if the job has already finished.
+    """
+    job = await _get_job_or_404(job_id)
+    if job["status"] in FINISHED_STATES:
+        raise HTTPException(status_code=409, detail=f"Job already {job['status']}.")
+    job = await asyncio.to_thread(job_queue.cancel, job_id)
+    logger.info(f"Cancellation requested for job {job_id}")
+    return JobStatus(**job)
@@ -2,19 +2,33 @@
 
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from pydantic import BaseModel
-from app.api.models.schemas import SpectralAnalysisResponse, ErrorResponse
-from app.core.spectral_processor import spectral_processor
+from app.api.models.schemas import SpectralAnalysisResponse, ErrorResponse, JobStatus
+from app.core.spectral_processor import spectral_processor, index_specs, get_index_raster_path, INDEX_IN_MEMORY_MB
+from app.core.worker_pool import worker_pool, WorkerPoolFullError
+from app.core.job_queue import job_queue, JobContext, JobQueueFullError, JobInterruptedError
 from app.utils.file_handler import save_upload_file
+import asyncio
 import uuid
 import logging
 import numpy as np
 import os
 import json
-from typing import Dict, Any
+import math
+from typing import Any, Callable, Dict, Optional
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Most pixels of each index returned as a sample; larger strides are used beyond this
+MAX_SAMPLE_PIXELS = 16384
+
+def _sample_stride(height: int, width: int, requested: int) -> int:
+    """The requested sample stride, raised until the sample has at most MAX_SAMPLE_PIXELS pixels."""
+    stride = max(1, requested, math.ceil(math.sqrt(height * width / MAX_SAMPLE_PIXELS)))
+    while math.ceil(height / stride) * math.ceil(width / stride) > MAX_SAMPLE_PIXELS:
+        stride += 1
+    return stride
+
 class SpectralAnalysisRequest(BaseModel):
     """
     Request model for spectral analysis with optional metadata
@@ -28,6 +42,165 @@ class SpectralAnalysisRequest(BaseModel):
     swir_band: int = 5
     metadata: Dict[str, Any] = {}
 
+def _run_spectral_analysis(
+    upload_id: str,
+    file_path: str,
+    analysis_type: str,
+    red_band: int,
+    nir_band: int,
+    red_edge_band: int,
+    swir_band: int,
+    save_rasters: bool = False,
+    sample_stride: Optional[int] = None,
+    progress: Optional[Callable[[float, Optional[str]], None]] = None
+) -> Dict[str, Any]:
+    """
+    Loads the saved cube, computes the requested indices and health map, and saves the results.
+    Each index gets summary statistics; save_rasters also writes it as a GeoTIFF and
+    sample_stride adds every sample_stride-th pixel of every sample_stride-th row.
+    Scenes above INDEX_IN_MEMORY_MB are streamed block by block into running statistics.
+    This is CPU and IO heavy, so it is run on the worker pool or as a job.
+    progress(fraction, message), if given, is called after each step.
+    """
+    report = progress or (lambda fraction, message=None: None)
+    # Load hyperspectral data
+    report(0.0, "Loading cube")
+    # Lazy: only the bands the indices use are read, block by block
+    spectral_data = spectral_processor.load_hyperspectral_data(file_path, lazy=True)
+    report(0.2, "Computing indices")
+    
+    # Compute requested spectral indices
+    results = {
+        "upload_id": upload_id,
+        "file_info": {
+            "path": file_path,
+            "shape": spectral_data["shape"],
+            "bands": spectral_data["bands"]
+        },
+        "indices": {}
+    }
+    
+    # Compute indices based on analysis type
+    data = spectral_data["data"]
+    bands = spectral_data["bands"]
+    specs = []
+    for spec in index_specs(analysis_type, red_band, nir_band, red_edge_band, swir_band):
+        # Drop any index whose bands are out of range, so one bad band cannot fail the fused pass
+        if all(0 <= band < bands for band in spec.bands):
+            specs.append(spec)
+        else:
+            logger.warning(f"Could not compute {spec.name.upper()}: needs bands {spec.bands}, but the data has {bands} bands")
+
+    height, width = spectral_data["shape"][:2]
+    index_rasters = {spec.name: get_index_raster_path(upload_id, spec.name) for spec in specs} if save_rasters else {}
+    stride = _sample_stride(height, width, sample_stride) if sample_stride else None
+    statistics, samples, health_map = {}, {}, None
+    try:
+        if height * width * 4 * len(specs) <= INDEX_IN_MEMORY_MB * 1024 * 1024:
+            # All indices in one pass over the cube (or from the raster cache); the arrays
+            # are reused for the statistics, the health map, the rasters and the samples
+            indices = spectral_processor.cached_indices(
+                data, specs, progress=lambda fraction: report(0.2 + 0.5 * fraction)
+            )
+            report(0.7, "Computing statistics")
+            statistics = spectral_processor.index_statistics(indices, specs)
+            if "ndvi" in indices:
+                health_map = spectral_processor.generate_health_map(indices["ndvi"])
+            if index_rasters:
+                spectral_processor.save_index_rasters(indices, index_rasters, spectral_data["metadata"])
+            if stride:
+                samples = {name: index[::stride, ::stride] for name, index in indices.items()}
+        else:
+            # Too large to hold the index arrays: stream the cube block by block and
+            # keep only the statistics, the health map and the samples
+            if "ndvi" in (spec.name for spec in specs):
+                health_map = np.zeros((height, width, 3), dtype=np.uint8)
+            if stride:
+                sample_shape = (-(-height // stride), -(-width // stride))
+                samples = {spec.name: np.empty(sample_shape, dtype=np.float32) for spec in specs}
+
+            def on_block(row: int, blocks: Dict[str, np.ndarray]):
+                rows = next(iter(blocks.values())).shape[0]
+                if health_map is not None:
+                    health_map[row:row + rows] = spectral_processor.generate_health_map(blocks["ndvi"])
+                if stride:
+                    # The block rows that fall on the stride
+                    first = -row % stride
+                    for name, block in blocks.items():
+                        sampled = block[first::stride, ::stride]
+                        start = (row + first) // stride
+                        samples[name][start:start + sampled.shape[0]] = sampled
+
+            statistics = spectral_processor.compute_index_statistics(
+                data, specs, raster_paths=index_rasters, on_block=on_block,
+                progress=lambda fraction: report(0.2 + 0.6 * fraction)
+            )
+    except JobInterruptedError:
+        raise
+    except Exception as e:
+        logger.warning(f"Could not compute spectral indices: {e}")
+        statistics, samples, health_map = {}, {}, None
+    finally:
+        data.close()
+
+    for name, stats in statistics.items():
+        results["indices"][name] = stats.to_dict()
+        if name in samples:
+            sample = samples[name]
+            # Only the sampled pixels become Python values; NaN is not valid JSON
+            results["indices"][name]["sample"] = {
+                "stride": stride,
+                "shape": list(sample.shape),
+                "values": np.where(np.isfinite(sample), sample, None).tolist(),
+            }
+    if statistics and index_rasters:
+        results["index_rasters"] = index_rasters
+    
+    # Save the health map rendered from NDVI, if available
+    report(0.8, "Saving health map")
+    if health_map is not None:
+        try:
+            # Save health map as a temporary image file
+            import cv2
+            health_map_path = os.path.join("data", "results", f"{upload_id}_health_map.jpg")
+            os.makedirs(os.path.dirname(health_map_path), exist_ok=True)
+            
+            # Save the health map image
+            cv2.imwrite(health_map_path, cv2.cvtColor(health_map, cv2.COLOR_RGB2BGR))
+            
+            results["health_map_path"] = health_map_path
+        except Exception as e:
+            logger.warning(f"Could not generate health map: {e}")
+    
+    # Save results to JSON file
+    result_file_path = os.path.join("data", "results", f"{upload_id}_spectral.json")
+    os.makedirs(os.path.dirname(result_file_path), exist_ok=True)
+    
+    with open(result_file_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    
+    return results
+
+def _validate_spectral_file(file: UploadFile):
+    """Rejects uploads that are neither images nor ENVI/GeoTIFF cubes."""
+    if not file.content_type or not any(ext in file.content_type.lower() for ext in ["image/", "application/octet-stream", "text/plain"]):
+        if not any(ext in file.filename.lower() for ext in [".hdr", ".dat", ".tif", ".tiff", ".geotiff"]):
+            raise HTTPException(
+                status_code=400, 
+                detail="Invalid file type. Please upload hyperspectral files (ENVI .hdr/.dat or GeoTIFF .tif/.tiff)"
+            )
+
+def _validate_sample_stride(sample_stride: Optional[int]):
+    """Rejects sample strides below 1."""
+    if sample_stride is not None and sample_stride < 1:
+        raise HTTPException(status_code=400, detail="sample_stride must be at least 1.")
+
+def _spectral_job(job: JobContext) -> Dict[str, Any]:
+    """Job handler: spectral analysis of an uploaded cube with the parameters given at submission."""
+    return _run_spectral_analysis(**job.params, progress=job.report)
+
+job_queue.register_handler("spectral", _spectral_job)
+
 @router.post("/spectral/analyze", response_model=SpectralAnalysisResponse)
 async def analyze_spectral_data(
     file: UploadFile = File(...),
@@ -36,18 +209,18 @@ async def analyze_spectral_data(
     red_band: int = 2,
     nir_band: int = 3,
     red_edge_band: int = 3,
-    swir_band: int = 5
+    swir_band: int = 5,
+    save_rasters: bool = False,
+    sample_stride: Optional[int] = None
 ):
     """
     Analyze hyperspectral/multispectral data to compute spectral indices
+    With save_rasters, each index is also stored as a GeoTIFF (see index_rasters).
+    With sample_stride, each index includes a strided sample of its pixels.
     """
     # Validate file type
-    if not file.content_type or not any(ext in file.content_type.lower() for ext in ["image/", "application/octet-stream", "text/plain"]):
-        if not any(ext in file.filename.lower() for ext in [".hdr", ".dat", ".tif", ".tiff", ".geotiff"]):
-            raise HTTPException(
-                status_code=400, 
-                detail="Invalid file type. Please upload hyperspectral files (ENVI .hdr/.dat or GeoTIFF .tif/.tiff)"
-            )
+    _validate_spectral_file(file)
+    _validate_sample_stride(sample_stride)
 
     # Generate a unique ID for this analysis
     upload_id = str(uuid.uuid4())
@@ -56,101 +229,69 @@ async def analyze_spectral_data(
         # Save the uploaded file
         file_path = await save_upload_file(file, upload_id)
         
-        # Load hyperspectral data
-        spectral_data = spectral_processor.load_hyperspectral_data(file_path)
-        
-        # Compute requested spectral indices
-        results = {
-            "upload_id": upload_id,
-            "file_info": {
-                "path": file_path,
-                "shape": spectral_data["shape"],
-                "bands": spectral_data["bands"]
-            },
-            "indices": {}
-        }
-        
-        # Compute indices based on analysis type
-        data = spectral_data["data"]
-        
-        if analysis_type in ["full", "ndvi"]:
-            try:
-                ndvi = spectral_processor.compute_ndvi(data, red_band, nir_band)
-                results["indices"]["ndvi"] = {
-                    "min": float(np.min(ndvi)),
-                    "max": float(np.max(ndvi)),
-                    "mean": float(np.mean(ndvi)),
-                    "data": ndvi.tolist()[:10]  # Include a sample of the data (first 10 values)
-                }
-            except Exception as e:
-                logger.warning(f"Could not compute NDVI: {e}")
-        
-        if analysis_type in ["full", "ndre"]:
-            try:
-                ndre = spectral_processor.compute_ndre(data, red_edge_band, nir_band)
-                results["indices"]["ndre"] = {
-                    "min": float(np.min(ndre)),
-                    "max": float(np.max(ndre)),
-                    "mean": float(np.mean(ndre)),
-                    "data": ndre.tolist()[:10]  # Include a sample of the data (first 10 values)
-                }
-            except Exception as e:
-                logger.warning(f"Could not compute NDRE: {e}")
-        
-        if analysis_type in ["full", "msi"]:
-            try:
-                msi = spectral_processor.compute_msi(data, nir_band, swir_band)
-                results["indices"]["msi"] = {
-                    "min": float(np.min(msi)),
-                    "max": float(np.max(msi)),
-                    "mean": float(np.mean(msi)),
-                    "data": msi.tolist()[:10]  # Include a sample of the data (first 10 values)
-                }
-            except Exception as e:
-                logger.warning(f"Could not compute MSI: {e}")
-        
-        if analysis_type in ["full", "savi"]:
-            try:
-                savi = spectral_processor.compute_savi(data, red_band, nir_band)
-                results["indices"]["savi"] = {
-                    "min": float(np.min(savi)),
-                    "max": float(np.max(savi)),
-                    "mean": float(np.mean(savi)),
-                    "data": savi.tolist()[:10]  # Include a sample of the data (first 10 values)
-                }
-            except Exception as e:
-                logger.warning(f"Could not compute SAVI: {e}")
-        
-        # Generate health map from NDVI if available
-        if "ndvi" in results["indices"]:
-            try:
-                ndvi_data = spectral_data["data"]  # Re-compute full NDVI for health map
-                full_ndvi = spectral_processor.compute_ndvi(data, red_band, nir_band)
-                health_map = spectral_processor.generate_health_map(full_ndvi)
-                
-                # Save health map as a temporary image file
-                import cv2
-                health_map_path = os.path.join("data", "results", f"{upload_id}_health_map.jpg")
-                os.makedirs(os.path.dirname(health_map_path), exist_ok=True)
-                
-                # Save the health map image
-                cv2.imwrite(health_map_path, cv2.cvtColor(health_map, cv2.COLOR_RGB2BGR))
-                
-                results["health_map_path"] = health_map_path
-            except Exception as e:
-                logger.warning(f"Could not generate health map: {e}")
-        
-        # Save results to JSON file
-        result_file_path = os.path.join("data", "results", f"{upload_id}_spectral.json")
-        os.makedirs(os.path.dirname(result_file_path), exist_ok=True)
-        
-        with open(result_file_path, 'w') as f:
-            json.dump(results, f, indent=2)
+        # Load the cube and compute indices on the worker pool
+        results = await worker_pool.run(
+            _run_spectral_analysis,
+            upload_id,
+            file_path,
+            analysis_type,
+            red_band,
+            nir_band,
+            red_edge_band,
+            swir_band,
+            save_rasters,
+            sample_stride
+        )
         
         logger.info(f"Spectral analysis completed for upload_id {upload_id}")
         
         return SpectralAnalysisResponse(**results)
     
+    except WorkerPoolFullError as e:
+        logger.warning(f"Rejected spectral analysis for upload_id {upload_id}: {e}")
+        raise HTTPException(status_code=503, detail="Server is busy. Please retry shortly.")
     except Exception as e:
         logger.error(f"Error during spectral analysis for upload: {e}")
-        raise HTTPException(status_code=500, detail=f"Spectral analysis failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Spectral analysis failed: {str(e)}")
+
+@router.post("/spectral/analyze/jobs", response_model=JobStatus, status_code=202)
+async def submit_spectral_job(
+    file: UploadFile = File(...),
+    analysis_type: str = "full",
+    red_band: int = 2,
+    nir_band: int = 3,
+    red_edge_band: int = 3,
+    swir_band: int = 5,
+    save_rasters: bool = False,
+    sample_stride: Optional[int] = None,
+    timeout_seconds: Optional[float] = None
+):
+    """
+    Save the uploaded cube and queue its spectral analysis as a background job.
+    Poll /jobs/{job_id} (or follow /jobs/{job_id}/events) for progress and the result.
+    """
+    _validate_spectral_file(file)
+    _validate_sample_stride(sample_stride)
+    upload_id = str(uuid.uuid4())
+
+    try:
+        file_path = await save_upload_file(file, upload_id)
+        params = {
+            "upload_id": upload_id,
+            "file_path": file_path,
+            "analysis_type": analysis_type,
+            "red_band": red_band,
+            "nir_band": nir_band,
+            "red_edge_band": red_edge_band,
+            "swir_band": swir_band,
+            "save_rasters": save_rasters,
+            "sample_stride": sample_stride,
+        }
+        job = await asyncio.to_thread(job_queue.submit, "spectral", params, timeout_seconds)
+        return JobStatus(**job)
+    except JobQueueFullError as e:
+        logger.warning(f"Rejected spectral job for upload_id {upload_id}: {e}")
+        raise HTTPException(status_code=503, detail="Job queue is full. Please retry later.")
+    except Exception as e:
+        logger.error(f"Error submitting spectral job: {e}")
+        raise HTTPException(status_code=500, detail=f"Could not queue spectral analysis: {str(e)}")
@@ -1,101 +1,205 @@
 # backend/app/core/ai_predictor.py
 
+import numpy as np
 import torch
 import os
 import json
 import logging
-from .model_loader import get_model, get_hs_features, get_class_names
+from typing import Optional
+from .model_loader import get_active, get_class_names, LoadedModel, HS_SELECTION, HS_TOP_K
 from .image_processor import preprocess_image
-from app.utils.file_handler import get_upload_file_path
+from .inference_batcher import InferenceBatcher
+from .worker_pool import worker_pool
+from .result_cache import result_cache, ResultCache, CachedAnalysis
+from app.utils.file_handler import get_upload_file_path, file_content_hash
 
 logger = logging.getLogger(__name__)
 
-def run_analysis(upload_id: str) -> dict:
+# --- Configuration ---
+# Uploads run through the model together by the batch endpoint's analysis_pipeline
+BATCH_ANALYSIS_SIZE = int(os.environ.get("KRISHI_BATCH_ANALYSIS_SIZE", "64"))
+
+# --- Recommendation Logic (Simple Example) ---
+# In a real system, this would be a more complex mapping or database lookup
+RECOMMENDATION_MAP = {
+    "Tomato___Bacterial_spot": "Apply copper-based fungicide.",
+    "Tomato___Early_blight": "Use chlorothalonil or mancozeb fungicide.",
+    "Tomato___Late_blight": "Apply metalaxyl or mefenoxam fungicide immediately.",
+    "Tomato___Leaf_Mold": "Spray copper fungicide.",
+    "Tomato___Septoria_leaf_spot": "Use chlorothalonil fungicide.",
+    "Tomato___Spider_mites Two-spotted_spider_mite": "Apply abamectin or bifenthrin miticide.",
+    "Tomato___Target_Spot": "Use copper-based fungicide.",
+    "Tomato___Tomato_Yellow_Leaf_Curl_Virus": "Remove and destroy infected plants. Control whiteflies.",
+    "Tomato___Tomato_mosaic_virus": "Remove and destroy infected plants.",
+    "Potato___Early_blight": "Apply chlorothalonil fungicide.",
+    "Potato___Late_blight": "Apply metalaxyl or mefenoxam fungicide immediately.",
+    "Corn_(maize)___Common_rust_": "Apply triazole or strobilurin fungicide.",
+    "Corn_(maize)___Northern_Leaf_Blight": "Apply fungicide like azoxystrobin.",
+    "Apple___Apple_scab": "Apply captan or dodine fungicide.",
+    "Grape___Black_rot": "Apply mancozeb or myclobutanil fungicide.",
+    # Add more mappings as needed
+}
+
+def get_result_file_path(upload_id: str) -> str:
+    """Returns the path where the analysis result for an upload is stored."""
+    return os.path.join("data", "results", f"{upload_id}.json")
+
+def select_hs_features(loaded: LoadedModel, rgb_feat: torch.Tensor) -> torch.Tensor:
     """
-    Runs the complete AI analysis pipeline for a given upload ID.
-    Loads the image, preprocesses it, runs inference using the combined model,
-    and saves the result.
-    Returns the analysis result as a dictionary.
+    Selects the hyperspectral features paired with each RGB image in a batch.
+    rgb_feat shape: (batch_size, 128) RGB embeddings.
+    Returns a tensor of shape (batch_size, feature_dim_HS).
     """
-    # 1. Get paths
-    image_path = get_upload_file_path(upload_id)
-    result_file_path = os.path.join("data", "results", f"{upload_id}.json")
+    if HS_SELECTION == "nearest":
+        # Average of the patch features closest to each image's RGB embedding
+        return loaded.hs_index.select(rgb_feat, HS_TOP_K)
+    # Original MVP behaviour: always pair with the first available HS feature
+    hs_features = loaded.hs_features # Shape: (N_patches, feature_dim_HS)
+    return hs_features[0:1].expand(rgb_feat.shape[0], -1)
 
+def predict_batch(rgb_batch: torch.Tensor, loaded: Optional[LoadedModel] = None):
+    """
+    Runs the active model version (or the given one) on a batch of RGB images,
+    pairing each with the hyperspectral features chosen by select_hs_features.
+    rgb_batch shape: (batch_size, C, H, W)
+    Returns (confidences, predicted class indices, RGB embeddings, model). Confidences
+    and indices have shape (batch_size,), embeddings (batch_size, 128) or None if the
+    backend cannot provide them; model is the LoadedModel that ran the batch.
+    """
+    # Fetch the active version once so a hot swap mid-batch cannot mix models
+    loaded = loaded if loaded is not None else get_active()
+    predictor = loaded.onnx_predictor
+    if predictor is not None and predictor.supports_embedding:
+        rgb_feat = torch.from_numpy(predictor.embed(rgb_batch.cpu().numpy()))
+        confidence, predicted_idx = predictor.classify(select_hs_features(loaded, rgb_feat).cpu().numpy(), rgb_feat.numpy())
+        return torch.from_numpy(confidence), torch.from_numpy(predicted_idx), rgb_feat, loaded
+    if predictor is not None and (HS_SELECTION == "first" or loaded.model is None):
+        hs_batch = loaded.hs_features[0:1].expand(rgb_batch.shape[0], -1)
+        confidence, predicted_idx, rgb_feat = predictor.predict(hs_batch.cpu().numpy(), rgb_batch.cpu().numpy())
+        embeddings = torch.from_numpy(rgb_feat) if rgb_feat is not None else None
+        return torch.from_numpy(confidence), torch.from_numpy(predicted_idx), embeddings, loaded
+
+    model = loaded.model
+    with torch.no_grad(): # Disable gradient calculation for inference
+        model.eval() # Ensure model is in evaluation mode
+        rgb_feat = model.embed(rgb_batch)
+        outputs = model.classify(select_hs_features(loaded, rgb_feat), rgb_feat)
+        probabilities = torch.nn.functional.softmax(outputs, dim=1)
+        confidence, predicted_idx = torch.max(probabilities, 1)
+    return confidence, predicted_idx, rgb_feat.cpu(), loaded
+
+def build_result(upload_id: str, predicted_class_idx: int, confidence_score: float, model_version: str = None) -> dict:
+    """Maps a predicted class index to its name and recommendation."""
+    class_names = get_class_names()
+    if predicted_class_idx < len(class_names):
+         predicted_class_name = class_names[predicted_class_idx]
+    else:
+         predicted_class_name = f"Unknown_Class_{predicted_class_idx}" # Fallback if index is out of bounds
+    recommendation = RECOMMENDATION_MAP.get(predicted_class_name, "Consult an agricultural expert for specific treatment.")
+
+    return {
+        "upload_id": upload_id,
+        "prediction": predicted_class_name,
+        "confidence": confidence_score,
+        "recommendation": recommendation,
+        "model_version": model_version,
+    }
+
+def save_result(result: dict) -> str:
+    """Saves an analysis result as JSON and returns the file path."""
+    result_file_path = get_result_file_path(result["upload_id"])
+    os.makedirs(os.path.dirname(result_file_path), exist_ok=True)
+    with open(result_file_path, 'w') as f:
+        json.dump(result, f, indent=2)
+    logger.info(f"Analysis result saved for upload_id {result['upload_id']} at {result_file_path}")
+    return result_file_path
+
+def _find_upload(upload_id: str) -> str:
+    """Returns the path of the uploaded image for an ID."""
+    image_path = get_upload_file_path(upload_id)
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"Uploaded image file not found for ID {upload_id} at {image_path}")
+    return image_path
+
+def _lookup_cache(upload_id: str):
+    """
+    Hashes the uploaded image (reusing the digest stored at upload) and looks it up in the result cache for the active model version.
+    Returns (image_path, image hash, cached entry or None, version of the cached entry).
+    """
+    image_path = _find_upload(upload_id)
+    image_hash = file_content_hash(image_path)
+    loaded = get_active()
+    return image_path, image_hash, result_cache.get(ResultCache.make_key(image_hash, loaded.tag)), loaded.version
 
+def _remember(image_hash: str, loaded: LoadedModel, predicted_class_idx: int, confidence_score: float, embedding):
+    """Stores a fresh prediction (and its embedding, when available) under the model that produced it."""
+    if embedding is None:
+        return
+    result_cache.put(ResultCache.make_key(image_hash, loaded.tag), CachedAnalysis(
+        embedding=np.asarray(embedding, dtype=np.float32).reshape(-1),
+        predicted_idx=predicted_class_idx,
+        confidence=confidence_score,
+    ))
+
+def run_analysis(upload_id: str) -> dict:
+    """
+    Runs the complete AI analysis pipeline for a given upload ID.
+    Loads the image, preprocesses it, runs inference using the combined model,
+    and saves the result. Images that were analyzed before (same bytes, same
+    model) are answered from the result cache without running inference.
+    Returns the analysis result as a dictionary.
+    """
     try:
+        # 1. Look the image up by content hash
+        image_path, image_hash, cached, cached_version = _lookup_cache(upload_id)
+        if cached is not None:
+            logger.info(f"Cache hit for upload_id {upload_id}")
+            result = build_result(upload_id, cached.predicted_idx, cached.confidence, cached_version)
+            save_result(result)
+            return result
+
         # 2. Preprocess the uploaded RGB image
         rgb_tensor = preprocess_image(image_path)
 
-        # 3. Load the model and hyperspectral features
-        model = get_model()
-        hs_features = get_hs_features() # Shape: (N_patches, feature_dim_HS)
-
-        # 4. Select Hyperspectral Feature (MVP Strategy)
-        # For simplicity in MVP, we'll use the first available HS feature.
-        # In a more advanced version, you'd map the RGB image location to a specific HS patch.
-        # Here, we just take the first one. You might also consider averaging features.
-        selected_hs_feature = hs_features[0:1] # Shape: (1, feature_dim_HS)
-
-        # 5. Run Inference
+        # 3. Run Inference
+        # rgb_img shape: (1, 3, 224, 224); the HS feature is chosen from its embedding
         logger.info(f"Running inference for upload_id {upload_id}")
-        with torch.no_grad(): # Disable gradient calculation for inference
-            model.eval() # Ensure model is in evaluation mode
-            # Pass the selected HS feature and the preprocessed RGB tensor
-            # Note: The model expects (hs_feat, rgb_img)
-            # hs_feat shape: (batch_size, feature_dim_HS) -> (1, 128) from pre-computed features
-            # rgb_img shape: (batch_size, C, H, W) -> (1, 3, 224, 224)
-            outputs = model(selected_hs_feature, rgb_tensor)
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            confidence, predicted_idx = torch.max(probabilities, 1)
-
-        # 6. Format Results
-        predicted_class_idx = predicted_idx.item()
-        confidence_score = confidence.item()
-        class_names = get_class_names()
-        if predicted_class_idx < len(class_names):
-             predicted_class_name = class_names[predicted_class_idx]
-        else:
-             predicted_class_name = f"Unknown_Class_{predicted_class_idx}" # Fallback if index is out of bounds
-        # --- Recommendation Logic (Simple Example) ---
-        # In a real system, this would be a more complex mapping or database lookup
-        recommendation_map = {
-            "Tomato___Bacterial_spot": "Apply copper-based fungicide.",
-            "Tomato___Early_blight": "Use chlorothalonil or mancozeb fungicide.",
-            "Tomato___Late_blight": "Apply metalaxyl or mefenoxam fungicide immediately.",
-            "Tomato___Leaf_Mold": "Spray copper fungicide.",
-            "Tomato___Septoria_leaf_spot": "Use chlorothalonil fungicide.",
-            "Tomato___Spider_mites Two-spotted_spider_mite": "Apply abamectin or bifenthrin miticide.",
-            "Tomato___Target_Spot": "Use copper-based fungicide.",
-            "Tomato___Tomato_Yellow_Leaf_Curl_Virus": "Remove and destroy infected plants. Control whiteflies.",
-            "Tomato___Tomato_mosaic_virus": "Remove and destroy infected plants.",
-            "Potato___Early_blight": "Apply chlorothalonil fungicide.",
-            "Potato___Late_blight": "Apply metalaxyl or mefenoxam fungicide immediately.",
-            "Corn_(maize)___Common_rust_": "Apply triazole or strobilurin fungicide.",
-            "Corn_(maize)___Northern_Leaf_Blight": "Apply fungicide like azoxystrobin.",
-            "Apple___Apple_scab": "Apply captan or dodine fungicide.",
-            "Grape___Black_rot": "Apply mancozeb or myclobutanil fungicide.",
-            # Add more mappings as needed
-        }
-        recommendation = recommendation_map.get(predicted_class_name, "Consult an agricultural expert for specific treatment.")
-        # --- End Recommendation Logic ---
-
-        result = {
-            "upload_id": upload_id,
-            "prediction": predicted_class_name,
-            "confidence": confidence_score,
-            "recommendation": recommendation
-        }
-
-        # 7. Save Results
-        os.makedirs(os.path.dirname(result_file_path), exist_ok=True)
-        with open(result_file_path, 'w') as f:
-            json.dump(result, f, indent=2)
-        logger.info(f"Analysis result saved for upload_id {upload_id} at {result_file_path}")
+        confidence, predicted_idx, embeddings, loaded = predict_batch(rgb_tensor)
 
+        # 4. Format and save results
+        result = build_result(upload_id, predicted_idx.item(), confidence.item(), loaded.version)
+        _remember(image_hash, loaded, predicted_idx.item(), confidence.item(), embeddings[0] if embeddings is not None else None)
+        save_result(result)
         return result
 
     except Exception as e:
         logger.error(f"Error during analysis for upload_id {upload_id}: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# Shared batcher so concurrent requests are stacked into one forward pass
+inference_batcher = InferenceBatcher(predict_batch)
+
+async def run_analysis_async(upload_id: str) -> dict:
+    """
+    Same as run_analysis, but the forward pass goes through the shared
+    InferenceBatcher so concurrent requests are served by one batched call.
+    Hashing, decoding and file writes run on the worker pool, off the event loop.
+    """
+    try:
+        image_path, image_hash, cached, cached_version = await worker_pool.run(_lookup_cache, upload_id)
+        if cached is not None:
+            logger.info(f"Cache hit for upload_id {upload_id}")
+            result = build_result(upload_id, cached.predicted_idx, cached.confidence, cached_version)
+            await worker_pool.run(save_result, result)
+            return result
+
+        rgb_tensor = await worker_pool.run(preprocess_image, image_path)
+        logger.info(f"Queueing inference for upload_id {upload_id}")
+        predicted_class_idx, confidence_score, embedding, loaded = await inference_batcher.submit(rgb_tensor)
+        result = build_result(upload_id, predicted_class_idx, confidence_score, loaded.version)
+        await worker_pool.run(_remember, image_hash, loaded, predicted_class_idx, confidence_score, embedding)
+        await worker_pool.run(save_result, result)
+        return result
+    except Exception as e:
+        logger.error(f"Error during analysis for upload_id {upload_id}: {e}")
+        raise
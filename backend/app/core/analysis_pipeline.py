@@ -0,0 +1,378 @@
+# backend/app/core/analysis_pipeline.py
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional
+
+import torch
+
+from .ai_predictor import (
+    predict_batch, build_result, save_result, _lookup_cache, _remember, BATCH_ANALYSIS_SIZE,
+)
+from .image_processor import preprocess_image
+from .process_runtime import CORES_PER_WORKER
+from .worker_pool import worker_pool, WorkerPoolFullError
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Threads decoding and preprocessing upcoming uploads while the model runs
+PREPROCESS_WORKERS = int(os.environ.get("KRISHI_PREPROCESS_WORKERS", str(max(1, CORES_PER_WORKER // 2))))
+# Preprocessed uploads allowed to wait for the inference stage
+PREFETCH_QUEUE_DEPTH = int(os.environ.get("KRISHI_PREFETCH_QUEUE_DEPTH", str(2 * BATCH_ANALYSIS_SIZE)))
+# Finished results allowed to wait for the consumer (e.g. a slow streaming client)
+RESULT_QUEUE_DEPTH = int(os.environ.get("KRISHI_RESULT_QUEUE_DEPTH", str(BATCH_ANALYSIS_SIZE)))
+# Pipeline runs (batch requests) allowed at once; each holds a feeder and an inference thread
+MAX_PIPELINE_RUNS = int(os.environ.get("KRISHI_MAX_PIPELINE_RUNS", "2"))
+# How often blocked queue operations re-check for cancellation (seconds)
+POLL_INTERVAL = 0.1
+
+# Marks the end of a queue
+_DONE = object()
+
+
+@dataclass
+class PreparedUpload:
+    """Output of the preprocess stage for one upload."""
+    upload_id: str
+    image_hash: Optional[str] = None
+    tensor: Optional[torch.Tensor] = None
+    # Set when no inference is needed (cache hit or error)
+    entry: Optional[dict] = None
+
+
+class StageMetrics:
+    """Busy and blocked time of one pipeline stage."""
+
+    def __init__(self, name: str, threads: int):
+        self.name = name
+        self.threads = threads
+        self.items = 0
+        self.busy_seconds = 0.0
+        # Time spent waiting on the input queue (starved) or the output queue (backpressure)
+        self.starved_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy: float = 0.0, starved: float = 0.0, blocked: float = 0.0, items: int = 0):
+        with self._lock:
+            self.busy_seconds += busy
+            self.starved_seconds += starved
+            self.blocked_seconds += blocked
+            self.items += items
+
+    def to_dict(self, wall_seconds: float) -> dict:
+        return {
+            "threads": self.threads,
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "starved_seconds": round(self.starved_seconds, 3),
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            # Share of the stage's thread time spent doing work
+            "utilization": round(self.busy_seconds / (wall_seconds * self.threads), 3) if wall_seconds > 0 else 0.0,
+        }
+
+
+class PipelineRun:
+    """
+    One pass of the pipeline over a list of uploads.
+    A feeder submits uploads to the shared preprocess pool (hash lookup, decode
+    and transform) and hands the futures, in order, to the inference stage through a
+    bounded queue. The inference stage batches whatever is already preprocessed,
+    runs the model on the shared worker pool and puts results on a second
+    bounded queue. Iterating the run yields one
+    entry per upload, in input order: a result dict or {"upload_id", "error"}.
+    """
+
+    def __init__(self, upload_ids: List[str], loop: asyncio.AbstractEventLoop, executor: ThreadPoolExecutor,
+                 preprocess_workers: int, batch_size: int, prefetch_depth: int, result_depth: int,
+                 on_finish: Optional[Callable[[], None]] = None):
+        self.upload_ids = upload_ids
+        # The event loop that owns the worker pool the forward passes are submitted to
+        self._loop = loop
+        self.batch_size = max(1, batch_size)
+        self._prepared: queue.Queue = queue.Queue(maxsize=max(1, prefetch_depth))
+        self._results: queue.Queue = queue.Queue(maxsize=max(1, result_depth))
+        # Taken from _prepared but still being preprocessed; it heads the next batch
+        self._head = None
+        self._cancelled = threading.Event()
+        self._executor = executor
+        self._on_finish = on_finish
+        self.preprocess_metrics = StageMetrics("preprocess", preprocess_workers)
+        self.inference_metrics = StageMetrics("inference", 1)
+        self.batches = 0
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self._feeder = threading.Thread(target=self._feed, name="krishi-pipeline-feed", daemon=True)
+        self._inference = threading.Thread(target=self._infer, name="krishi-pipeline-infer", daemon=True)
+        self._feeder.start()
+        self._inference.start()
+
+    def _put(self, target: queue.Queue, item) -> Optional[float]:
+        """Puts an item, waiting while the queue is full. Returns the time blocked, or None if cancelled."""
+        start = time.perf_counter()
+        while not self._cancelled.is_set():
+            try:
+                target.put(item, timeout=POLL_INTERVAL)
+                return time.perf_counter() - start
+            except queue.Full:
+                continue
+        return None
+
+    def _prepare(self, upload_id: str) -> PreparedUpload:
+        """Preprocess stage: cache lookup, then decode and transform on a miss."""
+        start = time.perf_counter()
+        try:
+            image_path, image_hash, cached, cached_version = _lookup_cache(upload_id)
+            if cached is not None:
+                result = build_result(upload_id, cached.predicted_idx, cached.confidence, cached_version)
+                save_result(result)
+                return PreparedUpload(upload_id, entry=result)
+            return PreparedUpload(upload_id, image_hash=image_hash, tensor=preprocess_image(image_path))
+        except Exception as e:
+            logger.error(f"Error preprocessing upload_id {upload_id} in pipeline: {e}")
+            return PreparedUpload(upload_id, entry={"upload_id": upload_id, "error": str(e)})
+        finally:
+            self.preprocess_metrics.add(busy=time.perf_counter() - start, items=1)
+
+    def _feed(self):
+        """Submits uploads in order; the bounded queue limits how far decoding runs ahead."""
+        for upload_id in self.upload_ids:
+            if self._cancelled.is_set():
+                return
+            future = self._executor.submit(self._prepare, upload_id)
+            blocked = self._put(self._prepared, future)
+            if blocked is None:
+                future.cancel()
+                return
+            self.preprocess_metrics.add(blocked=blocked)
+        self._put(self._prepared, _DONE)
+
+    def _next_prepared(self, block: bool):
+        """
+        Takes the next prepared upload (or _DONE), recording time starved. Without
+        block, returns None unless the next upload has already been preprocessed.
+        """
+        start = time.perf_counter()
+        while not self._cancelled.is_set():
+            future, self._head = self._head, None
+            if future is None:
+                try:
+                    future = self._prepared.get(timeout=POLL_INTERVAL) if block else self._prepared.get_nowait()
+                except queue.Empty:
+                    if not block:
+                        return None
+                    continue
+            if not block and future is not _DONE and not future.done():
+                # Still decoding: leave it for the next batch instead of holding this one back
+                self._head = future
+                return None
+            try:
+                item = future if future is _DONE else future.result()
+            except CancelledError:
+                # The run was closed while this upload was waiting to be preprocessed
+                return _DONE
+            self.inference_metrics.add(starved=time.perf_counter() - start)
+            return item
+        return _DONE
+
+    def _predict(self, rgb_batch: torch.Tensor):
+        """
+        Runs the forward pass on the shared worker pool, so batch runs and /analyze
+        requests share one bounded set of inference threads. Waits while the pool is full.
+        """
+        while True:
+            future = asyncio.run_coroutine_threadsafe(worker_pool.run(predict_batch, rgb_batch), self._loop)
+            try:
+                return future.result()
+            except WorkerPoolFullError:
+                if self._cancelled.wait(POLL_INTERVAL):
+                    raise RuntimeError("Pipeline run was closed")
+
+    def _run_batch(self, batch: List[PreparedUpload]) -> List[dict]:
+        """Inference stage: one forward pass for the uploads that need it, entries in input order."""
+        start = time.perf_counter()
+        to_predict = [item for item in batch if item.entry is None]
+        if to_predict:
+            try:
+                confidences, indices, embeddings, loaded = self._predict(torch.cat([item.tensor for item in to_predict], dim=0))
+                self.batches += 1
+                for row, item in enumerate(to_predict):
+                    predicted_class_idx = int(indices[row].item())
+                    confidence_score = float(confidences[row].item())
+                    result = build_result(item.upload_id, predicted_class_idx, confidence_score, loaded.version)
+                    try:
+                        _remember(item.image_hash, loaded, predicted_class_idx, confidence_score,
+                                  embeddings[row] if embeddings is not None else None)
+                        save_result(result)
+                        item.entry = result
+                    except Exception as e:
+                        logger.error(f"Error saving result for upload_id {item.upload_id}: {e}")
+                        item.entry = {"upload_id": item.upload_id, "error": str(e)}
+            except Exception as e:
+                logger.error(f"Error during pipelined inference: {e}")
+                for item in to_predict:
+                    item.entry = {"upload_id": item.upload_id, "error": str(e)}
+            # Release the decoded tensors as soon as the batch is done
+            for item in to_predict:
+                item.tensor = None
+        self.inference_metrics.add(busy=time.perf_counter() - start, items=len(to_predict))
+        return [item.entry for item in batch]
+
+    def _infer(self):
+        """Collects ready uploads into batches, runs them and publishes the entries."""
+        try:
+            finished = False
+            while not finished:
+                item = self._next_prepared(block=True)
+                if item is _DONE:
+                    break
+                batch = [item]
+                pending = 1 if item.entry is None else 0
+                # Add whatever is already queued, up to a full batch
+                while pending < self.batch_size:
+                    item = self._next_prepared(block=False)
+                    if item is None:
+                        break
+                    if item is _DONE:
+                        finished = True
+                        break
+                    batch.append(item)
+                    pending += 1 if item.entry is None else 0
+
+                for entry in self._run_batch(batch):
+                    blocked = self._put(self._results, entry)
+                    if blocked is None:
+                        return
+                    self.inference_metrics.add(blocked=blocked)
+        finally:
+            self.finished_at = time.perf_counter()
+            logger.info(f"Analysis pipeline run finished: {self.metrics()}")
+            self._put(self._results, _DONE)
+            self._cancel_prepared()
+            if self._on_finish is not None:
+                self._on_finish()
+
+    def next_result(self) -> Optional[dict]:
+        """Blocks until the next entry is ready. Returns None when all uploads are done."""
+        while True:
+            try:
+                item = self._results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if self._cancelled.is_set():
+                    return None
+                continue
+            return None if item is _DONE else item
+
+    def __iter__(self) -> Iterator[dict]:
+        try:
+            while True:
+                entry = self.next_result()
+                if entry is None:
+                    return
+                yield entry
+        finally:
+            self.close()
+
+    def _cancel_prepared(self):
+        """Cancels this run's uploads still waiting in the shared preprocess pool."""
+        head = self._head
+        if head is not None:
+            head.cancel()
+        while True:
+            try:
+                future = self._prepared.get_nowait()
+            except queue.Empty:
+                return
+            if future is not _DONE:
+                future.cancel()
+
+    def close(self):
+        """Stops the run (e.g. when the client went away); its threads exit within POLL_INTERVAL."""
+        if not self._cancelled.is_set():
+            self._cancelled.set()
+            self._cancel_prepared()
+
+    def metrics(self) -> Dict:
+        """Per-stage utilization of this run."""
+        wall = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            "uploads": len(self.upload_ids),
+            "batches": self.batches,
+            "wall_seconds": round(wall, 3),
+            "finished": self.finished_at is not None,
+            "stages": {
+                "preprocess": self.preprocess_metrics.to_dict(wall),
+                "inference": self.inference_metrics.to_dict(wall),
+            },
+        }
+
+
+class AnalysisPipeline:
+    """
+    Starts pipeline runs with the configured sizes and keeps the metrics of the latest one.
+    All runs share one preprocess pool, and at most max_runs are active at once.
+    """
+
+    def __init__(self, batch_size: int = BATCH_ANALYSIS_SIZE,
+                 preprocess_workers: int = PREPROCESS_WORKERS,
+                 prefetch_depth: int = PREFETCH_QUEUE_DEPTH,
+                 result_depth: int = RESULT_QUEUE_DEPTH,
+                 max_runs: int = MAX_PIPELINE_RUNS):
+        self.batch_size = batch_size
+        self.preprocess_workers = max(1, preprocess_workers)
+        self.prefetch_depth = prefetch_depth
+        self.result_depth = result_depth
+        self.max_runs = max(1, max_runs)
+        self._executor = ThreadPoolExecutor(max_workers=self.preprocess_workers, thread_name_prefix="krishi-preprocess")
+        self._active_runs = 0
+        self._lock = threading.Lock()
+        self._last_run: Optional[PipelineRun] = None
+
+    def _release(self):
+        with self._lock:
+            self._active_runs -= 1
+
+    def run(self, upload_ids: List[str]) -> PipelineRun:
+        """
+        Starts analyzing uploads in the background; iterate the returned run for the results.
+        Must be called from the event loop, which runs the forward passes on the worker pool.
+        Raises WorkerPoolFullError when max_runs runs are already active.
+        """
+        with self._lock:
+            if self._active_runs >= self.max_runs:
+                raise WorkerPoolFullError(f"{self._active_runs} analysis pipeline runs already active")
+            self._active_runs += 1
+        try:
+            self._last_run = PipelineRun(upload_ids, asyncio.get_running_loop(), self._executor,
+                                         self.preprocess_workers, self.batch_size, self.prefetch_depth,
+                                         self.result_depth, on_finish=self._release)
+        except Exception:
+            self._release()
+            raise
+        return self._last_run
+
+    def shutdown(self):
+        """Cancels queued preprocessing on application shutdown."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def metrics(self) -> Dict:
+        """Configuration and per-stage metrics of the most recent run."""
+        return {
+            "batch_size": self.batch_size,
+            "preprocess_workers": self.preprocess_workers,
+            "prefetch_queue_depth": self.prefetch_depth,
+            "result_queue_depth": self.result_depth,
+            "max_runs": self.max_runs,
+            "active_runs": self._active_runs,
+            "last_run": self._last_run.metrics() if self._last_run is not None else None,
+        }
+
+# Initialize the shared analysis pipeline
+analysis_pipeline = AnalysisPipeline()
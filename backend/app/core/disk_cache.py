@@ -0,0 +1,102 @@
+# backend/app/core/disk_cache.py
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class DiskCache:
+    """
+    Directory of cache files, one per key, bounded in total size.
+    Files are evicted least recently used first; a file's mtime records its last
+    use, so the order survives restarts. Writes go to a temporary file that is
+    then renamed into place, so readers never see a partial file.
+    Shared by the result cache and the raster cache.
+    """
+
+    def __init__(self, cache_dir: str, suffix: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        # key -> file size, oldest first; built lazily from the directory
+        self._index: Optional["OrderedDict[str, int]"] = None
+        self._bytes = 0
+        # Accessed from worker pool and job threads
+        self._lock = threading.Lock()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}{self.suffix}")
+
+    def _load_index(self):
+        """Scans the cache directory once, ordering existing files by last use. The caller must hold the lock."""
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith(self.suffix) and ".tmp" not in name:
+                        stat = os.stat(os.path.join(root, name))
+                        entries.append((stat.st_mtime, name[:-len(self.suffix)], stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((key, size) for _, key, size in entries)
+        self._bytes = sum(self._index.values())
+
+    def load(self, key: str, reader: Callable[[str], T]) -> Optional[T]:
+        """Reads a key's file with reader(path) and marks it recently used. Returns None if missing or unreadable."""
+        path = self.path(key)
+        try:
+            value = reader(path)
+            # Touch the file so eviction treats it as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not read cache file {path}: {e}")
+            return None
+
+        with self._lock:
+            if self._index is not None and key in self._index:
+                self._index.move_to_end(key)
+        return value
+
+    def store(self, key: str, writer: Callable[[str], None]) -> bool:
+        """Writes a key's file with writer(path), then evicts old files until the directory fits."""
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path[:-len(self.suffix)]}.{threading.get_ident()}.tmp{self.suffix}"
+            writer(tmp_path)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except Exception as e:
+            logger.warning(f"Could not write cache file {path}: {e}")
+            return False
+
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            else:
+                self._bytes += size - self._index.pop(key, 0)
+                self._index[key] = size
+            self._evict()
+        return True
+
+    def _evict(self):
+        """Removes least recently used files until the directory fits. The caller must hold the lock."""
+        while self._bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def size_bytes(self) -> Optional[int]:
+        """Total size of the cached files, or None if the directory has not been scanned yet."""
+        with self._lock:
+            return self._bytes if self._index is not None else None
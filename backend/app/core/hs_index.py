@@ -0,0 +1,41 @@
+# backend/app/core/hs_index.py
+
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class HSFeatureIndex:
+    """
+    Exact nearest-neighbour index over the pre-computed hyperspectral patch features.
+    Features are L2-normalized once at build time, so a query is one matrix
+    multiplication plus a top-k, well under a millisecond for thousands of patches.
+    """
+
+    def __init__(self, hs_features: torch.Tensor):
+        # hs_features shape: (N_patches, feature_dim_HS)
+        self.features = hs_features.float()
+        self.normalized = torch.nn.functional.normalize(self.features, dim=1)
+        logger.info(f"Built HS feature index over {self.features.shape[0]} patch features")
+
+    def __len__(self) -> int:
+        return self.features.shape[0]
+
+    def search(self, queries: torch.Tensor, k: int = 1):
+        """
+        Returns (scores, indices) of the k most similar patch features for each query
+        by cosine similarity. queries shape: (batch_size, feature_dim_HS)
+        """
+        k = max(1, min(k, len(self)))
+        similarity = torch.nn.functional.normalize(queries.float(), dim=1) @ self.normalized.T
+        return torch.topk(similarity, k, dim=1)
+
+    def select(self, queries: torch.Tensor, k: int = 1) -> torch.Tensor:
+        """
+        Returns, for each query, the average of its k nearest patch features.
+        Output shape: (batch_size, feature_dim_HS)
+        """
+        _, indices = self.search(queries, k)
+        return self.features[indices].mean(dim=1)
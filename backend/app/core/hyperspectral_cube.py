@@ -0,0 +1,121 @@
+# backend/app/core/hyperspectral_cube.py
+
+import logging
+import os
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+import spectral as spy
+from rasterio.windows import Window
+
+logger = logging.getLogger(__name__)
+
+ENVI_EXTENSIONS = ('.hdr', '.dat', '.img', '.raw')
+GEOTIFF_EXTENSIONS = ('.tif', '.tiff', '.geotiff')
+
+
+def _envi_header_path(file_path: str) -> str:
+    """ENVI cubes are opened through their .hdr file, which sits next to the data file."""
+    if file_path.lower().endswith('.hdr'):
+        return file_path
+    return f"{os.path.splitext(file_path)[0]}.hdr"
+
+
+class HyperspectralCube:
+    """
+    Lazy handle on an ENVI or GeoTIFF hyperspectral cube.
+    Opening reads only the header. ENVI data is memory-mapped and GeoTIFF data is
+    read through rasterio windows, so only the requested window is ever in memory.
+    Reads can also select bands: only those bands are gathered from the memmap
+    (for band-sequential files only their planes are paged in) or read from the GeoTIFF.
+    Windows are returned as (rows, cols, bands) arrays in the file's data type.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._memmap: Optional[np.ndarray] = None
+        self._src = None
+        lower = file_path.lower()
+        if lower.endswith(ENVI_EXTENSIONS):
+            img = spy.open_image(_envi_header_path(file_path))
+            if img is None:
+                raise ValueError(f"Could not load hyperspectral data from {file_path}")
+            # (rows, cols, bands) view whatever the file's interleave; pages are read on access
+            self._memmap = img.open_memmap(interleave='bip')
+            # The header and the data file
+            self.files: Tuple[str, ...] = (_envi_header_path(file_path), img.filename)
+            self.metadata: Dict[str, Any] = img.metadata
+            self.shape: Tuple[int, int, int] = tuple(self._memmap.shape)
+            self.dtype = self._memmap.dtype
+        elif lower.endswith(GEOTIFF_EXTENSIONS):
+            self._src = rasterio.open(file_path)
+            self.files = (file_path,)
+            self.metadata = {
+                'transform': self._src.transform,
+                'crs': self._src.crs,
+                'nodata': self._src.nodata
+            }
+            self.shape = (self._src.height, self._src.width, self._src.count)
+            self.dtype = np.dtype(self._src.dtypes[0])
+        else:
+            raise ValueError(f"Unsupported file format: {file_path}")
+
+    @property
+    def height(self) -> int:
+        return self.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.shape[1]
+
+    @property
+    def bands(self) -> int:
+        return self.shape[2]
+
+    @property
+    def float32_nbytes(self) -> int:
+        """Size of the whole cube as float32, i.e. what loading it for inference would cost."""
+        return self.height * self.width * self.bands * 4
+
+    def read_window(self, row_start: int, row_end: int, col_start: int = 0, col_end: Optional[int] = None,
+                    bands: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Returns rows [row_start, row_end) and columns [col_start, col_end) with all
+        bands, or only the given band indices (in that order).
+        """
+        col_end = self.width if col_end is None else col_end
+        if self._memmap is not None:
+            window = self._memmap[row_start:row_end, col_start:col_end]
+            return window if bands is None else window[:, :, list(bands)]
+        indexes = None if bands is None else [int(band) + 1 for band in bands]
+        data = self._src.read(indexes, window=Window(col_start, row_start, col_end - col_start, row_end - row_start))
+        return np.transpose(data, (1, 2, 0))
+
+    def read(self, bands: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Reads the whole cube (or only the given bands) into a writable in-memory array."""
+        data = self.read_window(0, self.height, bands=bands)
+        # A plain window of an ENVI memmap is a read-only view of the file; band
+        # selections and GeoTIFF reads are already copies
+        return data if data.flags.writeable else np.array(data)
+
+    def close(self):
+        if self._src is not None:
+            self._src.close()
+            self._src = None
+        self._memmap = None
+
+    def __enter__(self) -> "HyperspectralCube":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_cube(file_path: str) -> HyperspectralCube:
+    """Opens a hyperspectral cube without reading its pixels."""
+    try:
+        return HyperspectralCube(file_path)
+    except Exception as e:
+        logger.error(f"Error opening hyperspectral cube {file_path}: {e}")
+        raise
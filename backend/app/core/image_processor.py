@@ -1,20 +1,96 @@
 # backend/app/core/image_processor.py
 
 from PIL import Image
+import numpy as np
 import torch
 from torchvision import transforms
 import logging
+import os
+import sys
+import time
+from typing import Dict, Tuple
 
 logger = logging.getLogger(__name__)
 
+# --- Configuration ---
+# Decode large images close to the target size instead of at full resolution
+FAST_DECODE = os.environ.get("KRISHI_FAST_DECODE", "1") != "0"
+# The reduced decode keeps at least this many times the target size, so the final
+# antialiased resize still has enough pixels to average over
+DECODE_MARGIN = 2
+
 # Define the same transforms used during training
 # Assuming RGB_IMG_SIZE = (224, 224) from your notebook
 IMAGE_SIZE = (224, 224)
+NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+NORMALIZE_STD = [0.229, 0.224, 0.225]
 preprocess_transform = transforms.Compose([
     transforms.Resize(IMAGE_SIZE),
     transforms.ToTensor(), # Converts PIL Image to Tensor and scales [0, 255] to [0, 1]
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]) # ImageNet normalization
+    transforms.Normalize(mean=NORMALIZE_MEAN, std=NORMALIZE_STD) # ImageNet normalization
 ])
+# ToTensor + Normalize folded into one multiply-subtract on uint8 input: x * scale - offset
+_NORMALIZE_SCALE = (1.0 / (255.0 * torch.tensor(NORMALIZE_STD))).view(3, 1, 1)
+_NORMALIZE_OFFSET = (torch.tensor(NORMALIZE_MEAN) / torch.tensor(NORMALIZE_STD)).view(3, 1, 1)
+# Modes Image.reduce() handles directly; others are converted to RGB first
+_REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA")
+
+def _decode_reduced(img: Image.Image) -> Image.Image:
+    """
+    Decodes an image at the smallest resolution that is still at least
+    DECODE_MARGIN times IMAGE_SIZE. JPEGs are decoded with DCT scaling (1/2, 1/4
+    or 1/8 of full size), so most pixels are never produced; other formats are
+    shrunk by an integer box filter right after decoding.
+    """
+    min_height, min_width = IMAGE_SIZE[0] * DECODE_MARGIN, IMAGE_SIZE[1] * DECODE_MARGIN
+    if img.format == "JPEG":
+        img.draft("RGB", (min_width, min_height))
+    if img.mode not in _REDUCIBLE_MODES:
+        img = img.convert('RGB')
+    factor = min(img.width // min_width, img.height // min_height)
+    if factor > 1:
+        img = img.reduce(factor)
+    return img
+
+def _to_normalized_tensor(img: Image.Image) -> torch.Tensor:
+    """
+    Converts a resized RGB image to a normalized (3, H, W) float tensor with a
+    single uint8 -> float32 copy, normalizing in place.
+    """
+    array = np.array(img, dtype=np.uint8)  # (H, W, 3)
+    tensor = torch.empty((3, array.shape[0], array.shape[1]), dtype=torch.float32)
+    tensor.copy_(torch.from_numpy(array).permute(2, 0, 1))
+    return tensor.mul_(_NORMALIZE_SCALE).sub_(_NORMALIZE_OFFSET)
+
+def _preprocess_timed(image_path: str, fast: bool) -> Tuple[torch.Tensor, Dict[str, float]]:
+    """Runs preprocessing and returns the (1, C, H, W) tensor and per-stage timings in milliseconds."""
+    timings = {}
+    start = time.perf_counter()
+    with Image.open(image_path) as img:
+        if fast:
+            img = _decode_reduced(img)
+        # Verify it's RGB
+        if img.mode != 'RGB':
+            # Convert to RGB if necessary (e.g., RGBA -> RGB)
+            img = img.convert('RGB')
+        img.load()
+        timings["decode_ms"] = (time.perf_counter() - start) * 1000.0
+
+        # Apply transforms
+        if fast:
+            start = time.perf_counter()
+            # Same antialiased bilinear resize as transforms.Resize on a PIL image
+            img = img.resize((IMAGE_SIZE[1], IMAGE_SIZE[0]), Image.BILINEAR)
+            timings["resize_ms"] = (time.perf_counter() - start) * 1000.0
+            start = time.perf_counter()
+            tensor = _to_normalized_tensor(img)
+            timings["normalize_ms"] = (time.perf_counter() - start) * 1000.0
+        else:
+            start = time.perf_counter()
+            tensor = preprocess_transform(img)
+            timings["transform_ms"] = (time.perf_counter() - start) * 1000.0
+    # Add batch dimension (1, C, H, W)
+    return tensor.unsqueeze(0), timings
 
 def preprocess_image(image_path: str) -> torch.Tensor:
     """
@@ -23,17 +99,34 @@ def preprocess_image(image_path: str) -> torch.Tensor:
     """
     try:
         logger.info(f"Preprocessing image: {image_path}")
-        with Image.open(image_path) as img:
-            # Verify it's RGB
-            if img.mode != 'RGB':
-                # Convert to RGB if necessary (e.g., RGBA -> RGB)
-                img = img.convert('RGB')
-            # Apply transforms
-            tensor = preprocess_transform(img)
-            # Add batch dimension (1, C, H, W)
-            tensor = tensor.unsqueeze(0)
-            logger.info(f"Image preprocessed successfully. Shape: {tensor.shape}")
-            return tensor
+        tensor, timings = _preprocess_timed(image_path, FAST_DECODE)
+        stages = ", ".join(f"{name} {ms:.1f}" for name, ms in timings.items())
+        logger.info(f"Image preprocessed successfully. Shape: {tensor.shape} ({stages})")
+        return tensor
     except Exception as e:
         logger.error(f"Error preprocessing image {image_path}: {e}")
-        raise
\ No newline at end of file
+        raise
+
+if __name__ == "__main__":
+    # Usage (from the backend directory): python -m app.core.image_processor <image> [image ...]
+    # Compares per-stage timings of the full and reduced decode paths.
+    logging.basicConfig(level=logging.WARNING)
+    if len(sys.argv) < 2:
+        print("Usage: python -m app.core.image_processor <image> [image ...]")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        with Image.open(path) as img:
+            print(f"{path}: {img.format} {img.width}x{img.height}")
+        reference = None
+        for fast in (False, True):
+            # First run warms up the file cache and the decoders
+            _preprocess_timed(path, fast)
+            tensor, timings = _preprocess_timed(path, fast)
+            total = sum(timings.values())
+            stages = ", ".join(f"{name} {ms:.1f}" for name, ms in timings.items())
+            line = f"  {'reduced' if fast else 'full':>7}: {total:.1f} ms ({stages})"
+            if reference is None:
+                reference = tensor
+            else:
+                line += f", max abs diff vs full {float((tensor - reference).abs().max()):.3f}"
+            print(line)
@@ -0,0 +1,94 @@
+# backend/app/core/inference_batcher.py
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+import torch
+
+from .worker_pool import worker_pool
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Largest number of requests stacked into one forward pass
+MAX_BATCH_SIZE = int(os.environ.get("KRISHI_MAX_BATCH_SIZE", "32"))
+# How long the first request of a batch waits for others to join (milliseconds)
+MAX_WAIT_MS = float(os.environ.get("KRISHI_MAX_WAIT_MS", "5"))
+
+
+class InferenceBatcher:
+    """
+    Collects concurrent inference requests for a few milliseconds and runs them
+    as a single batched forward pass. Each caller gets back its own row of the
+    batch output.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[torch.Tensor], Tuple[torch.Tensor, torch.Tensor, Optional[torch.Tensor], Any]],
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+    ):
+        # predict_fn takes an RGB batch and returns (confidences, class indices, RGB embeddings or None,
+        # the model that produced them)
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def _ensure_worker(self):
+        """Starts the batching loop on the running event loop if it is not already running."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, rgb_tensor: torch.Tensor) -> Tuple[int, float, Optional[torch.Tensor], Any]:
+        """
+        Queues one (1, ...) shaped request and waits for its prediction.
+        Returns (predicted class index, confidence, RGB embedding or None, model).
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rgb_tensor, future))
+        return await future
+
+    async def _collect(self) -> List[tuple]:
+        """Waits for one request, then gathers more until the batch is full or the wait expires."""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        """Batching loop: collect, stack, run one forward pass, hand out results."""
+        while True:
+            batch = await self._collect()
+            # Drop requests whose callers have already gone away
+            batch = [item for item in batch if not item[1].cancelled()]
+            if not batch:
+                continue
+            try:
+                rgb_batch = torch.cat([item[0] for item in batch], dim=0)
+                # Run the forward pass on the worker pool so new requests keep queueing
+                confidences, indices, embeddings, model = await worker_pool.run(self.predict_fn, rgb_batch)
+                logger.info(f"Ran batched inference for {len(batch)} request(s)")
+                for i, (_, future) in enumerate(batch):
+                    if not future.done():
+                        embedding = embeddings[i] if embeddings is not None else None
+                        future.set_result((int(indices[i].item()), float(confidences[i].item()), embedding, model))
+            except Exception as e:
+                logger.error(f"Error during batched inference: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
@@ -0,0 +1,166 @@
+# backend/app/core/inference_modes.py
+
+import copy
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Selectable CPU inference modes for CombinedModel
+#   fp32          - eager FP32, the reference
+#   int8_dynamic  - Linear layers quantized to INT8 at runtime (weights INT8, activations quantized per call)
+#   int8_static   - ResNet trunk statically quantized to INT8 with calibration images (FX graph mode)
+#   channels_last - eager FP32 with NHWC memory layout, which suits oneDNN convolution kernels
+#   compile       - FP32 model with the RGB branch compiled by torch.compile (Inductor)
+INFERENCE_MODES = ("fp32", "int8_dynamic", "int8_static", "channels_last", "compile")
+# Number of calibration images used for int8_static
+CALIBRATION_LIMIT = 32
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+
+
+class ChannelsLastModel(nn.Module):
+    """Wraps CombinedModel so RGB inputs are converted to channels_last before the forward pass."""
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+
+    def embed(self, rgb_img):
+        return self.model.embed(rgb_img.contiguous(memory_format=torch.channels_last))
+
+    def classify(self, hs_feat, rgb_feat):
+        return self.model.classify(hs_feat, rgb_feat)
+
+    def forward(self, hs_feat, rgb_img):
+        return self.classify(hs_feat, self.embed(rgb_img))
+
+
+def list_calibration_images(image_dir: str, limit: int = CALIBRATION_LIMIT) -> List[str]:
+    """Returns up to `limit` image paths from a directory, in a stable order."""
+    if not os.path.isdir(image_dir):
+        return []
+    names = sorted(name for name in os.listdir(image_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+    return [os.path.join(image_dir, name) for name in names[:limit]]
+
+
+def load_image_batch(image_paths: Sequence[str]) -> torch.Tensor:
+    """Preprocesses images into one (N, 3, 224, 224) tensor."""
+    from .image_processor import preprocess_image
+    return torch.cat([preprocess_image(path) for path in image_paths], dim=0)
+
+
+def _quantize_static(model: nn.Module, calibration_batch: Optional[torch.Tensor]) -> nn.Module:
+    """Statically quantizes the ResNet trunk of the RGB branch; the small classifier stays FP32."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    if calibration_batch is None or len(calibration_batch) == 0:
+        # Without real images the activation ranges are only a rough guess
+        logger.warning("No calibration images for int8_static; calibrating with random inputs.")
+        calibration_batch = torch.randn(8, 3, 224, 224)
+
+    backend = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+    torch.backends.quantized.engine = backend
+    trunk = model.rgb_model.base_model
+    prepared = prepare_fx(trunk, get_default_qconfig_mapping(backend), (calibration_batch[:1],))
+    with torch.no_grad():
+        for start in range(0, len(calibration_batch), 8):
+            prepared(calibration_batch[start:start + 8])
+    model.rgb_model.base_model = convert_fx(prepared)
+    return model
+
+
+def apply_inference_mode(model: nn.Module, mode: str, calibration_batch: Optional[torch.Tensor] = None) -> nn.Module:
+    """
+    Returns a copy of an FP32 CombinedModel prepared for the given inference mode.
+    The returned module keeps the forward(hs_feat, rgb_img), embed() and classify() methods.
+    """
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode '{mode}'. Expected one of {INFERENCE_MODES}")
+    if mode == "fp32":
+        return model
+
+    optimized = copy.deepcopy(model).cpu().eval()
+    if mode == "int8_dynamic":
+        from torch.ao.quantization import quantize_dynamic
+        optimized = quantize_dynamic(optimized, {nn.Linear}, dtype=torch.qint8)
+    elif mode == "int8_static":
+        optimized = _quantize_static(optimized, calibration_batch)
+    elif mode == "channels_last":
+        optimized = ChannelsLastModel(optimized)
+    elif mode == "compile":
+        # Compile the RGB branch, which holds nearly all the FLOPs; keeping the
+        # outer module eager preserves the embed()/classify() methods
+        optimized.rgb_model = torch.compile(optimized.rgb_model)
+    optimized.eval()
+    logger.info(f"Prepared model for inference mode '{mode}'")
+    return optimized
+
+
+def _time_per_image(model: nn.Module, hs_feat: torch.Tensor, images: torch.Tensor, repeats: int) -> float:
+    """Mean single-image latency in milliseconds, after one warm-up pass."""
+    with torch.no_grad():
+        model(hs_feat, images[:1])
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for i in range(len(images)):
+                model(hs_feat, images[i:i + 1])
+        elapsed = time.perf_counter() - start
+    return elapsed / (repeats * len(images)) * 1000.0
+
+
+def parity_check(image_paths: Sequence[str], modes: Sequence[str] = INFERENCE_MODES, repeats: int = 3) -> List[Dict]:
+    """
+    Runs every inference mode on a fixed image set and compares it with eager FP32.
+    Reports, per mode, the top-1 agreement with FP32 and the mean per-image latency
+    and speedup relative to FP32.
+    """
+    from .model_loader import build_fp32_model, get_hs_features
+
+    if not image_paths:
+        raise ValueError("parity_check needs at least one image")
+    images = load_image_batch(image_paths)
+    reference = build_fp32_model().cpu().eval()
+    hs_feat = get_hs_features()[0:1].cpu()
+
+    with torch.no_grad():
+        reference_top1 = reference(hs_feat.expand(len(images), -1), images).argmax(dim=1)
+    reference_ms = _time_per_image(reference, hs_feat, images, repeats)
+
+    report = []
+    for mode in modes:
+        try:
+            model = apply_inference_mode(reference, mode, calibration_batch=images)
+            with torch.no_grad():
+                top1 = model(hs_feat.expand(len(images), -1), images).argmax(dim=1)
+            latency_ms = reference_ms if mode == "fp32" else _time_per_image(model, hs_feat, images, repeats)
+            report.append({
+                "mode": mode,
+                "top1_agreement": float((top1 == reference_top1).float().mean().item()),
+                "latency_ms": round(latency_ms, 2),
+                "speedup": round(reference_ms / latency_ms, 2),
+            })
+        except Exception as e:
+            logger.error(f"Inference mode '{mode}' failed: {e}")
+            report.append({"mode": mode, "error": str(e)})
+    return report
+
+
+if __name__ == "__main__":
+    # Usage (from the backend directory): python -m app.core.inference_modes [image_dir]
+    logging.basicConfig(level=logging.WARNING)
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data", "uploads")
+    paths = list_calibration_images(image_dir)
+    print(f"Parity check on {len(paths)} image(s) from {image_dir}")
+    for row in parity_check(paths):
+        if "error" in row:
+            print(f"{row['mode']:>14}: failed ({row['error']})")
+        else:
+            print(f"{row['mode']:>14}: top-1 agreement {row['top1_agreement']:.1%}, "
+                  f"{row['latency_ms']:.2f} ms/image, {row['speedup']:.2f}x vs fp32")
@@ -0,0 +1,340 @@
+# backend/app/core/job_queue.py
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# SQLite file holding the jobs; shared by all server processes on the host
+JOBS_DB_PATH = os.environ.get("KRISHI_JOBS_DB", os.path.join("data", "jobs.db"))
+# Jobs run at the same time by each server process (each job already uses the process's torch threads)
+JOB_WORKERS = int(os.environ.get("KRISHI_JOB_WORKERS", "1"))
+# Jobs allowed to wait in the queue before new submissions are rejected
+MAX_QUEUED_JOBS = int(os.environ.get("KRISHI_MAX_QUEUED_JOBS", "100"))
+# A running job is stopped at its next progress report once it has run this long (seconds)
+JOB_TIMEOUT_SECONDS = float(os.environ.get("KRISHI_JOB_TIMEOUT_SECONDS", "1800"))
+# How often idle workers look for jobs submitted by other processes (seconds)
+JOB_POLL_INTERVAL = 1.0
+# Progress is written to the database at most this often (seconds)
+PROGRESS_WRITE_INTERVAL = 0.5
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED, TIMED_OUT = "queued", "running", "succeeded", "failed", "cancelled", "timed_out"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED, TIMED_OUT)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    timeout_seconds REAL NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+
+class JobQueueFullError(RuntimeError):
+    """Raised when the queue already holds MAX_QUEUED_JOBS waiting jobs."""
+    pass
+
+
+class JobInterruptedError(RuntimeError):
+    """Raised inside a running job when it has to stop early."""
+    status = FAILED
+
+
+class JobCancelledError(JobInterruptedError):
+    """The job was cancelled by a client."""
+    status = CANCELLED
+
+
+class JobTimeoutError(JobInterruptedError):
+    """The job ran longer than its timeout."""
+    status = TIMED_OUT
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+class JobContext:
+    """
+    Handed to a job handler. Handlers call report() as they go: it records the
+    progress and raises JobCancelledError or JobTimeoutError when the job has to
+    stop, so cancellation and timeouts take effect at the next report.
+    """
+
+    def __init__(self, queue: "JobQueue", job_id: str, params: Dict[str, Any], timeout_seconds: float):
+        self.queue = queue
+        self.job_id = job_id
+        self.params = params
+        self._deadline = time.monotonic() + timeout_seconds
+        self._last_write = 0.0
+
+    def check(self):
+        """Raises if the job was cancelled or ran out of time."""
+        if time.monotonic() > self._deadline:
+            raise JobTimeoutError(f"Job {self.job_id} timed out")
+        if self.queue.cancel_requested(self.job_id):
+            raise JobCancelledError(f"Job {self.job_id} was cancelled")
+
+    def report(self, progress: float, message: Optional[str] = None):
+        """Records progress (0 to 1) and stops the job if needed. Writes are throttled."""
+        now = time.monotonic()
+        if message is None and now - self._last_write < PROGRESS_WRITE_INTERVAL:
+            return
+        self._last_write = now
+        self.check()
+        self.queue.update_progress(self.job_id, progress, message)
+
+
+class JobQueue:
+    """
+    Persistent queue of long-running analyses (risk detection, spectral indices).
+    Jobs are stored in SQLite, so their status survives restarts and any server
+    process can answer status requests. Each process runs JOB_WORKERS worker
+    threads that claim queued jobs atomically and run the handler registered for
+    the job's kind.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS,
+                 max_queued: int = MAX_QUEUED_JOBS, timeout_seconds: float = JOB_TIMEOUT_SECONDS):
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.timeout_seconds = timeout_seconds
+        self._handlers: Dict[str, Callable[[JobContext], Dict[str, Any]]] = {}
+        self._threads: List[threading.Thread] = []
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30.0)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _ensure_schema(self):
+        if self._initialized:
+            return
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        with self._connect() as connection:
+            # WAL lets status reads proceed while a worker writes progress
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+        self._initialized = True
+
+    def register_handler(self, kind: str, handler: Callable[[JobContext], Dict[str, Any]]):
+        """handler(context) runs the job and returns its (JSON-serializable) result."""
+        self._handlers[kind] = handler
+
+    def submit(self, kind: str, params: Dict[str, Any], timeout_seconds: Optional[float] = None) -> Dict[str, Any]:
+        """Queues a job and returns its status. Raises JobQueueFullError if the queue is full."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self._ensure_schema()
+        job_id = str(uuid.uuid4())
+        with self._connect() as connection:
+            queued = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= self.max_queued:
+                raise JobQueueFullError(f"Job queue is full ({queued} jobs waiting, limit {self.max_queued})")
+            connection.execute(
+                "INSERT INTO jobs (job_id, kind, params, status, timeout_seconds, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), QUEUED, timeout_seconds or self.timeout_seconds, _now()),
+            )
+        logger.info(f"Queued {kind} job {job_id}")
+        with self._wakeup:
+            self._wakeup.notify()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Status of a job, with its result once it has succeeded. None if unknown."""
+        self._ensure_schema()
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent jobs first, without their results."""
+        self._ensure_schema()
+        query, args = "SELECT * FROM jobs", []
+        if status:
+            query, args = query + " WHERE status = ?", [status]
+        with self._connect() as connection:
+            rows = connection.execute(query + " ORDER BY created_at DESC LIMIT ?", (*args, limit)).fetchall()
+        return [self._to_dict(row, include_result=False) for row in rows]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancels a job. A queued job is cancelled at once; a running job stops at its
+        next progress report. Finished jobs are left unchanged. None if unknown.
+        """
+        self._ensure_schema()
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, message = 'Cancelled before it started' "
+                "WHERE job_id = ? AND status = ?", (CANCELLED, _now(), job_id, QUEUED))
+            connection.execute("UPDATE jobs SET cancel_requested = 1, message = 'Cancellation requested' "
+                               "WHERE job_id = ? AND status = ?", (job_id, RUNNING))
+        return self.get(job_id)
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as connection:
+            row = connection.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def update_progress(self, job_id: str, progress: float, message: Optional[str] = None):
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET progress = ?, message = COALESCE(?, message) WHERE job_id = ?",
+                               (min(1.0, max(0.0, progress)), message, job_id))
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row, include_result: bool = True) -> Dict[str, Any]:
+        job = {
+            "job_id": row["job_id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "progress": round(row["progress"] * 100.0, 1),
+            "message": row["message"],
+            "params": json.loads(row["params"]),
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+        if include_result:
+            job["result"] = json.loads(row["result"]) if row["result"] else None
+        return job
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Atomically moves the oldest queued job to running; safe across processes."""
+        with self._connect() as connection:
+            return connection.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, worker = ? "
+                "WHERE job_id = (SELECT job_id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) "
+                "RETURNING job_id, kind, params, timeout_seconds",
+                (RUNNING, _now(), self._worker_name, QUEUED),
+            ).fetchone()
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+                error: Optional[str] = None, message: Optional[str] = None):
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, message = COALESCE(?, message), finished_at = ?, "
+                "progress = CASE WHEN ? = ? THEN 1.0 ELSE progress END WHERE job_id = ?",
+                (status, json.dumps(result) if result is not None else None, error, message, _now(),
+                 status, SUCCEEDED, job_id),
+            )
+
+    def _run(self, row: sqlite3.Row):
+        job_id, kind = row["job_id"], row["kind"]
+        context = JobContext(self, job_id, json.loads(row["params"]), row["timeout_seconds"])
+        start = time.perf_counter()
+        logger.info(f"Running {kind} job {job_id}")
+        try:
+            handler = self._handlers.get(kind)
+            if handler is None:
+                raise ValueError(f"No handler for job kind {kind}")
+            context.check()
+            result = handler(context)
+            self._finish(job_id, SUCCEEDED, result=result, message="Done")
+            logger.info(f"{kind} job {job_id} finished in {time.perf_counter() - start:.1f} s")
+        except JobInterruptedError as e:
+            logger.warning(f"{kind} job {job_id} stopped: {e}")
+            self._finish(job_id, e.status, error=str(e))
+        except Exception as e:
+            logger.error(f"Error in {kind} job {job_id}: {e}")
+            self._finish(job_id, FAILED, error=str(e))
+
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            try:
+                row = self._claim()
+            except Exception as e:
+                logger.error(f"Error claiming a job: {e}")
+                row = None
+            if row is None:
+                with self._wakeup:
+                    self._wakeup.wait(JOB_POLL_INTERVAL)
+                continue
+            self._run(row)
+
+    def _recover(self):
+        """Jobs left running by a process of this host that no longer exists are marked failed."""
+        host = socket.gethostname()
+        with self._connect() as connection:
+            rows = connection.execute("SELECT job_id, worker FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+            for job_id, worker in rows:
+                worker_host, _, pid = (worker or "").rpartition(":")
+                if worker_host != host or not pid.isdigit():
+                    continue
+                try:
+                    os.kill(int(pid), 0)
+                    continue
+                except ProcessLookupError:
+                    pass
+                except PermissionError:
+                    continue
+                connection.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                                   (FAILED, "Interrupted by a server restart", _now(), job_id))
+                logger.warning(f"Marked interrupted job {job_id} as failed")
+
+    def start(self):
+        """Starts the worker threads. Called when the application starts."""
+        if self._threads:
+            return
+        self._ensure_schema()
+        self._recover()
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"krishi-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Job queue started with {self.workers} worker(s) on {self.db_path}")
+
+    def shutdown(self):
+        """
+        Stops the workers once their current job is done. Jobs still running when the
+        process exits are marked failed by the next start.
+        """
+        logger.info("Shutting down job queue")
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        self._threads = []
+
+    def stats(self) -> Dict[str, Any]:
+        """Job counts per status and the queue settings."""
+        self._ensure_schema()
+        with self._connect() as connection:
+            counts = dict(connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"workers": self.workers, "max_queued": self.max_queued,
+                "timeout_seconds": self.timeout_seconds, "jobs": counts}
+
+# Initialize the shared job queue
+job_queue = JobQueue()
@@ -1,17 +1,41 @@
 # backend/app/core/model_loader.py
 
+import numpy as np
 import torch
+import torch.nn as nn
+import torchvision.models as models
 import os
 import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
+from .inference_modes import apply_inference_mode, list_calibration_images, load_image_batch
+from .onnx_backend import OnnxPredictor, load_onnx_predictor
+from .hs_index import HSFeatureIndex
+from .model_registry import DEFAULT_VERSION, get_version_paths, version_exists
+from .process_runtime import load_weights
 
 logger = logging.getLogger(__name__)
 
 # --- Configuration ---
-MODEL_PATH = os.path.join("data", "models", "combined_model.pth")
-HS_FEATURES_PATH = os.path.join("data", "models", "hs_features.pt")
+# Model version served at startup (see model_registry.py); "default" is the weights directly in data/models
+ACTIVE_MODEL_VERSION = os.environ.get("KRISHI_MODEL_VERSION", DEFAULT_VERSION)
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-# Assuming you know the number of classes from your training
-NUM_RGB_CLASSES = 15 # As defined in your notebook
+# CPU inference mode: fp32, int8_dynamic, int8_static, channels_last or compile (see inference_modes.py)
+INFERENCE_MODE = os.environ.get("KRISHI_INFERENCE_MODE", "fp32")
+# Inference backend: "torch", or "onnx" to run the exported model with ONNX Runtime (falls back to torch)
+INFERENCE_BACKEND = os.environ.get("KRISHI_INFERENCE_BACKEND", "torch")
+# How the HS feature paired with each RGB image is chosen:
+#   "nearest" - average of the HS_TOP_K patch features most similar to the image's RGB embedding
+#   "first"   - always the first patch feature (the original MVP behaviour)
+HS_SELECTION = os.environ.get("KRISHI_HS_SELECTION", "nearest")
+HS_TOP_K = int(os.environ.get("KRISHI_HS_TOP_K", "5"))
+# Images used to calibrate the int8_static mode
+CALIBRATION_DIR = os.environ.get("KRISHI_CALIBRATION_DIR", os.path.join("data", "uploads"))
+# The NUM_RGB_CLASSES should match the number used during training (15 as per the training script)
+NUM_RGB_CLASSES = 15  # As defined in the training script
+# Size of each pre-computed hyperspectral feature vector
+HS_FEATURE_DIM = 128
 # Define PlantVillage class names (must match the order from your training dataset)
 PLANTVILLAGE_CLASSES = [
     'Apple___Apple_scab', 'Apple___Black_rot', 'Apple___Cedar_apple_rust', 'Apple___healthy',
@@ -25,140 +49,162 @@ PLANTVILLAGE_CLASSES = [
     'Tomato___Spider_mites Two-spotted_spider_mite', 'Tomato___Target_Spot', 'Tomato___Tomato_Yellow_Leaf_Curl_Virus', 'Tomato___Tomato_mosaic_virus', 'Tomato___healthy'
 ] # Update this list based on your actual training classes if different
 
-# The NUM_RGB_CLASSES should match the number used during training (15 as per the training script)
-NUM_RGB_CLASSES = 15  # As defined in the training script
+# --- Model Architecture ---
+# Based on the training script (ai_model.py), the model architecture is:
+# CombinedModel contains:
+#   - rgb_model which is an RGBResNet (ResNet18-based with custom fc layer)
+#     - base_model with ResNet structure (conv1, bn1, layer1-4, avgpool, fc)
+#   - classifier with Linear layers
+
+class RGBResNet(nn.Module):
+    """The RGB model part based on the training script."""
+    def __init__(self, output_dim=128):
+        super().__init__()
+        # Use ResNet18 - this will match the trained model
+        self.base_model = models.resnet18(weights=None)  # Don't load pretrained weights since we'll load from our model
+        # Replace the final classification layer to output the feature vector
+        self.base_model.fc = nn.Linear(self.base_model.fc.in_features, output_dim)
+
+    def forward(self, x):
+        return self.base_model(x)
+
+class CombinedModel(nn.Module):
+    """The complete combined model based on the training script."""
+    def __init__(self, final_classes):
+        super().__init__()
+        # The RGB model as defined in the training script
+        self.rgb_model = RGBResNet(output_dim=128)  # Output 128-dim features
+        
+        # The classifier as defined in the training script
+        self.classifier = nn.Sequential(
+            nn.Linear(128 + 128, 256),  # 128 from HS features, 128 from RGB features
+            nn.ReLU(),
+            nn.Dropout(0.3),
+            nn.Linear(256, final_classes)  # Number of final classes
+        )
+
+    def embed(self, rgb_img):
+        """Returns the 128-d RGB feature vector for each image."""
+        return self.rgb_model(rgb_img)
+
+    def classify(self, hs_feat, rgb_feat):
+        """Returns class logits for paired HS features and RGB feature vectors."""
+        combined = torch.cat([hs_feat, rgb_feat], dim=1)
+        return self.classifier(combined)
+
+    def forward(self, hs_feat, rgb_img):
+        return self.classify(hs_feat, self.embed(rgb_img))
 
 # --- Model and Features Loading ---
-model = None
-hs_features = None
 
-def load_model_and_features():
-    """Loads the model and hyperspectral features into memory."""
-    global model, hs_features
+@dataclass
+class LoadedModel:
+    """Everything needed to serve one model version. Swapped in as a whole."""
+    version: str
+    hs_features: torch.Tensor
+    # Nearest-neighbour index over hs_features, built once at load time
+    hs_index: HSFeatureIndex
+    # The torch model; None when the version is served through ONNX Runtime
+    model: Optional[nn.Module]
+    onnx_predictor: Optional[OnnxPredictor]
+    # Identifies the weights and inference settings; cached predictions are keyed by it
+    tag: str
+
+# The version currently serving requests. Replaced atomically by activate_version().
+_active: Optional[LoadedModel] = None
+# Guards loading so concurrent first requests and the warm-up thread load only once
+_load_lock = threading.Lock()
+# Only one rollout (background load + swap) runs at a time
+_rollout_lock = threading.Lock()
+_rollout = {"version": None, "status": "idle", "error": None}
+# Set once a model is loaded and a warm-up forward pass has run
+_ready = threading.Event()
+_warmup_thread = None
+_load_error = None
+
+def build_fp32_model(model_path: Optional[str] = None) -> nn.Module:
+    """Builds CombinedModel and loads the trained FP32 weights, in eval mode on DEVICE."""
+    if model_path is None:
+        model_path = get_version_paths(get_active_version())["model_path"]
+    # Initialize the model with the architecture used in training
+    fp32_model = CombinedModel(final_classes=NUM_RGB_CLASSES)
+    
+    logger.info(f"Loading model from {model_path} on device {DEVICE}...")
+    model_state_dict = load_weights(model_path, map_location=DEVICE)
+    
+    # Load the state dict, allowing for missing keys (like the fc layer which might have different dimensions).
+    # assign=True keeps the (memory-mapped) loaded tensors instead of copying them into
+    # freshly allocated parameters, so server processes share one copy of the weights.
+    fp32_model.load_state_dict(model_state_dict, strict=False, assign=True)
+    fp32_model.to(DEVICE)
+    fp32_model.eval()
+    return fp32_model
+
+def _prepare_for_inference(loaded_model: nn.Module) -> nn.Module:
+    """Applies the configured INFERENCE_MODE to a freshly loaded FP32 model."""
+    if INFERENCE_MODE == "fp32":
+        return loaded_model
+    if DEVICE.type != "cpu":
+        logger.warning(f"Inference mode '{INFERENCE_MODE}' targets CPU; using fp32 on {DEVICE}.")
+        return loaded_model
+    calibration_batch = None
+    if INFERENCE_MODE == "int8_static":
+        calibration_paths = list_calibration_images(CALIBRATION_DIR)
+        if calibration_paths:
+            calibration_batch = load_image_batch(calibration_paths)
+    return apply_inference_mode(loaded_model, INFERENCE_MODE, calibration_batch=calibration_batch)
+
+def _make_tag(version: str, paths: dict) -> str:
+    """Builds the cache tag for a version from its files and the inference settings."""
+    parts = [version, INFERENCE_BACKEND, INFERENCE_MODE, f"{HS_SELECTION}:{HS_TOP_K}"]
+    for path in (paths["model_path"], paths["hs_features_path"]):
+        stat = os.stat(path)
+        parts.append(f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}")
+    return "|".join(parts)
+
+def _warm_up(loaded: LoadedModel):
+    """Runs one dummy forward pass so the first real request doesn't pay for lazy allocations and kernel selection."""
+    if loaded.model is None:
+        loaded.onnx_predictor.predict(
+            np.zeros((1, loaded.hs_features.shape[1]), dtype=np.float32),
+            np.zeros((1, 3, 224, 224), dtype=np.float32),
+        )
+        return
+    with torch.no_grad():
+        dummy_hs = torch.zeros((1, loaded.hs_features.shape[1]), device=DEVICE)
+        dummy_rgb = torch.zeros((1, 3, 224, 224), device=DEVICE)
+        loaded.model(dummy_hs, dummy_rgb)
+
+def load_version(version: str) -> LoadedModel:
+    """
+    Loads a model version from the registry and warms it up.
+    Does not change the active version.
+    """
+    if not version_exists(version):
+        raise FileNotFoundError(f"Model version {version} not found in the registry")
+    paths = get_version_paths(version)
     try:
-        logger.info(f"Loading hyperspectral features from {HS_FEATURES_PATH}...")
-        hs_features = torch.load(HS_FEATURES_PATH, map_location=DEVICE)
-        logger.info(f"Hyperspectral features loaded. Shape: {hs_features.shape}")
-        
-        # Define the model architecture based on the keys in the state dict
-        # From the error message, it looks like the model consists of rgb_model and classifier
-        class CombinedModel(torch.nn.Module):
-            def __init__(self, input_size=128, num_classes=NUM_RGB_CLASSES):
-                super(CombinedModel, self).__init__()
-                
-                import torch.nn as nn
-                
-                # Create the RGB model based on the structure in state dict
-                self.rgb_model = torch.nn.Sequential(
-                    # This is a simplified representation - the actual model would need
-                    # to match the exact structure from training
-                    nn.Conv2d(3, 64, kernel_size=7, stride=2, padding=3, bias=False),  # conv1
-                    nn.BatchNorm2d(64),  # bn1
-                    nn.ReLU(inplace=True),
-                    nn.MaxPool2d(kernel_size=3, stride=2, padding=1),
-                    # Add layer blocks (simplified)
-                    self._make_layer(64, 64, 3),  # layer1 with 3 blocks
-                    self._make_layer(64, 128, 4, stride=2),  # layer2 with 4 blocks
-                    self._make_layer(128, 256, 6, stride=2),  # layer3 with 6 blocks
-                    self._make_layer(256, 512, 3, stride=2),  # layer4 with 3 blocks
-                    nn.AdaptiveAvgPool2d((1, 1)),  # Adaptive avg pooling
-                    nn.Flatten(),  # Flatten
-                    nn.Linear(512, 128),  # fc layer (simplified)
-                )
-                
-                # Classifier layers
-                self.classifier = torch.nn.Sequential(
-                    nn.Linear(128 + input_size, 256),  # Combined HS features and RGB features
-                    nn.ReLU(),
-                    nn.Dropout(0.5),
-                    nn.Linear(256, 128),
-                    nn.ReLU(),
-                    nn.Linear(128, num_classes)
-                )
-                
-            def _make_layer(self, in_channels, out_channels, blocks, stride=1):
-                layers = []
-                layers.append(torch.nn.Conv2d(in_channels, out_channels, kernel_size=3, stride=stride, padding=1, bias=False))
-                layers.append(torch.nn.BatchNorm2d(out_channels))
-                layers.append(torch.nn.ReLU(inplace=True))
-                
-                for _ in range(1, blocks):
-                    layers.append(torch.nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1, bias=False))
-                    layers.append(torch.nn.BatchNorm2d(out_channels))
-                    layers.append(torch.nn.ReLU(inplace=True))
-                
-                return torch.nn.Sequential(*layers)
-            
-            def forward(self, hs_features, rgb_images):
-                # Process RGB images
-                rgb_features = self.rgb_model(rgb_images)
-                
-                # Concatenate hyperspectral features with RGB features
-                combined = torch.cat((hs_features, rgb_features), dim=1)
-                
-                # Classification
-                output = self.classifier(combined)
-                return output
-
-        # Based on the training script (ai_model.py), the actual model architecture is:
-        # CombinedModel contains:
-        #   - rgb_model which is an RGBResNet (ResNet18-based with custom fc layer)
-        #     - base_model with ResNet structure (conv1, bn1, layer1-4, avgpool, fc)
-        #   - classifier with Linear layers
-        
-        import torch.nn as nn
-        import torchvision.models as models
-
-        class RGBResNet(nn.Module):
-            """The RGB model part based on the training script."""
-            def __init__(self, output_dim=128):
-                super().__init__()
-                # Use ResNet18 - this will match the trained model
-                self.base_model = models.resnet18(weights=None)  # Don't load pretrained weights since we'll load from our model
-                # Replace the final classification layer to output the feature vector
-                self.base_model.fc = nn.Linear(self.base_model.fc.in_features, output_dim)
-
-            def forward(self, x):
-                return self.base_model(x)
-
-        class CombinedModel(nn.Module):
-            """The complete combined model based on the training script."""
-            def __init__(self, final_classes):
-                super().__init__()
-                # The RGB model as defined in the training script
-                self.rgb_model = RGBResNet(output_dim=128)  # Output 128-dim features
-                
-                # The classifier as defined in the training script
-                self.classifier = nn.Sequential(
-                    nn.Linear(128 + 128, 256),  # 128 from HS features, 128 from RGB features
-                    nn.ReLU(),
-                    nn.Dropout(0.3),
-                    nn.Linear(256, final_classes)  # Number of final classes
-                )
-
-            def forward(self, hs_feat, rgb_img):
-                rgb_feat = self.rgb_model(rgb_img)
-                combined = torch.cat([hs_feat, rgb_feat], dim=1)
-                out = self.classifier(combined)
-                return out
-
-        # Initialize the actual model with the correct architecture
-        model = CombinedModel(final_classes=NUM_RGB_CLASSES)
-        
-        logger.info(f"Loading model from {MODEL_PATH} on device {DEVICE}...")
-        model_state_dict = torch.load(MODEL_PATH, map_location=DEVICE)
-        
-        # Load the state dict, allowing for missing keys (like the fc layer which might have different dimensions)
-        model.load_state_dict(model_state_dict, strict=False)
-        model.to(DEVICE)
-        model.eval()
-        
-        logger.info("Model loaded successfully with trained weights.")
+        logger.info(f"Loading hyperspectral features from {paths['hs_features_path']}...")
+        loaded_features = load_weights(paths["hs_features_path"], map_location=DEVICE)
+        logger.info(f"Hyperspectral features loaded. Shape: {loaded_features.shape}")
 
-        # Load hyperspectral features
-        logger.info(f"Loading hyperspectral features from {HS_FEATURES_PATH}...")
-        hs_features = torch.load(HS_FEATURES_PATH, map_location=DEVICE)
-        logger.info(f"Hyperspectral features loaded. Shape: {hs_features.shape}")
+        onnx_predictor = load_onnx_predictor(paths["onnx_path"]) if INFERENCE_BACKEND == "onnx" else None
+        # The torch model is only needed without ONNX, or when the exported model
+        # lacks the classifier head that nearest HS selection relies on
+        needs_torch = onnx_predictor is None or (not onnx_predictor.supports_embedding and HS_SELECTION != "first")
+        torch_model = _prepare_for_inference(build_fp32_model(paths["model_path"])) if needs_torch else None
+
+        loaded = LoadedModel(
+            version=version,
+            hs_features=loaded_features,
+            hs_index=HSFeatureIndex(loaded_features),
+            model=torch_model,
+            onnx_predictor=onnx_predictor,
+            tag=_make_tag(version, paths),
+        )
+        _warm_up(loaded)
+        logger.info(f"Model version {version} loaded and warmed up.")
+        return loaded
 
     except FileNotFoundError as e:
         logger.error(f"Model or features file not found: {e}")
@@ -167,23 +213,101 @@ def load_model_and_features():
         logger.error(f"Error loading model or features: {e}")
         raise
 
-def get_model():
-    """Returns the loaded model, loading it if necessary."""
-    if model is None:
-        load_model_and_features()
-    return model
+def get_active() -> LoadedModel:
+    """
+    Returns the model version serving requests, loading the configured one on first use.
+    Callers should fetch this once per request (or batch) so the whole request uses one version.
+    """
+    global _active
+    loaded = _active
+    if loaded is not None:
+        return loaded
+    with _load_lock:
+        if _active is None:
+            _active = load_version(ACTIVE_MODEL_VERSION)
+        return _active
+
+def get_active_version() -> str:
+    """Returns the name of the version serving requests (or the one that will be loaded)."""
+    loaded = _active
+    return loaded.version if loaded is not None else ACTIVE_MODEL_VERSION
+
+def activate_version(version: str):
+    """
+    Loads and warms up a version, then swaps it in atomically. Requests already
+    in flight finish on the previous version; new requests use the new one.
+    """
+    global _active
+    loaded = load_version(version)
+    with _load_lock:
+        previous = _active
+        _active = loaded
+    _ready.set()
+    logger.info(f"Activated model version {version} (previous: {previous.version if previous else None})")
+
+def _run_rollout(version: str):
+    """Background body of start_rollout."""
+    try:
+        activate_version(version)
+        _rollout.update(status="active", error=None)
+    except Exception as e:
+        logger.error(f"Rollout of model version {version} failed: {e}")
+        _rollout.update(status="failed", error=str(e))
+    finally:
+        _rollout_lock.release()
+
+def start_rollout(version: str) -> bool:
+    """
+    Starts loading a version on a background thread and swaps it in once warm.
+    Returns False if another rollout is still in progress.
+    """
+    if not _rollout_lock.acquire(blocking=False):
+        return False
+    _rollout.update(version=version, status="loading", error=None)
+    threading.Thread(target=_run_rollout, args=(version,), name="model-rollout", daemon=True).start()
+    return True
+
+def get_rollout_status() -> dict:
+    """Returns the state of the latest rollout."""
+    return dict(_rollout)
+
+def warm_up():
+    """Loads and warms up the configured model version, then marks this worker ready."""
+    global _load_error
+    try:
+        get_active()
+        _load_error = None
+        _ready.set()
+        logger.info("Model warm-up finished. Ready to serve requests.")
+    except Exception as e:
+        _load_error = str(e)
+        logger.error(f"Model warm-up failed: {e}")
+
+def start_background_warmup():
+    """Starts loading and warming up the model on a background thread."""
+    global _warmup_thread
+    if _ready.is_set() or (_warmup_thread is not None and _warmup_thread.is_alive()):
+        return
+    _warmup_thread = threading.Thread(target=warm_up, name="model-warmup", daemon=True)
+    _warmup_thread.start()
+
+def is_ready() -> bool:
+    """Returns True once the model is loaded and warmed up."""
+    return _ready.is_set()
+
+def get_status() -> dict:
+    """Returns the model lifecycle state for the readiness probe."""
+    if _ready.is_set():
+        return {"status": "ready", "model_version": get_active_version()}
+    if _load_error is not None:
+        return {"status": "failed", "error": _load_error}
+    return {"status": "loading"}
 
 def get_hs_features():
-    """Returns the loaded hyperspectral features, loading them if necessary."""
-    if hs_features is None:
-        load_model_and_features()
-    return hs_features
+    """Returns the active hyperspectral features, loading them if necessary."""
+    return get_active().hs_features
 
 def get_class_names():
     """Returns the list of class names."""
     # Truncate or select based on NUM_RGB_CLASSES if needed
     return PLANTVILLAGE_CLASSES[:NUM_RGB_CLASSES]
-
-# Load model and features when this module is imported
-load_model_and_features()
-logger.info("Model and features loaded at startup.")
\ No newline at end of file
@@ -0,0 +1,127 @@
+# backend/app/core/model_registry.py
+
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+MODELS_DIR = os.path.join("data", "models")
+# Files that make up one model version
+MODEL_FILENAME = "combined_model.pth"
+HS_FEATURES_FILENAME = "hs_features.pt"
+ONNX_FILENAME = "combined_model.onnx"
+MANIFEST_FILENAME = "manifest.json"
+# Weights placed directly in data/models (the original layout) are served as this version
+DEFAULT_VERSION = "default"
+VERSION_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+
+def get_version_dir(version: str) -> str:
+    """Returns the directory holding a model version's files."""
+    if version == DEFAULT_VERSION:
+        return MODELS_DIR
+    if not VERSION_PATTERN.match(version):
+        raise ValueError(f"Invalid model version name: {version}")
+    return os.path.join(MODELS_DIR, version)
+
+
+def get_version_paths(version: str) -> Dict[str, str]:
+    """Returns the model, HS features and ONNX paths for a version."""
+    version_dir = get_version_dir(version)
+    return {
+        "model_path": os.path.join(version_dir, MODEL_FILENAME),
+        "hs_features_path": os.path.join(version_dir, HS_FEATURES_FILENAME),
+        "onnx_path": os.path.join(version_dir, ONNX_FILENAME),
+    }
+
+
+def version_exists(version: str) -> bool:
+    """True if the version has both a weights file and an HS features file."""
+    try:
+        paths = get_version_paths(version)
+    except ValueError:
+        return False
+    return os.path.isfile(paths["model_path"]) and os.path.isfile(paths["hs_features_path"])
+
+
+def _read_manifest(version: str) -> Dict[str, Any]:
+    """Returns a version's manifest.json contents, or an empty dict."""
+    manifest_path = os.path.join(get_version_dir(version), MANIFEST_FILENAME)
+    if not os.path.isfile(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read manifest for model version {version}: {e}")
+        return {}
+
+
+def list_versions() -> List[Dict[str, Any]]:
+    """Lists every complete model version under MODELS_DIR."""
+    names = [DEFAULT_VERSION]
+    if os.path.isdir(MODELS_DIR):
+        names += sorted(
+            name for name in os.listdir(MODELS_DIR)
+            if os.path.isdir(os.path.join(MODELS_DIR, name)) and VERSION_PATTERN.match(name)
+        )
+
+    versions = []
+    for name in names:
+        if not version_exists(name):
+            continue
+        paths = get_version_paths(name)
+        versions.append({
+            "version": name,
+            "has_onnx": os.path.isfile(paths["onnx_path"]),
+            **_read_manifest(name),
+        })
+    return versions
+
+
+def register_version(version: str, model_path: str, hs_features_path: str, description: Optional[str] = None) -> str:
+    """
+    Copies trained weights (e.g. the outputs of scripts/ai_model.py) into a new
+    version directory and writes its manifest. Returns the version directory.
+    """
+    if version == DEFAULT_VERSION:
+        raise ValueError(f"'{DEFAULT_VERSION}' is reserved for the weights in {MODELS_DIR}")
+    version_dir = get_version_dir(version)
+    if os.path.exists(version_dir):
+        raise FileExistsError(f"Model version {version} already exists at {version_dir}")
+
+    # Copy into a temporary directory and rename, so a half-copied version is never listed
+    tmp_dir = f"{version_dir}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    shutil.copyfile(model_path, os.path.join(tmp_dir, MODEL_FILENAME))
+    shutil.copyfile(hs_features_path, os.path.join(tmp_dir, HS_FEATURES_FILENAME))
+    with open(os.path.join(tmp_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump({
+            "description": description or "",
+            "created_at": datetime.utcnow().isoformat() + "Z",
+        }, f, indent=2)
+    os.replace(tmp_dir, version_dir)
+    logger.info(f"Registered model version {version} at {version_dir}")
+    return version_dir
+
+
+if __name__ == "__main__":
+    # Usage (from the backend directory):
+    #   python -m app.core.model_registry list
+    #   python -m app.core.model_registry register <version> <combined_model.pth> <hs_features.pt> [description]
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) >= 2 and sys.argv[1] == "list":
+        for entry in list_versions():
+            print(json.dumps(entry))
+    elif len(sys.argv) >= 5 and sys.argv[1] == "register":
+        register_version(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5] if len(sys.argv) > 5 else None)
+    else:
+        print("Usage: python -m app.core.model_registry list | register <version> <model.pth> <hs_features.pt> [description]")
+        sys.exit(1)
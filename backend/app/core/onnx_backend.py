@@ -0,0 +1,194 @@
+# backend/app/core/onnx_backend.py
+
+import logging
+import os
+import sys
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .process_runtime import CORES_PER_WORKER
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Threads used inside one operator (defaults to this server process's share of the cores;
+# 0 lets ONNX Runtime use all physical cores)
+ONNX_INTRA_OP_THREADS = int(os.environ.get("KRISHI_ONNX_INTRA_OP_THREADS", str(CORES_PER_WORKER)))
+# Threads used to run independent operators in parallel (1 = sequential execution, best for a CNN)
+ONNX_INTER_OP_THREADS = int(os.environ.get("KRISHI_ONNX_INTER_OP_THREADS", "1"))
+ONNX_OPSET = 17
+
+
+def get_head_path(model_path: str) -> str:
+    """Path of the classifier-head graph exported next to the full model."""
+    return f"{os.path.splitext(model_path)[0]}.head.onnx"
+
+
+def export_onnx(model_path: str, output_path: str, opset: int = ONNX_OPSET) -> str:
+    """
+    Exports the FP32 CombinedModel to ONNX with both inputs (hs_feat, rgb_img)
+    and a dynamic batch dimension. Outputs are the class logits and the 128-d
+    RGB feature vector. The classifier head (hs_feat, rgb_feat) -> logits is
+    exported next to it, so HS features can be chosen from the RGB embedding
+    without running the ResNet twice. Returns the output path.
+    """
+    import torch
+    from .model_loader import build_fp32_model, HS_FEATURE_DIM
+
+    class _ExportWrapper(torch.nn.Module):
+        """Exposes the RGB feature vector as a second output next to the logits."""
+        def __init__(self, combined_model):
+            super().__init__()
+            self.model = combined_model
+
+        def forward(self, hs_feat, rgb_img):
+            rgb_feat = self.model.embed(rgb_img)
+            return self.model.classify(hs_feat, rgb_feat), rgb_feat
+
+    class _HeadWrapper(torch.nn.Module):
+        """Only the classifier head of CombinedModel."""
+        def __init__(self, combined_model):
+            super().__init__()
+            self.model = combined_model
+
+        def forward(self, hs_feat, rgb_feat):
+            return self.model.classify(hs_feat, rgb_feat)
+
+    fp32_model = build_fp32_model(model_path).cpu().eval()
+    model = _ExportWrapper(fp32_model).eval()
+    dummy_hs = torch.zeros((1, HS_FEATURE_DIM), dtype=torch.float32)
+    dummy_rgb = torch.zeros((1, 3, 224, 224), dtype=torch.float32)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    logger.info(f"Exporting CombinedModel to ONNX at {output_path} (opset {opset})...")
+    torch.onnx.export(
+        model,
+        (dummy_hs, dummy_rgb),
+        output_path,
+        input_names=["hs_feat", "rgb_img"],
+        output_names=["logits", "rgb_feat"],
+        dynamic_axes={"hs_feat": {0: "batch"}, "rgb_img": {0: "batch"}, "logits": {0: "batch"}, "rgb_feat": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False,
+    )
+    torch.onnx.export(
+        _HeadWrapper(fp32_model).eval(),
+        (dummy_hs, torch.zeros((1, 128), dtype=torch.float32)),
+        get_head_path(output_path),
+        input_names=["hs_feat", "rgb_feat"],
+        output_names=["logits"],
+        dynamic_axes={"hs_feat": {0: "batch"}, "rgb_feat": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False,
+    )
+    logger.info("ONNX export finished.")
+    return output_path
+
+
+def _softmax_top1(logits: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (confidence, class index) of the most likely class for each row of logits."""
+    # Softmax in float32, shifted for numerical stability
+    logits = logits - logits.max(axis=1, keepdims=True)
+    probabilities = np.exp(logits)
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+    predicted_idx = probabilities.argmax(axis=1)
+    confidence = probabilities[np.arange(len(predicted_idx)), predicted_idx]
+    return confidence, predicted_idx
+
+
+class OnnxPredictor:
+    """
+    Runs the exported CombinedModel with ONNX Runtime's CPU execution provider.
+    The torch weights are never loaded; torch itself is still imported, since
+    preprocessing and the model loader use it.
+    """
+
+    def __init__(self, model_path: str,
+                 intra_op_threads: int = ONNX_INTRA_OP_THREADS,
+                 inter_op_threads: int = ONNX_INTER_OP_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+
+        logger.info(f"Loading ONNX model from {model_path}...")
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.model_path = model_path
+        # Models exported before the rgb_feat output was added only return logits
+        self.output_names = [output.name for output in self.session.get_outputs() if output.name in ("logits", "rgb_feat")]
+        # Separate classifier head, used when HS features depend on the RGB embedding
+        head_path = get_head_path(model_path)
+        self.head_session = None
+        if "rgb_feat" in self.output_names and os.path.exists(head_path):
+            self.head_session = ort.InferenceSession(head_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+    @property
+    def supports_embedding(self) -> bool:
+        """True if the exported model can embed and classify in two steps."""
+        return self.head_session is not None
+
+    def embed(self, rgb_batch: np.ndarray) -> np.ndarray:
+        """Returns the (batch_size, 128) RGB feature vectors."""
+        rgb_batch = np.ascontiguousarray(rgb_batch, dtype=np.float32)
+        # The full graph needs an hs_feat input; its logits are discarded
+        dummy_hs = np.zeros((rgb_batch.shape[0], self.session.get_inputs()[0].shape[1]), dtype=np.float32)
+        return self.session.run(["rgb_feat"], {"hs_feat": dummy_hs, "rgb_img": rgb_batch})[0]
+
+    def classify(self, hs_batch: np.ndarray, rgb_feat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Runs the classifier head. Returns (confidences, predicted class indices)."""
+        logits = self.head_session.run(
+            ["logits"],
+            {
+                "hs_feat": np.ascontiguousarray(hs_batch, dtype=np.float32),
+                "rgb_feat": np.ascontiguousarray(rgb_feat, dtype=np.float32),
+            },
+        )[0]
+        return _softmax_top1(logits)
+
+    def predict(self, hs_batch: np.ndarray, rgb_batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        Runs a batch through the model.
+        Returns (confidences, predicted class indices, RGB feature vectors); the
+        feature vectors are None for models exported without the rgb_feat output.
+        """
+        outputs = self.session.run(
+            self.output_names,
+            {
+                "hs_feat": np.ascontiguousarray(hs_batch, dtype=np.float32),
+                "rgb_img": np.ascontiguousarray(rgb_batch, dtype=np.float32),
+            },
+        )
+        rgb_feat = outputs[1] if len(outputs) > 1 else None
+        confidence, predicted_idx = _softmax_top1(outputs[0])
+        return confidence, predicted_idx, rgb_feat
+
+
+def load_onnx_predictor(model_path: str) -> Optional[OnnxPredictor]:
+    """
+    Creates an OnnxPredictor for an exported model.
+    Returns None if onnxruntime or the exported model is unavailable, so callers
+    can fall back to the torch path.
+    """
+    try:
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"ONNX model not found at {model_path}. Export it with `python -m app.core.onnx_backend export`.")
+        return OnnxPredictor(model_path)
+    except Exception as e:
+        logger.warning(f"ONNX Runtime backend unavailable, falling back to torch: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    # Usage (from the backend directory): python -m app.core.onnx_backend export [model_version]
+    from .model_registry import DEFAULT_VERSION, get_version_paths
+
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "export":
+        print("Usage: python -m app.core.onnx_backend export [model_version]")
+        sys.exit(1)
+    paths = get_version_paths(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_VERSION)
+    export_onnx(paths["model_path"], paths["onnx_path"])
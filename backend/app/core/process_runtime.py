@@ -0,0 +1,58 @@
+# backend/app/core/process_runtime.py
+
+import logging
+import os
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Number of server processes on this machine. Uvicorn and gunicorn both read WEB_CONCURRENCY.
+WORKER_PROCESSES = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+# CPU cores each server process may use, so N processes don't oversubscribe the machine
+CORES_PER_WORKER = max(1, (os.cpu_count() or 1) // WORKER_PROCESSES)
+# torch intra-op threads per process (defaults to this process's share of the cores)
+TORCH_THREADS = int(os.environ.get("KRISHI_TORCH_THREADS", str(CORES_PER_WORKER)))
+# Memory-map weight files instead of reading them into each process's heap
+MMAP_WEIGHTS = os.environ.get("KRISHI_MMAP_WEIGHTS", "1") != "0"
+# torch is imported inside the functions so the ONNX Runtime backend can use this module without it
+
+_threads_configured = False
+
+
+def configure_torch_threads(num_threads: int = TORCH_THREADS):
+    """
+    Limits torch to this process's share of the cores. Called once per process at
+    startup, before any inference runs.
+    """
+    import torch
+
+    global _threads_configured
+    if _threads_configured:
+        return
+    torch.set_num_threads(max(1, num_threads))
+    try:
+        # Inter-op parallelism buys nothing for a single CNN and competes with the worker pool
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already fixed once parallel work has started in this process
+        pass
+    _threads_configured = True
+    logger.info(f"torch using {torch.get_num_threads()} thread(s) in this process "
+                f"({WORKER_PROCESSES} server process(es), {os.cpu_count()} core(s))")
+
+
+def load_weights(path: str, map_location=None):
+    """
+    Loads a file saved with torch.save (a state dict or a tensor).
+    On CPU the file is memory-mapped: tensors are backed by the OS page cache, so
+    every server process that loads the same file shares one physical copy,
+    whether the processes were forked or spawned. Files in the legacy
+    (non-zip) format cannot be mapped and are read normally.
+    """
+    import torch
+
+    cpu_target = map_location is None or torch.device(map_location).type == "cpu"
+    if MMAP_WEIGHTS and cpu_target and zipfile.is_zipfile(path):
+        return torch.load(path, map_location="cpu", mmap=True)
+    return torch.load(path, map_location=map_location)
@@ -0,0 +1,121 @@
+# backend/app/core/raster_cache.py
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .disk_cache import DiskCache
+from .hyperspectral_cube import HyperspectralCube
+from app.utils.file_handler import file_content_hash
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+RASTER_CACHE_DIR = os.environ.get("KRISHI_RASTER_CACHE_DIR", os.path.join("data", "cache", "rasters"))
+# Derived rasters kept in memory; least recently used ones are spilled to disk beyond it
+RASTER_CACHE_MAX_MEMORY_BYTES = int(os.environ.get("KRISHI_RASTER_CACHE_MEMORY_MB", "256")) * 1024 * 1024
+# Upper bound for the spilled .npy files; least recently used files are removed beyond it
+RASTER_CACHE_MAX_DISK_BYTES = int(os.environ.get("KRISHI_RASTER_CACHE_DISK_MB", "2048")) * 1024 * 1024
+
+
+def hash_cube(cube: HyperspectralCube) -> str:
+    """Content hash of a cube: the SHA-256 of its files' digests (header and data file for ENVI)."""
+    digests = ":".join(file_content_hash(path) for path in cube.files)
+    return hashlib.sha256(digests.encode()).hexdigest()
+
+
+class RasterCache:
+    """
+    Cache of rasters derived from a cube, such as spectral indices.
+    Keys combine the cube's content hash with everything the raster depends on
+    (e.g. the index name, band indices and parameters), so a re-upload of the
+    same scene hits the cache and different bands never do. Recently used rasters
+    are kept in a memory LRU bounded in bytes; rasters evicted from it are spilled
+    to .npy files, which are memory-mapped back on a hit, with the directory
+    bounded in size. Cached arrays are read-only.
+    """
+
+    def __init__(self, cache_dir: str = RASTER_CACHE_DIR,
+                 max_memory_bytes: int = RASTER_CACHE_MAX_MEMORY_BYTES,
+                 max_disk_bytes: int = RASTER_CACHE_MAX_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = DiskCache(cache_dir, ".npy", max_disk_bytes)
+        self.hits = 0
+        self.misses = 0
+        # Accessed from worker pool and job threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(content_hash: str, *parts) -> str:
+        """Combines a cube's content hash with what the raster was derived with (e.g. an IndexSpec)."""
+        return hashlib.sha256(":".join([content_hash, *map(repr, parts)]).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Returns the cached raster for a key (in memory or memory-mapped from disk), or None."""
+        with self._lock:
+            raster = self._memory.get(key)
+            if raster is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return raster
+
+        raster = self._disk.load(key, lambda path: np.load(path, mmap_mode="r"))
+        with self._lock:
+            if raster is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return raster
+
+    def put(self, key: str, raster: np.ndarray):
+        """Stores a raster in memory, spilling least recently used rasters (or this one, if too large) to disk."""
+        raster = raster.view()
+        raster.flags.writeable = False
+        if raster.nbytes > self.max_memory_bytes:
+            self._spill([(key, raster)])
+            return
+        with self._lock:
+            self._memory_bytes -= self._memory[key].nbytes if key in self._memory else 0
+            self._memory[key] = raster
+            self._memory_bytes += raster.nbytes
+            evicted = self._evict_memory()
+        # Written outside the lock so other threads keep reading
+        self._spill(evicted)
+
+    def _evict_memory(self) -> List[Tuple[str, np.ndarray]]:
+        """Drops least recently used rasters until memory fits. The caller must hold the lock."""
+        evicted = []
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            key, raster = self._memory.popitem(last=False)
+            self._memory_bytes -= raster.nbytes
+            evicted.append((key, raster))
+        return evicted
+
+    def _spill(self, entries: List[Tuple[str, np.ndarray]]):
+        """Writes rasters to .npy files; the disk cache evicts old files until the directory fits."""
+        for key, raster in entries:
+            if raster.nbytes <= self.max_disk_bytes:
+                self._disk.store(key, lambda path: np.save(path, raster))
+
+    def stats(self) -> dict:
+        """Hit/miss counts and memory use, for the admin endpoint."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk.size_bytes(),
+            }
+
+# Initialize the shared raster cache
+raster_cache = RasterCache()
@@ -0,0 +1,100 @@
+# backend/app/core/result_cache.py
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from .disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+CACHE_DIR = os.environ.get("KRISHI_RESULT_CACHE_DIR", os.path.join("data", "cache", "analysis"))
+# Entries kept in memory (each is a 128-d float32 embedding plus the prediction, ~1 KB)
+CACHE_MAX_MEMORY_ENTRIES = int(os.environ.get("KRISHI_RESULT_CACHE_MEMORY_ENTRIES", "10000"))
+# Upper bound for the on-disk cache; least recently used files are removed beyond it
+CACHE_MAX_DISK_BYTES = int(os.environ.get("KRISHI_RESULT_CACHE_DISK_MB", "256")) * 1024 * 1024
+
+
+@dataclass
+class CachedAnalysis:
+    """What we keep for an image we have already analyzed."""
+    embedding: np.ndarray  # 128-d rgb_model output, float32
+    predicted_idx: int
+    confidence: float
+
+
+class ResultCache:
+    """
+    Content-addressed cache of RGB embeddings and predictions.
+    Keys are image hashes combined with a model tag, so changing the model or
+    inference settings never serves stale predictions. Recently used entries are
+    kept in an in-memory LRU; every entry is also persisted as a small .npz file
+    so the cache survives restarts, with the directory bounded in size.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR,
+                 max_memory_entries: int = CACHE_MAX_MEMORY_ENTRIES,
+                 max_disk_bytes: int = CACHE_MAX_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max(1, max_memory_entries)
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, CachedAnalysis]" = OrderedDict()
+        self._disk = DiskCache(cache_dir, ".npz", max_disk_bytes)
+        # Accessed from worker pool threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(image_hash: str, model_tag: str) -> str:
+        """Combines an image hash with the tag of the model that produced the entry."""
+        return hashlib.sha256(f"{model_tag}:{image_hash}".encode()).hexdigest()
+
+    @staticmethod
+    def _read_entry(path: str) -> CachedAnalysis:
+        with np.load(path) as data:
+            return CachedAnalysis(
+                embedding=data["embedding"].astype(np.float32),
+                predicted_idx=int(data["predicted_idx"]),
+                confidence=float(data["confidence"]),
+            )
+
+    def get(self, key: str) -> Optional[CachedAnalysis]:
+        """Returns the cached analysis for a key, or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+
+        entry = self._disk.load(key, self._read_entry)
+        if entry is not None:
+            with self._lock:
+                self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, entry: CachedAnalysis):
+        """Stores an entry in memory and on disk."""
+        with self._lock:
+            self._remember(key, entry)
+        self._disk.store(key, lambda path: np.savez(
+            path,
+            embedding=np.asarray(entry.embedding, dtype=np.float32),
+            predicted_idx=np.int64(entry.predicted_idx),
+            confidence=np.float32(entry.confidence),
+        ))
+
+    def _remember(self, key: str, entry: CachedAnalysis):
+        """Inserts into the memory LRU. The caller must hold the lock."""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+# Initialize the shared result cache
+result_cache = ResultCache()
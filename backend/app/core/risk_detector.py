@@ -1,11 +1,42 @@
 import torch
 import torch.nn as nn
 import numpy as np
-from typing import Tuple, List, Dict, Any
+import os
+from typing import Tuple, List, Dict, Any, Callable, Optional, Union
 import logging
+from .process_runtime import load_weights
+from .hyperspectral_cube import HyperspectralCube
+from .spectral_projection import SpectralProjection, projection_path_for
 
 logger = logging.getLogger(__name__)
 
+# --- Configuration ---
+# Trained SpatialRiskCNN weights; without them the detector uses random weights
+RISK_MODEL_PATH = os.environ.get("KRISHI_RISK_MODEL_PATH", os.path.join("data", "models", "risk_model.pth"))
+# Band reduction applied before the CNN (PCA, 1x1 conv or band subset); used if the file exists.
+# Saved next to the weights, since they are trained on the projected bands.
+RISK_PROJECTION_PATH = os.environ.get("KRISHI_RISK_PROJECTION_PATH", projection_path_for(RISK_MODEL_PATH))
+# Patches run through the model together (32 patches of 32x32x385 float32 are ~50 MB)
+PATCH_BATCH_SIZE = int(os.environ.get("KRISHI_RISK_PATCH_BATCH_SIZE", "32"))
+# How the per-pixel risk map is computed:
+#   "dense" - conv trunk run once over the cube, classifier slid over the feature map
+#   "patch" - every overlapping 32x32 patch classified separately (the reference)
+RISK_INFERENCE_MODE = os.environ.get("KRISHI_RISK_INFERENCE_MODE", "dense")
+# Side of the square tiles processed per trunk pass in dense mode, in pixels (a multiple of 8).
+# Bounds memory: a 256 px tile of a 385-band cube peaks at ~500 MB with its context and activations.
+DENSE_TILE_SIZE = int(os.environ.get("KRISHI_RISK_DENSE_TILE_SIZE", "256"))
+# Extra pixels around each tile; covers the trunk's receptive field, so tiling does not change the features
+DENSE_HALO = 32
+# Cubes larger than this as float32 are streamed from disk instead of loaded (risk analysis endpoint)
+RISK_STREAMING_MB = int(os.environ.get("KRISHI_RISK_STREAMING_MB", "512"))
+# Risk zones smaller than this share of the scene raise no alert
+ALERT_MIN_AREA_FRACTION = float(os.environ.get("KRISHI_ALERT_MIN_AREA_FRACTION", "0.01"))
+# Most alerts reported per scene; the largest zones are kept (0 for no limit)
+MAX_ALERTS = int(os.environ.get("KRISHI_MAX_ALERTS", "50"))
+# The conv trunk downsamples by 8; the classifier sees a 4x4 feature window, i.e. a 32x32 patch
+FEATURE_STRIDE = 8
+DENSE_WINDOW = 4
+
 class SpatialRiskCNN(nn.Module):
     """
     CNN model for detecting stress/pest zones from spectral data
@@ -49,37 +80,72 @@ class SpatialRiskCNN(nn.Module):
         )
         
         self.num_classes = num_classes
+
+    def classify_features(self, features):
+        """Pools a trunk feature map to 4x4 and classifies it (the second half of forward)."""
+        x = self.adaptive_pool(features)
+        x = torch.flatten(x, 1)
+        return self.classifier(x)
+
+    def dense_head(self) -> nn.Sequential:
+        """
+        The classifier as convolutions: the first Linear becomes a 4x4 conv over the
+        flattened 256x4x4 window and the others 1x1 convs. Applied to a trunk feature
+        map it classifies every 32x32 patch (at an 8 px stride) in one pass. Shares the
+        classifier's weights; Dropout is a no-op in eval mode.
+        """
+        first, second, last = self.classifier[1], self.classifier[4], self.classifier[6]
+        conv_first = nn.Conv2d(256, first.out_features, kernel_size=DENSE_WINDOW)
+        conv_first.weight = nn.Parameter(first.weight.view(first.out_features, 256, DENSE_WINDOW, DENSE_WINDOW), requires_grad=False)
+        conv_first.bias = first.bias
+        conv_second = nn.Conv2d(second.in_features, second.out_features, kernel_size=1)
+        conv_second.weight = nn.Parameter(second.weight.view(second.out_features, second.in_features, 1, 1), requires_grad=False)
+        conv_second.bias = second.bias
+        conv_last = nn.Conv2d(last.in_features, last.out_features, kernel_size=1)
+        conv_last.weight = nn.Parameter(last.weight.view(last.out_features, last.in_features, 1, 1), requires_grad=False)
+        conv_last.bias = last.bias
+        return nn.Sequential(conv_first, nn.ReLU(inplace=True), conv_second, nn.ReLU(inplace=True), conv_last).eval()
     
     def forward(self, x):
         # x shape: (batch_size, height, width, channels) -> (batch_size, channels, height, width)
         x = x.permute(0, 3, 1, 2)  # Reorder dimensions for PyTorch conv layers
         
-        x = self.conv_layers(x)
-        x = self.adaptive_pool(x)
-        x = torch.flatten(x, 1)
-        x = self.classifier(x)
-        return x
+        return self.classify_features(self.conv_layers(x))
 
 class RiskDetector:
     """
     Risk detection model that analyzes spectral data for stress/pest zones
     """
-    def __init__(self, model_path: str = None):
+    def __init__(self, model_path: str = None, projection_path: str = None):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         
         # Number of classes: healthy, stress, pest_risk, disease
         self.num_classes = 4
         self.class_names = ["healthy", "stress", "pest_risk", "disease"]
         
+        # Optional band reduction the weights were trained on, stored next to them
+        projection_path = projection_path or (projection_path_for(model_path) if model_path else None)
+        self.projection = None
+        if projection_path and os.path.exists(projection_path):
+            try:
+                self.projection = SpectralProjection.load(projection_path)
+                logger.info(f"Loaded {self.projection.kind} spectral projection: "
+                            f"{self.projection.input_bands} -> {self.projection.output_bands} bands")
+            except Exception as e:
+                logger.warning(f"Could not load spectral projection {projection_path}: {e}. Using all bands.")
+
         # Initialize model
-        self.model = SpatialRiskCNN(num_classes=self.num_classes)
+        input_channels = self.projection.output_bands if self.projection is not None else 385
+        self.model = SpatialRiskCNN(num_classes=self.num_classes, input_channels=input_channels)
         self.model.to(self.device)
         
         # If model path provided, try to load pre-trained weights
-        if model_path and torch.load(model_path, map_location=self.device):
+        if model_path and os.path.exists(model_path):
             try:
-                state_dict = torch.load(model_path, map_location=self.device)
-                self.model.load_state_dict(state_dict)
+                # Memory-mapped, so every server process shares one copy of the weights
+                state_dict = load_weights(model_path, map_location=self.device)
+                self.model.load_state_dict(state_dict, assign=True)
+                self.model.to(self.device)
                 logger.info(f"Loaded pre-trained risk detection model from {model_path}")
             except Exception as e:
                 logger.warning(f"Could not load pre-trained model: {e}. Using untrained model.")
@@ -87,68 +153,70 @@ class RiskDetector:
             logger.info("Initialized risk detection model with random weights")
         
         self.model.eval()
+        # Built after the weights are loaded, since it shares them
+        self.dense_head = self.model.dense_head().to(self.device)
+
+    def _project(self, spectral_data: np.ndarray) -> np.ndarray:
+        """Applies the spectral projection, if any, to a (rows, cols, bands) window."""
+        return spectral_data if self.projection is None else self.projection.apply(spectral_data)
+
+    def _read_projected(self, cube: HyperspectralCube, row_start: int, row_end: int, col_start: int, col_end: int) -> np.ndarray:
+        """Reads a window of a lazy cube and projects it; a band subset reads only its bands."""
+        if self.projection is not None and self.projection.kind == "bands":
+            if cube.bands != self.projection.input_bands:
+                raise ValueError(f"Projection expects {self.projection.input_bands} bands, got {cube.bands}")
+            window = cube.read_window(row_start, row_end, col_start, col_end, bands=self.projection.band_indices)
+            return np.asarray(window, dtype=np.float32)
+        return self._project(cube.read_window(row_start, row_end, col_start, col_end))
     
-    def detect_risk_zones(self, spectral_data: np.ndarray) -> Dict[str, Any]:
+    def detect_risk_zones(self, spectral_data: Union[np.ndarray, HyperspectralCube],
+                          progress: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
         """
-        Detect risk zones in hyperspectral data
+        Detect risk zones in hyperspectral data.
+        spectral_data is a (height, width, bands) array or a lazy HyperspectralCube,
+        which is read tile by tile in dense mode.
+        The risk map (uint8 class indices) and confidence map (float32) are returned
+        as arrays; see risk_maps.save_risk_maps for storing them.
+        progress(fraction), if given, is called as tiles or patch batches finish.
         """
         try:
             # spectral_data shape: (height, width, bands)
             height, width, bands = spectral_data.shape
+            if isinstance(spectral_data, HyperspectralCube):
+                cube = spectral_data
+                read_window = lambda r0, r1, c0, c1: self._read_projected(cube, r0, r1, c0, c1)
+            else:
+                projected = self._project(spectral_data)
+                read_window = lambda r0, r1, c0, c1: projected[r0:r1, c0:c1]
             
-            # Prepare input tensor
-            # Add batch dimension and convert to tensor
-            input_tensor = torch.tensor(spectral_data, dtype=torch.float32).unsqueeze(0).to(self.device)
-            
-            # Run inference
-            with torch.no_grad():
-                outputs = self.model(input_tensor)
-                probabilities = torch.softmax(outputs, dim=1)
-                confidence, predicted_class = torch.max(probabilities, 1)
-                
-                # Convert to numpy for further processing
-                pred_class = predicted_class.cpu().numpy()[0]
-                conf_score = confidence.cpu().numpy()[0]
-                class_probs = probabilities.cpu().numpy()[0]
-            
-            # Create risk map - for each pixel, we'd need to process patches
-            # For MVP, we'll create a simplified version
-            risk_map = np.zeros((height, width), dtype=np.int32)
-            confidence_map = np.zeros((height, width), dtype=np.float32)
-            
-            # This is a simplified approach - in a real implementation,
-            # we'd process overlapping patches of the image
-            patch_size = min(32, min(height, width))  # Use smaller patches for smaller images
-            
-            for i in range(0, height - patch_size + 1, patch_size//2):  # 50% overlap
-                for j in range(0, width - patch_size + 1, patch_size//2):
-                    # Extract patch
-                    patch = spectral_data[i:i+patch_size, j:j+patch_size, :]
-                    
-                    # Pad patch if smaller than expected
-                    if patch.shape[0] < patch_size or patch.shape[1] < patch_size:
-                        padded_patch = np.zeros((patch_size, patch_size, bands), dtype=patch.dtype)
-                        padded_patch[:patch.shape[0], :patch.shape[1], :] = patch
-                        patch = padded_patch
-                    
-                    # Process patch
-                    patch_tensor = torch.tensor(patch, dtype=torch.float32).unsqueeze(0).to(self.device)
-                    
-                    with torch.no_grad():
-                        patch_outputs = self.model(patch_tensor)
-                        patch_probs = torch.softmax(patch_outputs, dim=1)
-                        patch_conf, patch_pred = torch.max(patch_probs, 1)
-                    
-                    # Assign prediction to the patch region
-                    risk_map[i:i+patch_size, j:j+patch_size] = patch_pred.cpu().numpy()[0]
-                    confidence_map[i:i+patch_size, j:j+patch_size] = patch_conf.cpu().numpy()[0]
+            if RISK_INFERENCE_MODE == "dense" and min(height, width) >= FEATURE_STRIDE * DENSE_WINDOW:
+                # The dense pass gives both the risk map and the whole-image prediction
+                risk_map = np.zeros((height, width), dtype=np.uint8)
+                confidence_map = np.zeros((height, width), dtype=np.float32)
+                class_probs = self._predict_dense(read_window, height, width, risk_map, confidence_map, progress)
+            else:
+                spectral_data = np.asarray(read_window(0, height, 0, width))
+                # Prepare input tensor
+                # Add batch dimension and convert to tensor
+                input_tensor = torch.tensor(spectral_data, dtype=torch.float32).unsqueeze(0).to(self.device)
+
+                # Run inference
+                with torch.no_grad():
+                    outputs = self.model(input_tensor)
+                    class_probs = torch.softmax(outputs, dim=1).cpu().numpy()[0]
+
+                # Create risk map from overlapping patches
+                patch_size = min(32, min(height, width))  # Use smaller patches for smaller images
+                risk_map, confidence_map = self._predict_patches(spectral_data, patch_size, max(1, patch_size // 2), progress)  # 50% overlap
+            pred_class = int(class_probs.argmax())
+            conf_score = class_probs[pred_class]
             
             # Generate alerts based on risk zones
             alerts = self._generate_alerts(risk_map, confidence_map, height, width)
             
             result = {
-                "risk_map": risk_map.tolist(),  # Convert to list for JSON serialization
-                "confidence_map": confidence_map.tolist(),
+                "risk_map": risk_map,
+                "confidence_map": confidence_map,
                 "overall_prediction": self.class_names[pred_class],
                 "overall_confidence": float(conf_score),
                 "class_probabilities": {self.class_names[i]: float(class_probs[i]) for i in range(self.num_classes)},
@@ -162,66 +230,356 @@ class RiskDetector:
             logger.error(f"Error in risk detection: {e}")
             raise
     
+    @staticmethod
+    def _patch_starts(length: int, patch_size: int, stride: int) -> List[int]:
+        """Patch offsets along one axis; the last patch is aligned with the edge so every pixel is covered."""
+        starts = list(range(0, length - patch_size + 1, stride))
+        if starts[-1] != length - patch_size:
+            starts.append(length - patch_size)
+        return starts
+
+    def _predict_patches(self, spectral_data: np.ndarray, patch_size: int, stride: int,
+                         progress: Optional[Callable[[float], None]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Classifies overlapping patches in batches of PATCH_BATCH_SIZE and averages the
+        class probabilities of all patches covering each pixel.
+        Returns the per-pixel (risk_map, confidence_map).
+        """
+        height, width, _ = spectral_data.shape
+        # Zero-copy view of every patch: (n_rows, n_cols, bands, patch_size, patch_size)
+        windows = np.lib.stride_tricks.sliding_window_view(spectral_data, (patch_size, patch_size), axis=(0, 1))
+        rows, cols = np.meshgrid(self._patch_starts(height, patch_size, stride),
+                                 self._patch_starts(width, patch_size, stride), indexing="ij")
+        rows, cols = rows.ravel(), cols.ravel()
+
+        prob_sum = np.zeros((height, width, self.num_classes), dtype=np.float32)
+        coverage = np.zeros((height, width, 1), dtype=np.float32)
+        for start in range(0, len(rows), PATCH_BATCH_SIZE):
+            batch_rows, batch_cols = rows[start:start + PATCH_BATCH_SIZE], cols[start:start + PATCH_BATCH_SIZE]
+            # Gathering the batch is the only copy of the patch data
+            patches = torch.from_numpy(np.asarray(windows[batch_rows, batch_cols], dtype=np.float32))
+            with torch.no_grad():
+                # The model expects (batch, height, width, bands)
+                probs = torch.softmax(self.model(patches.permute(0, 2, 3, 1).to(self.device)), dim=1).cpu().numpy()
+            for k, (i, j) in enumerate(zip(batch_rows, batch_cols)):
+                prob_sum[i:i + patch_size, j:j + patch_size] += probs[k]
+                coverage[i:i + patch_size, j:j + patch_size] += 1.0
+            if progress is not None:
+                progress(min(start + PATCH_BATCH_SIZE, len(rows)) / len(rows))
+
+        mean_probs = prob_sum / coverage
+        return mean_probs.argmax(axis=2).astype(np.uint8), mean_probs.max(axis=2)
+
+    def _dense_tile(self, read_window: Callable[[int, int, int, int], np.ndarray], height: int, width: int,
+                    cell_rows: Tuple[int, int], cell_cols: Tuple[int, int]) -> Tuple[np.ndarray, torch.Tensor]:
+        """
+        Dense prediction for one rectangle of feature cells (8x8 pixel blocks).
+        Reads the rectangle plus DENSE_WINDOW - 1 cells of head context and
+        DENSE_HALO pixels of trunk context on each side, so the result matches a
+        pass over the whole scene. Returns the (classes, rows, cols) averaged cell
+        probabilities and the (256, rows, cols) trunk features of the rectangle.
+        """
+        margin = DENSE_WINDOW - 1
+        cells_h, cells_w = height // FEATURE_STRIDE, width // FEATURE_STRIDE
+        lo_r, hi_r = max(0, cell_rows[0] - margin), min(cells_h, cell_rows[1] + margin)
+        lo_c, hi_c = max(0, cell_cols[0] - margin), min(cells_w, cell_cols[1] + margin)
+        start_r, end_r = max(0, lo_r * FEATURE_STRIDE - DENSE_HALO), min(height, hi_r * FEATURE_STRIDE + DENSE_HALO)
+        start_c, end_c = max(0, lo_c * FEATURE_STRIDE - DENSE_HALO), min(width, hi_c * FEATURE_STRIDE + DENSE_HALO)
+
+        # (rows, cols, bands) -> (1, bands, rows, cols), one float32 copy of the window;
+        # always a copy, since torch needs a writable array and memmap windows are read-only
+        window = read_window(start_r, end_r, start_c, end_c)
+        tile = torch.from_numpy(np.array(window.transpose(2, 0, 1), dtype=np.float32, order="C")).unsqueeze(0)
+        with torch.no_grad():
+            features = self.model.conv_layers(tile.to(self.device))
+            off_r, off_c = (lo_r * FEATURE_STRIDE - start_r) // FEATURE_STRIDE, (lo_c * FEATURE_STRIDE - start_c) // FEATURE_STRIDE
+            features = features[:, :, off_r:off_r + hi_r - lo_r, off_c:off_c + hi_c - lo_c]
+            # (1, classes, rows - 3, cols - 3): one prediction per 4x4 feature window
+            window_probs = torch.softmax(self.dense_head(features), dim=1)
+            # Feature cell (a, b) is covered by windows a-3..a and b-3..b: a 4x4 box sum
+            pad = (margin, margin, margin, margin)
+            prob_sum = nn.functional.avg_pool2d(nn.functional.pad(window_probs, pad), DENSE_WINDOW, stride=1, divisor_override=1)
+            coverage = nn.functional.avg_pool2d(nn.functional.pad(torch.ones_like(window_probs[:, :1]), pad),
+                                                DENSE_WINDOW, stride=1, divisor_override=1)
+        rows = slice(cell_rows[0] - lo_r, cell_rows[1] - lo_r)
+        cols = slice(cell_cols[0] - lo_c, cell_cols[1] - lo_c)
+        cell_probs = (prob_sum / coverage)[0, :, rows, cols].cpu().numpy()
+        return cell_probs, features[0, :, rows, cols]
+
+    @staticmethod
+    def _pool_bins(cells: int) -> torch.Tensor:
+        """(4, cells) membership of feature cells in AdaptiveAvgPool2d((4, 4))'s bins along one axis."""
+        bins = torch.zeros(DENSE_WINDOW, cells)
+        for i in range(DENSE_WINDOW):
+            bins[i, (i * cells) // DENSE_WINDOW:-((-(i + 1) * cells) // DENSE_WINDOW)] = 1.0
+        return bins
+
+    @staticmethod
+    def _cells_to_pixels(cells: np.ndarray, rows: int, cols: int) -> np.ndarray:
+        """Expands feature cells to 8x8 pixel blocks; pixels past the last full cell copy the edge."""
+        pixels = np.repeat(np.repeat(cells, FEATURE_STRIDE, axis=0), FEATURE_STRIDE, axis=1)
+        return np.pad(pixels, ((0, rows - pixels.shape[0]), (0, cols - pixels.shape[1])), mode="edge")
+
+    def _predict_dense(self, read_window: Callable[[int, int, int, int], np.ndarray], height: int, width: int,
+                       risk_map: np.ndarray, confidence_map: np.ndarray,
+                       progress: Optional[Callable[[float], None]] = None) -> np.ndarray:
+        """
+        Dense prediction: the classifier is slid over the trunk feature map, which
+        classifies every 32x32 patch at an 8 px stride without recomputing the
+        convolutions of overlapping patches. As in patch mode, each pixel gets the
+        average probabilities of the patches covering it. The scene is processed in
+        DENSE_TILE_SIZE tiles read through read_window(row_start, row_end, col_start,
+        col_end), and each tile's result is written into risk_map and confidence_map
+        (arrays or memmaps), so memory depends on the tile size, not the scene size.
+        Returns the whole-image class probabilities.
+        """
+        cells_h, cells_w = height // FEATURE_STRIDE, width // FEATURE_STRIDE
+        tile_cells = max(1, DENSE_TILE_SIZE // FEATURE_STRIDE)
+        row_bins, col_bins = self._pool_bins(cells_h), self._pool_bins(cells_w)
+        # The whole-image prediction pools the same features bin by bin as the tiles go by
+        pooled = torch.zeros(256, DENSE_WINDOW, DENSE_WINDOW)
+
+        for r0 in range(0, cells_h, tile_cells):
+            r1 = min(r0 + tile_cells, cells_h)
+            for c0 in range(0, cells_w, tile_cells):
+                c1 = min(c0 + tile_cells, cells_w)
+                cell_probs, features = self._dense_tile(read_window, height, width, (r0, r1), (c0, c1))
+                pooled += torch.einsum("crq,ir,jq->cij", features.cpu(), row_bins[:, r0:r1], col_bins[:, c0:c1])
+                # The last tile in each direction extends to the image edge
+                y0, y1 = r0 * FEATURE_STRIDE, height if r1 == cells_h else r1 * FEATURE_STRIDE
+                x0, x1 = c0 * FEATURE_STRIDE, width if c1 == cells_w else c1 * FEATURE_STRIDE
+                risk_map[y0:y1, x0:x1] = self._cells_to_pixels(cell_probs.argmax(axis=0), y1 - y0, x1 - x0)
+                confidence_map[y0:y1, x0:x1] = self._cells_to_pixels(cell_probs.max(axis=0), y1 - y0, x1 - x0)
+                if progress is not None:
+                    progress((r0 * cells_w + c1 * (r1 - r0)) / (cells_h * cells_w))
+
+        pooled /= row_bins.sum(dim=1)[:, None] * col_bins.sum(dim=1)[None, :]
+        with torch.no_grad():
+            logits = self.model.classifier(pooled.flatten().unsqueeze(0).to(self.device))
+        return torch.softmax(logits, dim=1).cpu().numpy()[0]
+
+    def detect_risk_zones_streaming(self, cube: HyperspectralCube, output_prefix: str,
+                                    progress: Optional[Callable[[float], None]] = None) -> Dict[str, Any]:
+        """
+        Out-of-core risk detection for cubes too large to load: tiles are read from
+        the memory-mapped ENVI file (or GeoTIFF windows), and the risk and confidence
+        maps are written tile by tile to <output_prefix>_risk_map.npy and
+        <output_prefix>_confidence_map.npy. Peak memory during inference is that of
+        one DENSE_TILE_SIZE tile, not of the scene; alerts are then labeled in row
+        strips of the written maps.
+        The result holds the maps as memmaps of those files, plus their paths.
+        """
+        risk_map_path = f"{output_prefix}_risk_map.npy"
+        confidence_map_path = f"{output_prefix}_confidence_map.npy"
+        try:
+            height, width = cube.height, cube.width
+            if min(height, width) < FEATURE_STRIDE * DENSE_WINDOW:
+                # Too small for a 32x32 patch; small enough to load
+                return self.detect_risk_zones(cube, progress)
+
+            os.makedirs(os.path.dirname(risk_map_path) or ".", exist_ok=True)
+            risk_map = np.lib.format.open_memmap(risk_map_path, mode="w+", dtype=np.uint8, shape=(height, width))
+            confidence_map = np.lib.format.open_memmap(confidence_map_path, mode="w+", dtype=np.float32, shape=(height, width))
+
+            logger.info(f"Streaming risk detection over {height}x{width}x{cube.bands} cube in {DENSE_TILE_SIZE} px tiles")
+            class_probs = self._predict_dense(lambda r0, r1, c0, c1: self._read_projected(cube, r0, r1, c0, c1),
+                                              height, width, risk_map, confidence_map, progress)
+            risk_map.flush()
+            confidence_map.flush()
+            pred_class = int(class_probs.argmax())
+
+            return {
+                "risk_map": risk_map,
+                "confidence_map": confidence_map,
+                "risk_map_path": risk_map_path,
+                "confidence_map_path": confidence_map_path,
+                "overall_prediction": self.class_names[pred_class],
+                "overall_confidence": float(class_probs[pred_class]),
+                "class_probabilities": {self.class_names[i]: float(class_probs[i]) for i in range(self.num_classes)},
+                "alerts": self._generate_alerts_streaming(risk_map, confidence_map, height, width),
+                "dimensions": {"height": height, "width": width}
+            }
+
+        except Exception as e:
+            logger.error(f"Error in streaming risk detection: {e}")
+            # Don't leave partial maps behind (e.g. when the job was cancelled)
+            for path in (risk_map_path, confidence_map_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
     def _generate_alerts(self, risk_map: np.ndarray, confidence_map: np.ndarray, height: int, width: int) -> List[Dict[str, Any]]:
         """
-        Generate alerts based on risk zones detected
+        Generate alerts based on risk zones detected.
+        Each risk class is labeled once; region areas come from a bincount of the
+        labels and bounding boxes from find_objects, and centroids and mean
+        confidences are computed in one labeled pass for the regions above
+        ALERT_MIN_AREA_FRACTION only. At most MAX_ALERTS regions (the largest) are reported.
         """
         alerts = []
-        
+        areas = []
+        min_area = height * width * ALERT_MIN_AREA_FRACTION
+
         # Find contiguous regions of the same risk class
         from scipy import ndimage
-        
+
         for class_idx in range(1, self.num_classes):  # Skip 'healthy' class (index 0)
-            class_mask = (risk_map == class_idx).astype(np.uint8)
-            
-            if np.any(class_mask):
-                # Label connected components
-                labeled_regions, num_regions = ndimage.label(class_mask)
-                
-                for region_idx in range(1, num_regions + 1):
-                    region_mask = (labeled_regions == region_idx)
-                    region_area = np.sum(region_mask)
-                    
-                    # Only create alerts for significant regions
-                    if region_area > (height * width * 0.01):  # Alert if >1% of image
-                        # Calculate center coordinates and average confidence
-                        region_coords = np.where(region_mask)
-                        center_y = int(np.mean(region_coords[0]))
-                        center_x = int(np.mean(region_coords[1]))
-                        avg_confidence = float(np.mean(confidence_map[region_mask]))
-                        
-                        # Determine risk level based on confidence
-                        if avg_confidence > 0.8:
-                            risk_level = "high"
-                        elif avg_confidence > 0.6:
-                            risk_level = "medium"
-                        else:
-                            risk_level = "low"
-                        
-                        # Generate recommendation based on risk type
-                        recommendation = self._get_recommendation(self.class_names[class_idx])
-                        
-                        alert = {
-                            "risk_type": self.class_names[class_idx],
-                            "risk_level": risk_level,
-                            "zone_coords": {
-                                "center": {"x": center_x, "y": center_y},
-                                "bbox": {
-                                    "x": int(np.min(region_coords[1])),
-                                    "y": int(np.min(region_coords[0])),
-                                    "width": int(np.max(region_coords[1]) - np.min(region_coords[1])),
-                                    "height": int(np.max(region_coords[0]) - np.min(region_coords[0]))
-                                }
-                            },
-                            "area_percentage": round(region_area / (height * width) * 100, 2),
-                            "average_confidence": avg_confidence,
-                            "recommendation": recommendation,
-                            "timestamp": ""
-                        }
-                        
-                        alerts.append(alert)
-        
+            class_mask = risk_map == class_idx
+
+            if not np.any(class_mask):
+                continue
+            # Label connected components
+            labeled_regions, num_regions = ndimage.label(class_mask)
+            region_areas = np.bincount(labeled_regions.ravel(), minlength=num_regions + 1)
+
+            # Only create alerts for significant regions
+            significant = np.flatnonzero(region_areas[1:] > min_area) + 1
+            if MAX_ALERTS > 0 and len(significant) > MAX_ALERTS:
+                # No more than MAX_ALERTS of them can make the final cut
+                largest = np.argsort(-region_areas[significant], kind="stable")[:MAX_ALERTS]
+                significant = np.sort(significant[largest])
+            if len(significant) == 0:
+                continue
+
+            bboxes = ndimage.find_objects(labeled_regions)
+            centers = ndimage.center_of_mass(class_mask, labeled_regions, significant)
+            avg_confidences = ndimage.mean(confidence_map, labeled_regions, significant)
+
+            for region_idx, (center_y, center_x), avg_confidence in zip(significant, centers, avg_confidences):
+                rows, cols = bboxes[region_idx - 1]
+                region_area = int(region_areas[region_idx])
+                alerts.append(self._zone_alert(
+                    class_idx, region_area, (int(center_y), int(center_x)),
+                    (rows.start, rows.stop - 1, cols.start, cols.stop - 1), float(avg_confidence), height, width,
+                ))
+                areas.append(region_area)
+
+        return self._largest_alerts(alerts, areas)
+
+    @staticmethod
+    def _largest_alerts(alerts: List[Dict[str, Any]], areas: List[int]) -> List[Dict[str, Any]]:
+        """Keeps the MAX_ALERTS alerts with the largest zones, in their original order."""
+        if MAX_ALERTS > 0 and len(alerts) > MAX_ALERTS:
+            logger.info(f"Keeping the {MAX_ALERTS} largest of {len(alerts)} risk zones")
+            keep = np.sort(np.argsort(-np.asarray(areas), kind="stable")[:MAX_ALERTS])
+            alerts = [alerts[i] for i in keep]
         return alerts
+
+    def _zone_alert(self, class_idx: int, area: int, center: Tuple[int, int], bbox: Tuple[int, int, int, int],
+                    avg_confidence: float, height: int, width: int) -> Dict[str, Any]:
+        """Builds the alert for one risk zone; center is (y, x) and bbox (min y, max y, min x, max x), inclusive."""
+        # Determine risk level based on confidence
+        if avg_confidence > 0.8:
+            risk_level = "high"
+        elif avg_confidence > 0.6:
+            risk_level = "medium"
+        else:
+            risk_level = "low"
+
+        min_y, max_y, min_x, max_x = bbox
+        return {
+            "risk_type": self.class_names[class_idx],
+            "risk_level": risk_level,
+            "zone_coords": {
+                "center": {"x": center[1], "y": center[0]},
+                "bbox": {"x": min_x, "y": min_y, "width": max_x - min_x, "height": max_y - min_y}
+            },
+            "area_percentage": round(area / (height * width) * 100, 2),
+            "average_confidence": avg_confidence,
+            # Generate recommendation based on risk type
+            "recommendation": self._get_recommendation(self.class_names[class_idx]),
+            "timestamp": ""
+        }
+
+    @staticmethod
+    def _label_strips(risk_map: np.ndarray, confidence_map: np.ndarray, class_idx: int, strip_rows: int) -> np.ndarray:
+        """
+        Statistics of the connected zones of one class, labeled strip by strip so only
+        one strip of masks and labels is in memory. Zones that continue across a strip
+        boundary are merged with a union-find over the labels of the two touching rows.
+        Returns one row per zone, ordered by its first pixel like ndimage.label:
+        (area, sum of y, sum of x, min y, max y, min x, max x, sum of confidence).
+        """
+        from scipy import ndimage
+
+        height, width = risk_map.shape
+        parent: List[int] = []
+        strips = []
+        prev_row = None
+        for r0 in range(0, height, strip_rows):
+            r1 = min(height, r0 + strip_rows)
+            labels, count = ndimage.label(np.asarray(risk_map[r0:r1]) == class_idx)
+            offset = len(parent)
+            if count:
+                flat = labels.ravel()
+                rows = np.repeat(np.arange(r0, r1, dtype=np.float64), width)
+                cols = np.tile(np.arange(width, dtype=np.float64), r1 - r0)
+                confidences = np.asarray(confidence_map[r0:r1], dtype=np.float64).ravel()
+                stats = np.empty((count, 8))
+                stats[:, 0] = np.bincount(flat, minlength=count + 1)[1:]
+                stats[:, 1] = np.bincount(flat, weights=rows, minlength=count + 1)[1:]
+                stats[:, 2] = np.bincount(flat, weights=cols, minlength=count + 1)[1:]
+                for i, (ys, xs) in enumerate(ndimage.find_objects(labels)):
+                    stats[i, 3:7] = (r0 + ys.start, r0 + ys.stop - 1, xs.start, xs.stop - 1)
+                stats[:, 7] = np.bincount(flat, weights=confidences, minlength=count + 1)[1:]
+                strips.append(stats)
+                parent.extend(range(offset, offset + count))
+
+            # Join zones that touch across the boundary with the previous strip
+            first_row = np.where(labels[0] > 0, labels[0] + offset, 0)
+            if prev_row is not None:
+                for a, b in set(zip(prev_row[(prev_row > 0) & (first_row > 0)].tolist(),
+                                    first_row[(prev_row > 0) & (first_row > 0)].tolist())):
+                    root_a, root_b = RiskDetector._find(parent, a - 1), RiskDetector._find(parent, b - 1)
+                    # The smaller label becomes the root, so zones keep the order of their first pixel
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+            prev_row = np.where(labels[-1] > 0, labels[-1] + offset, 0)
+
+        if not parent:
+            return np.empty((0, 8))
+        stats = np.concatenate(strips)
+        roots = np.array([RiskDetector._find(parent, i) for i in range(len(parent))])
+        zones, index = np.unique(roots, return_inverse=True)
+        merged = np.zeros((len(zones), 8))
+        merged[:, 3] = merged[:, 5] = np.inf
+        merged[:, 4] = merged[:, 6] = -np.inf
+        for col in (0, 1, 2, 7):
+            np.add.at(merged[:, col], index, stats[:, col])
+        for col in (3, 5):
+            np.minimum.at(merged[:, col], index, stats[:, col])
+        for col in (4, 6):
+            np.maximum.at(merged[:, col], index, stats[:, col])
+        return merged
+
+    @staticmethod
+    def _find(parent: List[int], i: int) -> int:
+        """Union-find root of label i, halving the path on the way."""
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def _generate_alerts_streaming(self, risk_map: np.ndarray, confidence_map: np.ndarray,
+                                   height: int, width: int) -> List[Dict[str, Any]]:
+        """
+        Same alerts as _generate_alerts for maps too large to label at once (e.g. the
+        memmaps of the streaming path). Zones are labeled in DENSE_TILE_SIZE row strips,
+        so memory grows with the scene width and the number of zones, not its area.
+        """
+        alerts = []
+        areas = []
+        min_area = height * width * ALERT_MIN_AREA_FRACTION
+        for class_idx in range(1, self.num_classes):  # Skip 'healthy' class (index 0)
+            for area, sum_y, sum_x, min_y, max_y, min_x, max_x, sum_confidence in \
+                    self._label_strips(risk_map, confidence_map, class_idx, DENSE_TILE_SIZE):
+                if area > min_area:
+                    alerts.append(self._zone_alert(
+                        class_idx, int(area), (int(sum_y / area), int(sum_x / area)),
+                        (int(min_y), int(max_y), int(min_x), int(max_x)),
+                        float(sum_confidence / area), height, width,
+                    ))
+                    areas.append(int(area))
+        return self._largest_alerts(alerts, areas)
     
     def _get_recommendation(self, risk_type: str) -> str:
         """
@@ -236,4 +594,4 @@ class RiskDetector:
         return recommendations.get(risk_type, "Consult local agricultural expert for appropriate treatment.")
 
 # Initialize the risk detector
-risk_detector = RiskDetector()
\ No newline at end of file
+risk_detector = RiskDetector(RISK_MODEL_PATH, RISK_PROJECTION_PATH)
\ No newline at end of file
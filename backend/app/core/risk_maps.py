@@ -0,0 +1,142 @@
+# backend/app/core/risk_maps.py
+
+import logging
+import math
+import os
+import warnings
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.windows import Window
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Side of the GeoTIFF's internal tiles, and rows written per block
+RASTER_BLOCK_SIZE = 256
+# Confidence in [0, 1] is stored as uint8: value = round(confidence * CONFIDENCE_SCALE)
+CONFIDENCE_SCALE = 255
+# Longest side of a window returned by the map endpoint; larger windows are downsampled
+MAX_WINDOW_SIZE = int(os.environ.get("KRISHI_RISK_MAP_MAX_WINDOW", "1024"))
+
+# Band 1 holds the class index, band 2 the quantized confidence
+CLASS_BAND = 1
+CONFIDENCE_BAND = 2
+
+
+def get_risk_raster_path(upload_id: str) -> str:
+    """Returns the path of the risk/confidence GeoTIFF for an upload."""
+    return os.path.join("data", "results", f"{upload_id}_risk.tif")
+
+
+def overview_factors(height: int, width: int) -> List[int]:
+    """Powers of two until the smallest overview fits in one block."""
+    factors = []
+    factor = 2
+    while max(height, width) / factor >= RASTER_BLOCK_SIZE / 2:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def save_risk_maps(upload_id: str, risk_map: np.ndarray, confidence_map: np.ndarray,
+                   class_names: List[str], transform=None, crs=None) -> Dict[str, Any]:
+    """
+    Writes the class map (uint8) and the quantized confidence map (uint8) as a
+    tiled, DEFLATE-compressed two-band GeoTIFF with nearest-neighbour overviews.
+    The maps are read in RASTER_BLOCK_SIZE row blocks, so memory-mapped maps are
+    never loaded whole. Returns per-class pixel counts and the mean confidence.
+    """
+    try:
+        height, width = risk_map.shape
+        raster_path = get_risk_raster_path(upload_id)
+        os.makedirs(os.path.dirname(raster_path), exist_ok=True)
+        profile = {
+            "driver": "GTiff",
+            "height": height,
+            "width": width,
+            "count": 2,
+            "dtype": "uint8",
+            "tiled": True,
+            "blockxsize": RASTER_BLOCK_SIZE,
+            "blockysize": RASTER_BLOCK_SIZE,
+            "compress": "deflate",
+            "predictor": 2,
+            "transform": transform if transform is not None else rasterio.Affine.identity(),
+            "crs": crs,
+        }
+
+        counts = np.zeros(len(class_names), dtype=np.int64)
+        confidence_sum = 0.0
+        with warnings.catch_warnings():
+            # Scenes without georeferencing are stored in pixel coordinates
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with rasterio.open(raster_path, "w", **profile) as dst:
+                for row in range(0, height, RASTER_BLOCK_SIZE):
+                    classes = np.asarray(risk_map[row:row + RASTER_BLOCK_SIZE], dtype=np.uint8)
+                    confidence = np.asarray(confidence_map[row:row + RASTER_BLOCK_SIZE], dtype=np.float32)
+                    window = Window(0, row, width, classes.shape[0])
+                    dst.write(classes, CLASS_BAND, window=window)
+                    dst.write(np.rint(np.clip(confidence, 0.0, 1.0) * CONFIDENCE_SCALE).astype(np.uint8),
+                              CONFIDENCE_BAND, window=window)
+                    counts += np.bincount(classes.ravel(), minlength=len(class_names))[:len(class_names)]
+                    confidence_sum += float(confidence.sum(dtype=np.float64))
+                dst.set_band_description(CLASS_BAND, "risk_class")
+                dst.set_band_description(CONFIDENCE_BAND, "confidence")
+                dst.update_tags(class_names=",".join(class_names), confidence_scale=str(CONFIDENCE_SCALE))
+                # Class indices can't be averaged, so both bands use nearest neighbour
+                dst.build_overviews(overview_factors(height, width), Resampling.nearest)
+
+        logger.info(f"Risk maps for upload_id {upload_id} saved at {raster_path} ({os.path.getsize(raster_path)} bytes)")
+        return {
+            "class_pixel_counts": {name: int(counts[i]) for i, name in enumerate(class_names)},
+            "class_fractions": {name: round(float(counts[i]) / (height * width), 4) for i, name in enumerate(class_names)},
+            "mean_confidence": confidence_sum / (height * width),
+        }
+
+    except Exception as e:
+        logger.error(f"Error saving risk maps for upload_id {upload_id}: {e}")
+        raise
+
+
+def read_risk_window(upload_id: str, x: int = 0, y: int = 0, width: Optional[int] = None, height: Optional[int] = None,
+                     max_size: int = MAX_WINDOW_SIZE) -> Dict[str, Any]:
+    """
+    Reads a window of the stored risk maps, downsampled (nearest neighbour) so its
+    longest side is at most max_size. Downsampled reads are served from the
+    overviews. Returns the class indices and the confidences of the window.
+    """
+    raster_path = get_risk_raster_path(upload_id)
+    if not os.path.exists(raster_path):
+        raise FileNotFoundError(f"No risk maps for upload_id {upload_id}")
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with rasterio.open(raster_path) as src:
+            # Clip the requested window to the scene
+            x0, y0 = min(max(0, x), src.width), min(max(0, y), src.height)
+            x1 = src.width if width is None else min(src.width, x0 + max(0, width))
+            y1 = src.height if height is None else min(src.height, y0 + max(0, height))
+            if x1 <= x0 or y1 <= y0:
+                raise ValueError("The requested window is outside the risk map.")
+            scale = max(1, math.ceil(max(x1 - x0, y1 - y0) / max(1, max_size)))
+            out_shape = (2, math.ceil((y1 - y0) / scale), math.ceil((x1 - x0) / scale))
+            data = src.read((CLASS_BAND, CONFIDENCE_BAND), window=Window(x0, y0, x1 - x0, y1 - y0),
+                            out_shape=out_shape, resampling=Resampling.nearest)
+            class_names = src.tags().get("class_names", "").split(",")
+            confidence_scale = float(src.tags().get("confidence_scale", CONFIDENCE_SCALE))
+
+    return {
+        "upload_id": upload_id,
+        "x": x0,
+        "y": y0,
+        "width": x1 - x0,
+        "height": y1 - y0,
+        "scale": scale,
+        "class_names": class_names,
+        "risk_map": data[0],
+        "confidence_map": data[1].astype(np.float32) / confidence_scale,
+    }
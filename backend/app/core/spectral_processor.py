@@ -1,13 +1,296 @@
 import numpy as np
-import spectral as spy
 import rasterio
-from typing import Dict, Tuple, Any
+import warnings
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple, Any, Optional, Sequence, Union
 import logging
 import os
 from pathlib import Path
+from rasterio.enums import Resampling
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.windows import Window
+from .hyperspectral_cube import HyperspectralCube, open_cube
+from .raster_cache import RasterCache, raster_cache, hash_cube
+from .risk_maps import RASTER_BLOCK_SIZE, overview_factors
+
+try:
+    import numexpr
+except ImportError:  # Optional; the NumPy path gives the same results
+    numexpr = None
 
 logger = logging.getLogger(__name__)
 
+# --- Configuration ---
+# Pixels per block of the fused index engine; a few float32 planes of this size stay in cache
+INDEX_BLOCK_PIXELS = int(os.environ.get("KRISHI_INDEX_BLOCK_PIXELS", "65536"))
+# Evaluate indices with numexpr (if installed); it pays off on multi-core hosts
+USE_NUMEXPR = os.environ.get("KRISHI_USE_NUMEXPR", "0") == "1"
+
+# Bins of the index histograms computed by compute_index_statistics
+INDEX_HISTOGRAM_BINS = int(os.environ.get("KRISHI_INDEX_HISTOGRAM_BINS", "64"))
+# Scenes whose index arrays fit in this many MB are computed in memory (exact percentiles);
+# larger scenes are streamed block by block (percentiles estimated from the histograms)
+INDEX_IN_MEMORY_MB = int(os.environ.get("KRISHI_INDEX_IN_MEMORY_MB", "256"))
+# Percentiles reported for each index
+INDEX_PERCENTILES = (5, 25, 50, 75, 95)
+
+# Index formulas over two bands a and b, as numexpr expressions, plus the range the result is clipped to.
+# "normalized_difference" and "savi" divide by 1 where the denominator is 0; "ratio" where b is 0.
+INDEX_FORMULAS = {
+    "normalized_difference": ("(a - b) / where(a + b == 0, 1, a + b)", (-1.0, 1.0)),
+    "ratio": ("a / where(b == 0, 1, b)", None),
+    "savi": ("(a - b) / where(a + b + L == 0, 1, a + b + L) * (1 + L)", (-2.0, 2.0)),
+}
+# Histogram range of each formula; ratios (e.g. MSI) are unbounded and beyond 4 count as "above"
+INDEX_HISTOGRAM_RANGES = {
+    "normalized_difference": (-1.0, 1.0),
+    "ratio": (0.0, 4.0),
+    "savi": (-2.0, 2.0),
+}
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """
+    One spectral index for SpectralProcessor.compute_indices: the output name, a key
+    of INDEX_FORMULAS, the (a, b) band indices and any formula parameters (e.g. SAVI's L).
+    Hashable, so it can key caches.
+    """
+    name: str
+    formula: str
+    bands: Tuple[int, int]
+    params: Tuple[Tuple[str, float], ...] = ()
+
+    @classmethod
+    def ndvi(cls, red_band: int = 2, nir_band: int = 3) -> "IndexSpec":
+        return cls("ndvi", "normalized_difference", (nir_band, red_band))
+
+    @classmethod
+    def ndre(cls, red_edge_band: int = 3, nir_band: int = 4) -> "IndexSpec":
+        return cls("ndre", "normalized_difference", (nir_band, red_edge_band))
+
+    @classmethod
+    def msi(cls, nir_band: int = 4, swir_band: int = 5) -> "IndexSpec":
+        return cls("msi", "ratio", (swir_band, nir_band))
+
+    @classmethod
+    def savi(cls, red_band: int = 2, nir_band: int = 4, L: float = 0.5) -> "IndexSpec":
+        return cls("savi", "savi", (nir_band, red_band), (("L", float(L)),))
+
+
+def get_index_raster_path(upload_id: str, name: str) -> str:
+    """Returns the path of the GeoTIFF of one index of an upload."""
+    return os.path.join("data", "results", f"{upload_id}_{name}.tif")
+
+
+def index_specs(analysis_type: str, red_band: int, nir_band: int, red_edge_band: int, swir_band: int) -> Tuple[IndexSpec, ...]:
+    """The indices the spectral route computes for an analysis type ("full" or one index name)."""
+    specs = (
+        IndexSpec.ndvi(red_band, nir_band),
+        IndexSpec.ndre(red_edge_band, nir_band),
+        IndexSpec.msi(nir_band, swir_band),
+        IndexSpec.savi(red_band, nir_band),
+    )
+    return tuple(spec for spec in specs if analysis_type in ("full", spec.name))
+
+
+class IndexStatistics:
+    """
+    Running statistics of one index, updated block by block: count of finite
+    values, min, max, mean and standard deviation (Welford/Chan updates in
+    float64) and a histogram over a fixed range, with the values outside the
+    range counted as below/above. Percentiles are exact for from_array and
+    estimated from the histogram otherwise.
+    """
+
+    def __init__(self, histogram_range: Tuple[float, float], bins: int = INDEX_HISTOGRAM_BINS):
+        self.histogram_range = histogram_range
+        self.count = 0
+        self.invalid_count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        self.below = 0
+        self.above = 0
+        self.exact_percentiles: Optional[Dict[str, float]] = None
+
+    @classmethod
+    def from_array(cls, values: np.ndarray, histogram_range: Tuple[float, float],
+                   percentiles: Sequence[float] = INDEX_PERCENTILES) -> "IndexStatistics":
+        """Statistics of a whole index array, with exact percentiles."""
+        statistics = cls(histogram_range)
+        statistics.update(values)
+        if statistics.count:
+            finite = values[np.isfinite(values)] if statistics.invalid_count else values.ravel()
+            statistics.exact_percentiles = dict(zip(_percentile_keys(percentiles),
+                                                    np.percentile(finite, percentiles).tolist()))
+        return statistics
+
+    def update(self, values: np.ndarray):
+        """Adds a block of index values; NaN and infinite values are only counted as invalid."""
+        values = values.ravel()
+        finite = np.isfinite(values)
+        if not finite.all():
+            self.invalid_count += int(values.size - np.count_nonzero(finite))
+            values = values[finite]
+        n = values.size
+        if n == 0:
+            return
+        deviations = values.astype(np.float64)
+        block_mean = float(deviations.mean())
+        deviations -= block_mean
+        block_m2 = float(np.dot(deviations, deviations))
+        # Chan et al.: merge the block's mean and sum of squared deviations
+        delta = block_mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self._m2 += block_m2 + delta * delta * self.count * n / total
+        self.count = total
+
+        block_min, block_max = float(values.min()), float(values.max())
+        self.min, self.max = min(self.min, block_min), max(self.max, block_max)
+        low, high = self.histogram_range
+        self.histogram += np.histogram(values, bins=len(self.histogram), range=(low, high))[0]
+        if block_min < low:
+            self.below += int(np.count_nonzero(values < low))
+        if block_max > high:
+            self.above += int(np.count_nonzero(values > high))
+
+    @property
+    def std(self) -> float:
+        """Population standard deviation, as np.std."""
+        return float(np.sqrt(self._m2 / self.count)) if self.count else float("nan")
+
+    def percentiles(self, percentiles: Sequence[float] = INDEX_PERCENTILES) -> Dict[str, Optional[float]]:
+        """
+        Exact percentiles if known, otherwise interpolated linearly within the
+        histogram bins. Estimates that fall outside the histogram range are None.
+        """
+        if self.exact_percentiles is not None:
+            return self.exact_percentiles
+        low, high = self.histogram_range
+        edges = np.linspace(low, high, len(self.histogram) + 1)
+        cumulative = (self.below + np.concatenate(([0], np.cumsum(self.histogram)))) * (100.0 / self.count)
+        estimates = np.clip(np.interp(percentiles, cumulative, edges), self.min, self.max)
+        below = np.asarray(percentiles) < cumulative[0]
+        above = np.asarray(percentiles) > cumulative[-1]
+        return {
+            key: None if outside_low or outside_high else value
+            for key, value, outside_low, outside_high in zip(_percentile_keys(percentiles), estimates.tolist(), below, above)
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        empty = self.count == 0
+        return {
+            "count": self.count,
+            "invalid_count": self.invalid_count,
+            "min": None if empty else self.min,
+            "max": None if empty else self.max,
+            "mean": None if empty else self.mean,
+            "std": None if empty else self.std,
+            "percentiles": None if empty else self.percentiles(),
+            "histogram": {
+                "edges": np.linspace(*self.histogram_range, len(self.histogram) + 1).tolist(),
+                "counts": self.histogram.tolist(),
+                "below": self.below,
+                "above": self.above,
+            },
+        }
+
+
+def _percentile_keys(percentiles: Sequence[float]) -> List[str]:
+    return [f"p{q:g}" for q in percentiles]
+
+
+def _index_blocks(data: Union[np.ndarray, HyperspectralCube], specs: Sequence[IndexSpec],
+                  use_numexpr: Optional[bool] = None, out: Optional[Dict[str, np.ndarray]] = None):
+    """
+    The fused index engine: walks the cube in row blocks and yields
+    (row, rows, {name: block}) with every index of the block evaluated. Blocks are
+    slices of out[name] if given, otherwise buffers reused by the next block.
+    """
+    if len(data.shape) != 3:
+        raise ValueError("Data must be 3D (height, width, bands)")
+    height, width, bands = data.shape
+    for spec in specs:
+        if max(spec.bands) >= bands or min(spec.bands) < 0:
+            raise ValueError(f"{spec.name} needs bands {spec.bands}, but the data has {bands} bands")
+    use_numexpr = (USE_NUMEXPR if use_numexpr is None else use_numexpr) and numexpr is not None
+
+    # Every band any index needs, read once per block
+    needed = sorted({band for spec in specs for band in spec.bands})
+    plane = {band: i for i, band in enumerate(needed)}
+    block_rows = max(1, min(height, INDEX_BLOCK_PIXELS // max(1, width)))
+    planes = np.empty((len(needed), block_rows, width), dtype=np.float32)
+    scratch = np.empty((block_rows, width), dtype=np.float32)
+    buffers = None if out is not None else {spec.name: np.empty((block_rows, width), dtype=np.float32) for spec in specs}
+    for row in range(0, height, block_rows):
+        rows = min(block_rows, height - row)
+        # One gather of the needed bands, cast to float32 into the shared planes
+        block = _read_bands(data, row, row + rows, needed)
+        np.copyto(planes[:, :rows], np.moveaxis(block, 2, 0), casting="unsafe")
+        blocks = {}
+        for spec in specs:
+            a, b = (planes[plane[band], :rows] for band in spec.bands)
+            blocks[spec.name] = out[spec.name][row:row + rows] if out is not None else buffers[spec.name][:rows]
+            _evaluate_index(spec, a, b, blocks[spec.name], scratch[:rows], use_numexpr)
+        yield row, rows, blocks
+
+
+def _open_index_raster(path: str, name: str, height: int, width: int, metadata: Dict[str, Any]):
+    """Opens a tiled, compressed float32 GeoTIFF for one index, georeferenced like the cube if it is."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    transform = metadata.get("transform")
+    with warnings.catch_warnings():
+        # Scenes without georeferencing are stored in pixel coordinates
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        dst = rasterio.open(
+            path, "w", driver="GTiff", height=height, width=width, count=1, dtype="float32",
+            tiled=True, blockxsize=RASTER_BLOCK_SIZE, blockysize=RASTER_BLOCK_SIZE,
+            compress="deflate", predictor=3,
+            transform=transform if transform is not None else rasterio.Affine.identity(),
+            crs=metadata.get("crs"),
+        )
+    dst.set_band_description(1, name)
+    return dst
+
+
+def _read_bands(data: Union[np.ndarray, HyperspectralCube], row_start: int, row_end: int, bands: Sequence[int]) -> np.ndarray:
+    """Rows [row_start, row_end) of the given bands, from an array or a lazy cube."""
+    if isinstance(data, HyperspectralCube):
+        return data.read_window(row_start, row_end, bands=bands)
+    return data[row_start:row_end, :, list(bands)]
+
+
+def _evaluate_index(spec: IndexSpec, a: np.ndarray, b: np.ndarray, out: np.ndarray, scratch: np.ndarray, use_numexpr: bool):
+    """Evaluates one index on float32 band planes into out, using scratch for the denominator."""
+    expression, clip_range = INDEX_FORMULAS[spec.formula]
+    params = {name: np.float32(value) for name, value in spec.params}
+    if use_numexpr:
+        numexpr.evaluate(expression, local_dict={"a": a, "b": b, **params}, out=out, casting="same_kind")
+    else:
+        # Same formulas with in-place NumPy operations on the block
+        if spec.formula == "ratio":
+            np.copyto(scratch, b)
+        else:
+            np.add(a, b, out=scratch)
+            if "L" in params:
+                scratch += params["L"]
+        scratch[scratch == 0] = 1
+        if spec.formula == "ratio":
+            np.divide(a, scratch, out=out)
+        else:
+            np.subtract(a, b, out=out)
+            out /= scratch
+            if "L" in params:
+                out *= 1 + params["L"]
+    if clip_range is not None:
+        np.clip(out, clip_range[0], clip_range[1], out=out)
+
+
 class SpectralProcessor:
     """
     Handles hyperspectral/multispectral data processing and spectral index computation
@@ -16,160 +299,190 @@ class SpectralProcessor:
     def __init__(self):
         pass
     
-    def load_hyperspectral_data(self, file_path: str) -> Dict[str, Any]:
+    def load_hyperspectral_data(self, file_path: str, bands: Optional[Sequence[int]] = None,
+                                window: Optional[Tuple[int, int, int, int]] = None, lazy: bool = False) -> Dict[str, Any]:
         """
         Load hyperspectral data from ENVI/TIFF files
+        Only the given band indices and window (row_start, row_end, col_start, col_end)
+        are read. With lazy=True no pixels are read: 'data' is the open
+        HyperspectralCube, which compute_indices and the risk detector accept directly
+        (they then read only the bands and blocks they need). Close it when done.
         """
         try:
-            if file_path.endswith('.hdr') or file_path.endswith('.dat'):
-                # ENVI format
-                img = spy.open_image(file_path)
-                if img is None:
-                    raise ValueError(f"Could not load hyperspectral data from {file_path}")
-                
-                data = img.load()
-                metadata = img.metadata
-                
-                return {
-                    'data': data,
-                    'metadata': metadata,
-                    'shape': data.shape,
-                    'bands': data.shape[2] if len(data.shape) == 3 else 1
-                }
-            elif file_path.lower().endswith(('.tif', '.tiff', '.geotiff')):
-                # GeoTIFF format
-                with rasterio.open(file_path) as src:
-                    data = src.read()  # Shape: (bands, height, width)
-                    metadata = {
-                        'transform': src.transform,
-                        'crs': src.crs,
-                        'nodata': src.nodata
-                    }
-                    
-                # Transpose to (height, width, bands) format
-                data = np.transpose(data, (1, 2, 0))
-                
-                return {
-                    'data': data,
-                    'metadata': metadata,
-                    'shape': data.shape,
-                    'bands': data.shape[2] if len(data.shape) == 3 else 1
-                }
+            cube = open_cube(file_path)
+            if lazy:
+                if bands is not None or window is not None:
+                    cube.close()
+                    raise ValueError("bands and window select what is read; a lazy cube is read on demand")
+                data = cube
             else:
-                raise ValueError(f"Unsupported file format: {file_path}")
+                with cube:
+                    if window is None:
+                        data = cube.read(bands)
+                    else:
+                        data = np.asarray(cube.read_window(*window, bands=bands))
+            
+            return {
+                'data': data,
+                'metadata': cube.metadata,
+                'shape': tuple(data.shape),
+                'bands': data.shape[2] if len(data.shape) == 3 else 1
+            }
         except Exception as e:
             logger.error(f"Error loading hyperspectral data from {file_path}: {e}")
             raise
     
-    def compute_ndvi(self, data: np.ndarray, red_band: int = 2, nir_band: int = 3) -> np.ndarray:
+    def compute_indices(self, data: Union[np.ndarray, HyperspectralCube], specs: Sequence[IndexSpec],
+                        out: Optional[Dict[str, np.ndarray]] = None, use_numexpr: Optional[bool] = None,
+                        progress: Optional[Callable[[float], None]] = None) -> Dict[str, np.ndarray]:
         """
-        Compute Normalized Difference Vegetation Index (NDVI)
-        NDVI = (NIR - Red) / (NIR + Red)
+        Computes several spectral indices in one pass over a (height, width, bands) array
+        or a lazy HyperspectralCube (then only the needed bands of each block are read).
+        The cube is walked in blocks of about INDEX_BLOCK_PIXELS pixels. Each band used
+        by any index is read and cast to float32 once per block, and every index is
+        evaluated on the block while it is still in cache, into preallocated float32
+        outputs (pass out={name: array} to reuse them). numexpr evaluates each index
+        without temporaries when it is installed (use_numexpr=None means USE_NUMEXPR).
+        Returns {spec.name: (height, width) float32 array}.
         """
         try:
-            if len(data.shape) != 3:
-                raise ValueError("Data must be 3D (height, width, bands)")
-            
-            red = data[:, :, red_band]
-            nir = data[:, :, nir_band]
-            
-            # Calculate NDVI
-            numerator = nir.astype(np.float32) - red.astype(np.float32)
-            denominator = nir.astype(np.float32) + red.astype(np.float32)
-            
-            # Avoid division by zero
-            denominator = np.where(denominator == 0, 1, denominator)
-            
-            ndvi = numerator / denominator
-            
-            # Clip values to [-1, 1] range
-            ndvi = np.clip(ndvi, -1, 1)
-            
-            return ndvi
+            height, width = data.shape[:2]
+            results = out if out is not None else {}
+            for spec in specs:
+                if spec.name not in results:
+                    results[spec.name] = np.empty((height, width), dtype=np.float32)
+            for row, rows, _ in _index_blocks(data, specs, use_numexpr, results):
+                if progress is not None:
+                    progress((row + rows) / height)
+            return results
         except Exception as e:
-            logger.error(f"Error computing NDVI: {e}")
+            logger.error(f"Error computing spectral indices: {e}")
             raise
-    
-    def compute_ndre(self, data: np.ndarray, red_edge_band: int = 3, nir_band: int = 4) -> np.ndarray:
+
+    def cached_indices(self, data: Union[np.ndarray, HyperspectralCube], specs: Sequence[IndexSpec],
+                       progress: Optional[Callable[[float], None]] = None) -> Dict[str, np.ndarray]:
         """
-        Compute Normalized Difference Red Edge Index (NDRE)
-        NDRE = (NIR - Red Edge) / (NIR + Red Edge)
+        compute_indices through the derived-raster cache. Indices of a cube are keyed
+        by its content hash and the IndexSpec (name, formula, bands, parameters):
+        cached ones are served from raster_cache, and only the missing ones are
+        computed, in one pass, and stored. The returned arrays are read-only.
+        Arrays that are not backed by a file are computed without the cache.
         """
+        if not isinstance(data, HyperspectralCube):
+            return self.compute_indices(data, specs, progress=progress)
         try:
-            if len(data.shape) != 3:
-                raise ValueError("Data must be 3D (height, width, bands)")
-            
-            red_edge = data[:, :, red_edge_band]
-            nir = data[:, :, nir_band]
-            
-            # Calculate NDRE
-            numerator = nir.astype(np.float32) - red_edge.astype(np.float32)
-            denominator = nir.astype(np.float32) + red_edge.astype(np.float32)
-            
-            # Avoid division by zero
-            denominator = np.where(denominator == 0, 1, denominator)
-            
-            ndre = numerator / denominator
-            
-            # Clip values to [-1, 1] range
-            ndre = np.clip(ndre, -1, 1)
-            
-            return ndre
+            content_hash = hash_cube(data)
+            keys = {spec.name: RasterCache.make_key(content_hash, spec) for spec in specs}
+            results = {}
+            for spec in specs:
+                cached = raster_cache.get(keys[spec.name])
+                if cached is not None and cached.shape == tuple(data.shape[:2]):
+                    results[spec.name] = cached
+            missing = [spec for spec in specs if spec.name not in results]
+            if missing:
+                computed = self.compute_indices(data, missing, progress=progress)
+                for spec in missing:
+                    raster_cache.put(keys[spec.name], computed[spec.name])
+                    computed[spec.name].flags.writeable = False
+                    results[spec.name] = computed[spec.name]
+            elif progress is not None:
+                progress(1.0)
+            logger.info(f"Spectral indices of {data.file_path}: {len(specs) - len(missing)} cached, {len(missing)} computed")
+            return {spec.name: results[spec.name] for spec in specs}
         except Exception as e:
-            logger.error(f"Error computing NDRE: {e}")
+            logger.error(f"Error computing cached spectral indices: {e}")
             raise
-    
-    def compute_msi(self, data: np.ndarray, nir_band: int = 4, swir_band: int = 5) -> np.ndarray:
+
+    def compute_index_statistics(self, data: Union[np.ndarray, HyperspectralCube], specs: Sequence[IndexSpec],
+                                 raster_paths: Optional[Dict[str, str]] = None,
+                                 on_block: Optional[Callable[[int, Dict[str, np.ndarray]], None]] = None,
+                                 use_numexpr: Optional[bool] = None,
+                                 progress: Optional[Callable[[float], None]] = None) -> Dict[str, "IndexStatistics"]:
         """
-        Compute Moisture Stress Index (MSI)
-        MSI = SWIR / NIR
+        Tiled mode of compute_indices for scenes too large to hold as index arrays:
+        the indices of each row block go into IndexStatistics accumulators and are
+        then dropped, so memory depends on INDEX_BLOCK_PIXELS, not on the scene.
+        raster_paths={name: path} also writes those indices block by block to
+        float32 GeoTIFFs. on_block(row, {name: block}), if given, sees every block
+        before it is reused (copy what you keep).
+        Returns {spec.name: IndexStatistics}.
         """
         try:
-            if len(data.shape) != 3:
-                raise ValueError("Data must be 3D (height, width, bands)")
-            
-            nir = data[:, :, nir_band]
-            swir = data[:, :, swir_band]
-            
-            # Calculate MSI
-            # Avoid division by zero
-            nir_safe = np.where(nir == 0, 1, nir)
-            
-            msi = swir.astype(np.float32) / nir_safe.astype(np.float32)
-            
-            return msi
+            height, width = data.shape[:2]
+            statistics = {spec.name: IndexStatistics(INDEX_HISTOGRAM_RANGES[spec.formula]) for spec in specs}
+            metadata = data.metadata if isinstance(data, HyperspectralCube) else {}
+            with ExitStack() as stack:
+                rasters = {
+                    name: stack.enter_context(_open_index_raster(path, name, height, width, metadata))
+                    for name, path in (raster_paths or {}).items()
+                }
+                for row, rows, blocks in _index_blocks(data, specs, use_numexpr):
+                    for name, block in blocks.items():
+                        statistics[name].update(block)
+                        if name in rasters:
+                            rasters[name].write(block, 1, window=Window(0, row, width, rows))
+                    if on_block is not None:
+                        on_block(row, blocks)
+                    if progress is not None:
+                        progress((row + rows) / height)
+                for dst in rasters.values():
+                    dst.build_overviews(overview_factors(height, width), Resampling.average)
+            return statistics
         except Exception as e:
-            logger.error(f"Error computing MSI: {e}")
+            logger.error(f"Error computing spectral index statistics: {e}")
             raise
-    
-    def compute_savi(self, data: np.ndarray, red_band: int = 2, nir_band: int = 4, L: float = 0.5) -> np.ndarray:
+
+    def index_statistics(self, indices: Dict[str, np.ndarray], specs: Sequence[IndexSpec]) -> Dict[str, IndexStatistics]:
+        """Statistics, with exact percentiles, of index arrays from compute_indices."""
+        return {
+            spec.name: IndexStatistics.from_array(indices[spec.name], INDEX_HISTOGRAM_RANGES[spec.formula])
+            for spec in specs if spec.name in indices
+        }
+
+    def save_index_rasters(self, indices: Dict[str, np.ndarray], raster_paths: Dict[str, str],
+                           metadata: Optional[Dict[str, Any]] = None):
+        """Writes index arrays from compute_indices as float32 GeoTIFFs, like compute_index_statistics does."""
+        try:
+            for name, path in raster_paths.items():
+                height, width = indices[name].shape
+                with _open_index_raster(path, name, height, width, metadata or {}) as dst:
+                    dst.write(indices[name], 1)
+                    dst.build_overviews(overview_factors(height, width), Resampling.average)
+        except Exception as e:
+            logger.error(f"Error saving index rasters: {e}")
+            raise
+
+    def compute_ndvi(self, data: Union[np.ndarray, HyperspectralCube], red_band: int = 2, nir_band: int = 3) -> np.ndarray:
+        """
+        Compute Normalized Difference Vegetation Index (NDVI)
+        NDVI = (NIR - Red) / (NIR + Red)
+        """
+        spec = IndexSpec.ndvi(red_band, nir_band)
+        return self.compute_indices(data, [spec])[spec.name]
+
+    def compute_ndre(self, data: Union[np.ndarray, HyperspectralCube], red_edge_band: int = 3, nir_band: int = 4) -> np.ndarray:
+        """
+        Compute Normalized Difference Red Edge Index (NDRE)
+        NDRE = (NIR - Red Edge) / (NIR + Red Edge)
+        """
+        spec = IndexSpec.ndre(red_edge_band, nir_band)
+        return self.compute_indices(data, [spec])[spec.name]
+
+    def compute_msi(self, data: Union[np.ndarray, HyperspectralCube], nir_band: int = 4, swir_band: int = 5) -> np.ndarray:
+        """
+        Compute Moisture Stress Index (MSI)
+        MSI = SWIR / NIR
+        """
+        spec = IndexSpec.msi(nir_band, swir_band)
+        return self.compute_indices(data, [spec])[spec.name]
+
+    def compute_savi(self, data: Union[np.ndarray, HyperspectralCube], red_band: int = 2, nir_band: int = 4, L: float = 0.5) -> np.ndarray:
         """
         Compute Soil-Adjusted Vegetation Index (SAVI)
         SAVI = ((NIR - Red) / (NIR + Red + L)) * (1 + L)
         """
-        try:
-            if len(data.shape) != 3:
-                raise ValueError("Data must be 3D (height, width, bands)")
-            
-            red = data[:, :, red_band]
-            nir = data[:, :, nir_band]
-            
-            # Calculate SAVI
-            numerator = (nir - red).astype(np.float32)
-            denominator = (nir + red + L).astype(np.float32)
-            
-            # Avoid division by zero
-            denominator = np.where(denominator == 0, 1, denominator)
-            
-            savi = (numerator / denominator) * (1 + L)
-            
-            # Clip values to [-1, 1] range (though SAVI can exceed these bounds)
-            savi = np.clip(savi, -2, 2)
-            
-            return savi
-        except Exception as e:
-            logger.error(f"Error computing SAVI: {e}")
-            raise
+        spec = IndexSpec.savi(red_band, nir_band, L)
+        return self.compute_indices(data, [spec])[spec.name]
     
     def generate_health_map(self, ndvi: np.ndarray) -> np.ndarray:
         """
@@ -0,0 +1,245 @@
+# backend/app/core/spectral_projection.py
+
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Pixels sampled from a cube when fitting PCA
+PCA_SAMPLE_PIXELS = 200_000
+# Rows read per block while fitting
+FIT_BLOCK_ROWS = 64
+
+PROJECTION_KINDS = ("pca", "conv1x1", "bands")
+
+
+def projection_path_for(model_path: str) -> str:
+    """The projection is stored next to the weights trained on it: risk_model.pth -> risk_model_projection.npz."""
+    return f"{os.path.splitext(model_path)[0]}_projection.npz"
+
+
+class SpectralProjection:
+    """
+    Per-pixel reduction of the spectral bands applied before SpatialRiskCNN.
+    Three kinds are supported:
+      "pca"     - projection on principal components fitted offline (fit_pca)
+      "conv1x1" - a learned 1x1 convolution (from_conv1x1)
+      "bands"   - an explicit subset of the bands (band_subset)
+    Works on (..., bands) arrays such as the windows read from a cube, so it can be
+    applied tile by tile before the conv trunk.
+    """
+
+    def __init__(self, kind: str, input_bands: int, weight: Optional[np.ndarray] = None,
+                 bias: Optional[np.ndarray] = None, band_indices: Optional[np.ndarray] = None,
+                 mean: Optional[np.ndarray] = None, explained_variance: Optional[float] = None):
+        if kind not in PROJECTION_KINDS:
+            raise ValueError(f"Unknown projection kind: {kind}")
+        self.kind = kind
+        self.input_bands = input_bands
+        # Linear kinds: output = input @ weight.T + bias, weight is (output_bands, input_bands)
+        self.weight = None if weight is None else np.ascontiguousarray(weight, dtype=np.float32)
+        self.bias = None if bias is None else np.ascontiguousarray(bias, dtype=np.float32)
+        self.band_indices = None if band_indices is None else np.asarray(band_indices, dtype=np.int64)
+        # Band means the PCA was centred on; needed to reconstruct the input
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float64)
+        # Share of the variance kept (PCA only)
+        self.explained_variance = explained_variance
+
+    @property
+    def output_bands(self) -> int:
+        return len(self.band_indices) if self.kind == "bands" else self.weight.shape[0]
+
+    def apply(self, data: np.ndarray) -> np.ndarray:
+        """Projects a (..., input_bands) array to (..., output_bands) float32."""
+        if data.shape[-1] != self.input_bands:
+            raise ValueError(f"Projection expects {self.input_bands} bands, got {data.shape[-1]}")
+        if self.kind == "bands":
+            return np.asarray(data[..., self.band_indices], dtype=np.float32)
+        projected = np.asarray(data, dtype=np.float32) @ self.weight.T
+        if self.bias is not None:
+            projected += self.bias
+        return projected
+
+    def fold_into_conv(self, weight: np.ndarray, bias: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rewrites a first conv trained on all input bands, (out, input_bands, kh, kw), to
+        take the projected bands. PCA inputs are reconstructed as mean + components.T @ y,
+        so trained weights can be reused without retraining (exact away from the zero
+        padded border). Dropped bands of a band subset are treated as zero.
+        """
+        if self.kind == "bands":
+            return weight[:, self.band_indices], bias
+        if self.kind != "pca":
+            raise ValueError("Only PCA and band subset projections can be folded into trained weights")
+        folded = np.einsum("oikl,ci->ockl", weight, self.weight)
+        return folded, bias + np.einsum("oikl,i->o", weight, self.mean)
+
+    def save(self, path: str):
+        """Saves the projection as .npz (no pickled objects)."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {"kind": np.array(self.kind), "input_bands": np.array(self.input_bands)}
+        for name in ("weight", "bias", "band_indices", "mean"):
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        if self.explained_variance is not None:
+            arrays["explained_variance"] = np.array(self.explained_variance)
+        np.savez(path, **arrays)
+        logger.info(f"Saved {self.kind} projection {self.input_bands} -> {self.output_bands} bands to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> "SpectralProjection":
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(
+                kind=str(arrays["kind"]),
+                input_bands=int(arrays["input_bands"]),
+                weight=arrays["weight"] if "weight" in arrays else None,
+                bias=arrays["bias"] if "bias" in arrays else None,
+                band_indices=arrays["band_indices"] if "band_indices" in arrays else None,
+                mean=arrays["mean"] if "mean" in arrays else None,
+                explained_variance=float(arrays["explained_variance"]) if "explained_variance" in arrays else None,
+            )
+
+    @classmethod
+    def fit_pca(cls, cube, components: int, sample_pixels: int = PCA_SAMPLE_PIXELS) -> "SpectralProjection":
+        """
+        Fits PCA on a HyperspectralCube. Evenly spaced rows are read FIT_BLOCK_ROWS at a
+        time and only the band covariance is accumulated, so the cube is never loaded.
+        """
+        bands = cube.bands
+        if not 0 < components <= bands:
+            raise ValueError(f"components must be between 1 and {bands}")
+        row_step = max(1, (cube.height * cube.width) // max(1, sample_pixels) // max(1, cube.width))
+        rows = np.arange(0, cube.height, row_step)
+        count = 0
+        total = np.zeros(bands, dtype=np.float64)
+        gram = np.zeros((bands, bands), dtype=np.float64)
+        for start in range(0, len(rows), FIT_BLOCK_ROWS):
+            block_rows = rows[start:start + FIT_BLOCK_ROWS]
+            block = cube.read_window(int(block_rows[0]), int(block_rows[-1]) + 1)[block_rows - block_rows[0]]
+            pixels = np.asarray(block, dtype=np.float64).reshape(-1, bands)
+            count += len(pixels)
+            total += pixels.sum(axis=0)
+            gram += pixels.T @ pixels
+
+        mean = total / count
+        covariance = (gram - count * np.outer(mean, mean)) / max(1, count - 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        order = np.argsort(eigenvalues)[::-1][:components]
+        weight = eigenvectors[:, order].T
+        kept = float(eigenvalues[order].sum() / max(eigenvalues.sum(), np.finfo(np.float64).tiny))
+        return cls("pca", bands, weight=weight, bias=-weight @ mean, mean=mean, explained_variance=kept)
+
+    @classmethod
+    def from_conv1x1(cls, conv) -> "SpectralProjection":
+        """Wraps a trained nn.Conv2d(input_bands, k, kernel_size=1)."""
+        weight = conv.weight.detach().cpu().numpy()[:, :, 0, 0]
+        bias = None if conv.bias is None else conv.bias.detach().cpu().numpy()
+        return cls("conv1x1", weight.shape[1], weight=weight, bias=bias)
+
+    @classmethod
+    def band_subset(cls, band_indices: Sequence[int], input_bands: int) -> "SpectralProjection":
+        indices = np.asarray(band_indices, dtype=np.int64)
+        if len(indices) == 0 or indices.min() < 0 or indices.max() >= input_bands:
+            raise ValueError(f"Band indices must be between 0 and {input_bands - 1}")
+        return cls("bands", input_bands, band_indices=indices)
+
+
+def fold_state_dict(state_dict: dict, projection: SpectralProjection) -> dict:
+    """SpatialRiskCNN weights trained on all bands, rewritten for the projected input (see fold_into_conv)."""
+    import torch
+    folded = dict(state_dict)
+    weight, bias = projection.fold_into_conv(state_dict["conv_layers.0.weight"].cpu().numpy().astype(np.float64),
+                                             state_dict["conv_layers.0.bias"].cpu().numpy().astype(np.float64))
+    folded["conv_layers.0.weight"] = torch.from_numpy(weight.astype(np.float32))
+    folded["conv_layers.0.bias"] = torch.from_numpy(bias.astype(np.float32))
+    return folded
+
+
+def benchmark(cube_path: str, component_counts: Sequence[int]):
+    """
+    Times risk detection on a cube with PCA projections of several sizes and
+    compares each against the full-band model. The reduced models reuse the full
+    model's weights folded through the projection (no retraining), so agreement
+    shows what each component count loses.
+    """
+    import torch
+    from . import risk_detector as rd
+    from .hyperspectral_cube import open_cube
+    from .process_runtime import configure_torch_threads
+
+    configure_torch_threads()
+    with open_cube(cube_path) as cube:
+        data = np.asarray(cube.read(), dtype=np.float32)
+        projections = {k: SpectralProjection.fit_pca(cube, k) for k in component_counts}
+    print(f"{cube_path}: {data.shape[0]}x{data.shape[1]}x{data.shape[2]}")
+
+    torch.manual_seed(0)
+    reference = rd.RiskDetector()
+    if not os.path.exists(rd.RISK_MODEL_PATH):
+        print("  (no weights at KRISHI_RISK_MODEL_PATH; using random weights)")
+    elif os.path.exists(projection_path_for(rd.RISK_MODEL_PATH)):
+        print("  (the weights at KRISHI_RISK_MODEL_PATH have a projection, so they are not full-band; "
+              "using random weights)")
+    else:
+        reference = rd.RiskDetector(rd.RISK_MODEL_PATH)
+    full_state = {name: value.detach().clone() for name, value in reference.model.state_dict().items()}
+
+    def timed(detector) -> Tuple[dict, float]:
+        detector.detect_risk_zones(data[:64, :64])  # warm-up
+        start = time.perf_counter()
+        result = detector.detect_risk_zones(data)
+        return result, time.perf_counter() - start
+
+    base, base_seconds = timed(reference)
+    print(f"  {'bands':>6} {'variance':>9} {'seconds':>8} {'speedup':>8} {'map agree':>10} {'conf diff':>10} {'overall':>8}")
+    print(f"  {data.shape[2]:>6} {1.0:>9.4f} {base_seconds:>8.2f} {1.0:>8.2f} {1.0:>10.4f} {0.0:>10.4f} {'same':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for k, projection in projections.items():
+            model_path = os.path.join(tmp, f"risk_model_pca{k}.pth")
+            torch.save(fold_state_dict(full_state, projection), model_path)
+            projection.save(projection_path_for(model_path))
+            result, seconds = timed(rd.RiskDetector(model_path))
+            agree = float((result["risk_map"] == base["risk_map"]).mean())
+            conf_diff = float(np.abs(result["confidence_map"] - base["confidence_map"]).mean())
+            same = "same" if result["overall_prediction"] == base["overall_prediction"] else "differs"
+            print(f"  {k:>6} {projection.explained_variance:>9.4f} {seconds:>8.2f} {base_seconds / seconds:>8.2f} "
+                  f"{agree:>10.4f} {conf_diff:>10.4f} {same:>8}")
+
+
+if __name__ == "__main__":
+    # Usage (from the backend directory):
+    #   python -m app.core.spectral_projection fit-pca <cube> <components> <model_path>
+    #   python -m app.core.spectral_projection bands <input_bands> <i,j,...> <model_path>
+    #   python -m app.core.spectral_projection fold <model_path> <output_model_path>
+    #   python -m app.core.spectral_projection benchmark <cube> [components ...]
+    # The projection is written next to <model_path> (see projection_path_for).
+    # "fold" rewrites full-band weights for the projection saved next to <output_model_path>.
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "fit-pca" and len(sys.argv) == 5:
+        from .hyperspectral_cube import open_cube
+        with open_cube(sys.argv[2]) as cube:
+            fitted = SpectralProjection.fit_pca(cube, int(sys.argv[3]))
+        fitted.save(projection_path_for(sys.argv[4]))
+        print(f"Explained variance: {fitted.explained_variance:.4f}")
+    elif command == "bands" and len(sys.argv) == 5:
+        indices = [int(i) for i in sys.argv[3].split(",")]
+        SpectralProjection.band_subset(indices, int(sys.argv[2])).save(projection_path_for(sys.argv[4]))
+    elif command == "fold" and len(sys.argv) == 4:
+        import torch
+        from .process_runtime import load_weights
+        fitted = SpectralProjection.load(projection_path_for(sys.argv[3]))
+        torch.save(fold_state_dict(load_weights(sys.argv[2], map_location="cpu"), fitted), sys.argv[3])
+        print(f"Saved {fitted.output_bands}-band weights to {sys.argv[3]}")
+    elif command == "benchmark" and len(sys.argv) >= 3:
+        benchmark(sys.argv[2], [int(k) for k in sys.argv[3:]] or [8, 16, 32, 64, 128])
+    else:
+        print("Usage: python -m app.core.spectral_projection fit-pca|bands|fold|benchmark ... (see the module)")
+        sys.exit(1)
@@ -0,0 +1,196 @@
+# backend/app/core/tiled_analysis.py
+
+import json
+import logging
+import os
+import warnings
+from typing import List
+
+import cv2
+import numpy as np
+import rasterio
+import torch
+from rasterio.enums import Resampling
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.windows import Window
+
+from .ai_predictor import predict_batch, RECOMMENDATION_MAP, _find_upload
+from .image_processor import IMAGE_SIZE, NORMALIZE_MEAN, _NORMALIZE_SCALE, _NORMALIZE_OFFSET
+from .model_loader import get_active, get_class_names
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Side of each square tile in source pixels (tiles are resized to the model input if different)
+TILE_SIZE = int(os.environ.get("KRISHI_TILE_SIZE", "224"))
+# Pixels shared by neighbouring tiles
+TILE_OVERLAP = int(os.environ.get("KRISHI_TILE_OVERLAP", "32"))
+# Tiles run through the model together
+TILE_BATCH_SIZE = int(os.environ.get("KRISHI_TILE_BATCH_SIZE", "32"))
+# Longest side of the rendered overlay image
+OVERLAY_MAX_SIZE = 2048
+OVERLAY_ALPHA = 0.45
+HEALTHY_COLOR = (0, 160, 0)
+DISEASED_COLOR = (220, 20, 60)
+# Padding for edge tiles; normalizes to zero
+MEAN_PIXEL = np.array([round(m * 255) for m in NORMALIZE_MEAN], dtype=np.uint8).reshape(3, 1, 1)
+
+
+def get_tiles_result_path(upload_id: str) -> str:
+    """Returns the path where the tiled analysis result for an upload is stored."""
+    return os.path.join("data", "results", f"{upload_id}_tiles.json")
+
+
+def get_tiles_overlay_path(upload_id: str) -> str:
+    """Returns the path of the rendered tile overlay for an upload."""
+    return os.path.join("data", "results", f"{upload_id}_tiles.jpg")
+
+
+def tile_starts(length: int, tile_size: int, stride: int) -> List[int]:
+    """Start offsets of tiles along one axis; the last tile is aligned with the image edge."""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] != length - tile_size:
+        starts.append(length - tile_size)
+    return starts
+
+
+def _rgb_bands(src) -> List[int]:
+    """Band indexes holding R, G and B (a single-band image is repeated)."""
+    return [1, 2, 3] if src.count >= 3 else [1, 1, 1]
+
+
+def _to_uint8(data: np.ndarray) -> np.ndarray:
+    """Scales 16-bit or float rasters to uint8; uint8 data is returned as is."""
+    if data.dtype == np.uint8:
+        return data
+    if np.issubdtype(data.dtype, np.integer):
+        return (data.astype(np.float32) * (255.0 / np.iinfo(data.dtype).max)).astype(np.uint8)
+    return (np.clip(data, 0.0, 1.0) * 255.0).astype(np.uint8)
+
+
+def _normalize_batch(tiles: np.ndarray) -> torch.Tensor:
+    """Turns a (N, 3, T, T) uint8 batch into the normalized model input."""
+    batch = torch.from_numpy(tiles).float()
+    if batch.shape[-2:] != IMAGE_SIZE:
+        batch = torch.nn.functional.interpolate(batch, size=IMAGE_SIZE, mode="bilinear", antialias=True, align_corners=False)
+    return batch.mul_(_NORMALIZE_SCALE).sub_(_NORMALIZE_OFFSET)
+
+
+def _render_overlay(src, xs: List[int], ys: List[int], tile_size: int,
+                    class_grid: np.ndarray, healthy: np.ndarray) -> np.ndarray:
+    """
+    Renders a downsampled preview of the image with each tile tinted green
+    (healthy) or red (diseased). Each preview pixel takes the tile whose centre
+    is nearest, so overlapping tiles don't blend.
+    """
+    scale = min(1.0, OVERLAY_MAX_SIZE / max(src.width, src.height))
+    preview_h, preview_w = max(1, round(src.height * scale)), max(1, round(src.width * scale))
+    # GDAL reads the preview block by block (or from overviews), never the full image at once
+    preview = _to_uint8(src.read(_rgb_bands(src), out_shape=(3, preview_h, preview_w), resampling=Resampling.average))
+    preview = preview.transpose(1, 2, 0).astype(np.float32)
+
+    def nearest_tile(starts: List[int], count: int) -> np.ndarray:
+        centres = np.asarray(starts, dtype=np.float64) + tile_size / 2.0
+        positions = (np.arange(count) + 0.5) / scale
+        return np.searchsorted((centres[:-1] + centres[1:]) / 2.0, positions)
+
+    tile_rows = nearest_tile(ys, preview_h)
+    tile_cols = nearest_tile(xs, preview_w)
+    colors = np.where(healthy[class_grid][..., None], HEALTHY_COLOR, DISEASED_COLOR).astype(np.float32)
+    tint = colors[tile_rows[:, None], tile_cols[None, :]]
+    return (preview * (1.0 - OVERLAY_ALPHA) + tint * OVERLAY_ALPHA).astype(np.uint8)
+
+
+def run_tiled_analysis(upload_id: str, tile_size: int = TILE_SIZE, overlap: int = TILE_OVERLAP) -> dict:
+    """
+    Analyzes a large RGB image (e.g. a stitched field orthomosaic) tile by tile.
+    The image is read one strip of tiles at a time and tiles are run through the
+    model in batches of TILE_BATCH_SIZE, so memory depends on the image width and
+    batch size, not on the image area. Returns a per-tile class/confidence grid,
+    a per-class summary and the path of a rendered overlay, and saves the result as JSON.
+    """
+    try:
+        image_path = _find_upload(upload_id)
+        stride = max(1, tile_size - overlap)
+        class_names = get_class_names()
+        healthy = np.array([name.endswith("healthy") for name in class_names])
+
+        with warnings.catch_warnings():
+            # Plain JPEG/PNG uploads have no georeferencing
+            warnings.simplefilter("ignore", NotGeoreferencedWarning)
+            with rasterio.open(image_path) as src:
+                ys = tile_starts(src.height, tile_size, stride)
+                xs = tile_starts(src.width, tile_size, stride)
+                logger.info(f"Tiled analysis of {upload_id}: {src.width}x{src.height} px, {len(ys)}x{len(xs)} tiles")
+                class_grid = np.zeros((len(ys), len(xs)), dtype=np.int64)
+                confidence_grid = np.zeros((len(ys), len(xs)), dtype=np.float32)
+                # Every tile of the scene runs on the same model version, even if another is activated mid-scan
+                loaded = get_active()
+
+                batch = np.empty((TILE_BATCH_SIZE, 3, tile_size, tile_size), dtype=np.uint8)
+                positions = []
+
+                def flush():
+                    confidences, indices, _, _ = predict_batch(_normalize_batch(batch[:len(positions)]), loaded)
+                    rows, cols = zip(*positions)
+                    class_grid[rows, cols] = indices.numpy()
+                    confidence_grid[rows, cols] = confidences.numpy()
+                    positions.clear()
+
+                for r, y in enumerate(ys):
+                    strip_height = min(tile_size, src.height - y)
+                    strip = _to_uint8(src.read(_rgb_bands(src), window=Window(0, y, src.width, strip_height)))
+                    for c, x in enumerate(xs):
+                        crop = strip[:, :, x:x + tile_size]
+                        tile = batch[len(positions)]
+                        if crop.shape[1:] != (tile_size, tile_size):
+                            # Image smaller than a tile: pad with the mean colour
+                            tile[:] = MEAN_PIXEL
+                        tile[:, :crop.shape[1], :crop.shape[2]] = crop
+                        positions.append((r, c))
+                        if len(positions) == TILE_BATCH_SIZE:
+                            flush()
+                if positions:
+                    flush()
+
+                overlay = _render_overlay(src, xs, ys, tile_size, class_grid, healthy)
+                width, height = src.width, src.height
+
+        overlay_path = get_tiles_overlay_path(upload_id)
+        os.makedirs(os.path.dirname(overlay_path), exist_ok=True)
+        cv2.imwrite(overlay_path, cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
+
+        counts = np.bincount(class_grid.ravel(), minlength=len(class_names))
+        class_counts = {class_names[i]: int(n) for i, n in enumerate(counts) if n > 0}
+        result = {
+            "upload_id": upload_id,
+            "image_width": width,
+            "image_height": height,
+            "tile_size": tile_size,
+            "stride": stride,
+            "rows": len(ys),
+            "cols": len(xs),
+            "class_names": class_names,
+            "class_grid": class_grid.tolist(),
+            "confidence_grid": np.round(confidence_grid.astype(np.float64), 4).tolist(),
+            "class_counts": class_counts,
+            "diseased_fraction": float((~healthy[class_grid]).mean()),
+            "recommendations": {
+                name: RECOMMENDATION_MAP.get(name, "Consult an agricultural expert for specific treatment.")
+                for name in class_counts if not name.endswith("healthy")
+            },
+            "overlay_path": overlay_path,
+            "model_version": loaded.version,
+        }
+
+        result_path = get_tiles_result_path(upload_id)
+        with open(result_path, 'w') as f:
+            json.dump(result, f)
+        logger.info(f"Tiled analysis result saved for upload_id {upload_id} at {result_path}")
+        return result
+
+    except Exception as e:
+        logger.error(f"Error during tiled analysis for upload_id {upload_id}: {e}")
+        raise
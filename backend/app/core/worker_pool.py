@@ -0,0 +1,71 @@
+# backend/app/core/worker_pool.py
+
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from .process_runtime import CORES_PER_WORKER
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Number of threads running CPU-bound work (torch inference, cube loading, image writes).
+# torch and numpy release the GIL in their kernels, so threads scale across cores.
+# Defaults to this server process's share of the cores.
+MAX_WORKERS = int(os.environ.get("KRISHI_WORKER_THREADS", str(CORES_PER_WORKER)))
+# Number of jobs allowed to wait for a free worker before new jobs are rejected
+MAX_QUEUE_DEPTH = int(os.environ.get("KRISHI_WORKER_QUEUE_DEPTH", "64"))
+
+
+class WorkerPoolFullError(RuntimeError):
+    """Raised when the worker pool already has the maximum number of queued jobs."""
+    pass
+
+
+class WorkerPool:
+    """
+    Bounded thread pool that runs blocking work off the FastAPI event loop,
+    so that slow analyses don't stall other requests (including /health).
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_queue_depth: int = MAX_QUEUE_DEPTH):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_depth = max(0, max_queue_depth)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="krishi-worker")
+        # Jobs submitted and not yet finished (running + waiting). Only touched from the event loop.
+        self._pending = 0
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Runs fn(*args, **kwargs) on a worker thread and waits for the result.
+        Raises WorkerPoolFullError if the queue is already at its maximum depth.
+        """
+        if self._pending >= self.max_workers + self.max_queue_depth:
+            raise WorkerPoolFullError(
+                f"Worker pool is full ({self._pending} jobs pending, limit {self.max_workers + self.max_queue_depth})"
+            )
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the current load of the pool."""
+        return {
+            "max_workers": self.max_workers,
+            "max_queue_depth": self.max_queue_depth,
+            "pending": self._pending,
+        }
+
+    def shutdown(self, wait: bool = True):
+        """Stops the worker threads. Called when the application shuts down."""
+        logger.info("Shutting down worker pool")
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+# Initialize the shared worker pool
+worker_pool = WorkerPool()
@@ -1,19 +1,43 @@
 # backend/app/main.py
 
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware # For allowing frontend requests
-from app.api.routes import upload, analysis, spectral, sensors # Import your route modules
+from app.api.routes import upload, analysis, spectral, sensors, admin, jobs # Import your route modules
+from app.core.worker_pool import worker_pool
+from app.core.job_queue import job_queue
+from app.core.analysis_pipeline import analysis_pipeline
+from app.core import model_loader
+from app.core.process_runtime import configure_torch_threads
+from contextlib import asynccontextmanager
 import logging
 
 # --- Logging Configuration ---
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# --- Application Lifespan ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Each server process gets its share of the cores, so N workers don't oversubscribe the machine
+    configure_torch_threads()
+    # Load and warm up the model in the background so startup stays fast;
+    # /ready reports when this worker can take traffic
+    model_loader.start_background_warmup()
+    # Start the workers that run queued risk/spectral analysis jobs
+    job_queue.start()
+    yield
+    # Stop the worker threads that run CPU-bound analyses
+    job_queue.shutdown()
+    worker_pool.shutdown(wait=False)
+    analysis_pipeline.shutdown()
+
 # --- FastAPI App Instance ---
 app = FastAPI(
     title="KrishiDrishti AI Backend",
     description="API for AI-powered crop health analysis using hyperspectral and RGB data.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # --- CORS Middleware (Update origins for production) ---
@@ -32,6 +56,8 @@ api_router.include_router(upload.router, prefix="/api", tags=["upload"])
 api_router.include_router(analysis.router, prefix="/api", tags=["analysis"])
 api_router.include_router(spectral.router, prefix="/api", tags=["spectral"])
 api_router.include_router(sensors.router, prefix="/api", tags=["sensors"])
+api_router.include_router(admin.router, prefix="/api", tags=["admin"])
+api_router.include_router(jobs.router, prefix="/api", tags=["jobs"])
 
 # --- Root Endpoint ---
 @app.get("/")
@@ -43,6 +69,16 @@ def read_root():
 def health_check():
     return {"status": "healthy", "message": "API is running"}
 
+# --- Readiness Probe ---
+# Unlike /health, this only succeeds once the model is loaded and warmed up,
+# so load balancers send traffic to warm workers only.
+@app.get("/ready")
+def readiness_check():
+    status = model_loader.get_status()
+    if status["status"] != "ready":
+        return JSONResponse(status_code=503, content=status)
+    return status
+
 # --- Main Entry Point (for Uvicorn) ---
 # This allows running the app directly with `uvicorn app.main:app --reload`
 if __name__ == "__main__":
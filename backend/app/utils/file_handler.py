@@ -3,6 +3,8 @@
 import os
 from fastapi import UploadFile
 import aiofiles # For async file operations
+import asyncio
+import hashlib
 import json
 import logging
 
@@ -12,6 +14,8 @@ logger = logging.getLogger(__name__)
 UPLOAD_DIR = os.path.join("data", "uploads")
 RESULTS_DIR = os.path.join("data", "results")
 
+HASH_CHUNK_SIZE = 1024 * 1024
+
 # Ensure directories exist
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(RESULTS_DIR, exist_ok=True)
@@ -29,9 +33,44 @@ async def save_upload_file(file: UploadFile, upload_id: str) -> str:
         content = await file.read() # Read file content asynchronously
         await buffer.write(content) # Write content asynchronously
 
+    # Record the content hash while the bytes are in memory, so caches keyed by
+    # content never have to read the file again
+    digest = await asyncio.to_thread(lambda: hashlib.sha256(content).hexdigest())
+    _write_content_hash(file_path, digest)
+
     logger.info(f"Saved uploaded file to {file_path}")
     return file_path
 
+def _content_hash_path(file_path: str) -> str:
+    return f"{file_path}.sha256"
+
+def _write_content_hash(file_path: str, digest: str):
+    try:
+        with open(_content_hash_path(file_path), 'w') as f:
+            f.write(digest)
+    except OSError as e:
+        logger.warning(f"Could not record the content hash of {file_path}: {e}")
+
+def file_content_hash(file_path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a file's bytes. The digest is kept next to
+    the file in {file_path}.sha256 (written on upload), so each file is hashed once;
+    a recorded digest older than the file is recomputed.
+    """
+    hash_path = _content_hash_path(file_path)
+    try:
+        if os.path.getmtime(hash_path) >= os.path.getmtime(file_path):
+            with open(hash_path, 'r') as f:
+                return f.read().strip()
+    except OSError:
+        pass
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    _write_content_hash(file_path, digest.hexdigest())
+    return digest.hexdigest()
+
 def get_upload_file_path(upload_id: str) -> str:
     """
     Constructs the expected path for an uploaded file based on its ID.
@@ -47,7 +86,8 @@ def get_upload_file_path(upload_id: str) -> str:
     # If not found with common extensions, look for files that start with upload_id
     # This handles cases where the file was saved with the upload_id as the filename
     for filename in os.listdir(UPLOAD_DIR):
-        if filename.startswith(upload_id):
+        # Skip the recorded content hashes that sit next to uploads
+        if filename.startswith(upload_id) and not filename.endswith(".sha256"):
             path = os.path.join(UPLOAD_DIR, filename)
             if os.path.exists(path):
                 return path
@@ -76,6 +116,26 @@ def load_result_json(upload_id: str) -> dict:
 
     return result_data
 
+def load_manifest_ids(manifest_path: str) -> list:
+    """
+    Reads upload IDs from a manifest file inside the data directory.
+    The manifest is either a JSON list of IDs or plain text with one ID per line.
+    """
+    data_dir = os.path.realpath("data")
+    full_path = os.path.realpath(os.path.join(data_dir, manifest_path))
+    # Refuse paths that escape the data directory
+    if os.path.commonpath([data_dir, full_path]) != data_dir:
+        raise ValueError(f"Manifest path must be inside the data directory: {manifest_path}")
+    if not os.path.isfile(full_path):
+        raise FileNotFoundError(f"Manifest file not found: {manifest_path}")
+
+    with open(full_path, 'r') as f:
+        content = f.read()
+
+    if content.lstrip().startswith("["):
+        return [str(upload_id).strip() for upload_id in json.loads(content)]
+    return [line.strip() for line in content.splitlines() if line.strip()]
+
 # Optional: Function to clean up old files (e.g., after 24 hours)
 # This could be run periodically by a background task scheduler like Celery.
 def cleanup_old_files(directory: str, hours_old: int = 24):
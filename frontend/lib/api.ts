@@ -20,13 +20,28 @@ export type SpectralAnalysisResult = {
   };
   indices: {
     [key: string]: {
-      min: number;
-      max: number;
-      mean: number;
-      data: number[];
+      count: number;
+      invalid_count: number;
+      min: number | null;
+      max: number | null;
+      mean: number | null;
+      std: number | null;
+      percentiles: { [key: string]: number | null } | null;
+      histogram: {
+        edges: number[];
+        counts: number[];
+        below: number;
+        above: number;
+      };
+      sample?: {
+        stride: number;
+        shape: number[];
+        values: (number | null)[][];
+      };
     };
   };
   health_map_path?: string;
+  index_rasters?: { [key: string]: string };
   timestamp: string;
 };
 